@@ -0,0 +1,173 @@
+"""
+AnalysisCache.py
+====================================
+The module that defines AnalysisCache.
+
+"""
+import json
+import os
+import sqlite3
+from odyssey.utils.cache_dir import get_cache_dir
+
+
+class AnalysisCache:
+    """AnalysisCache stores the facts analyzers extract from a file (import
+    records, instantiation keyword/value pairs), keyed by the BigQuery file id
+    and the analyzer version, so that files are only parsed once. The cache is
+    a SQLite file with a size cap; the least recently used facts are evicted
+    first."""
+
+    def __init__(self, path=None, max_size=2 ** 30):
+        """Initialize the AnalysisCache. The file is only created when the
+        cache is first used.
+
+        Parameters
+        ----------
+        path : string or None, optional (default=None)
+            Path of the SQLite file. ":memory:" keeps the cache in memory.
+            If None, analysis.sqlite in the per-user cache directory is used,
+            see odyssey.utils.cache_dir.
+
+        max_size : int, optional (default=2 ** 30)
+            Maximum size of the stored facts in bytes.
+
+        Returns
+        -------
+
+        object
+            returns an initialized AnalysisCache object.
+
+        """
+        if path is None:
+            path = os.path.join(get_cache_dir(), "analysis.sqlite")
+        self.path = path
+        self.max_size = max_size
+        self._connection = None
+        self._size = 0
+        self._clock = 0
+        self._pending = 0
+
+    def get(self, file_id, key):
+        """Get the facts stored for a file.
+
+        Parameters
+        ----------
+        file_id : string
+            BigQuery file id.
+
+        key : string
+            Kind and version of the facts, as given by the analyzer's
+            fact_key.
+
+        Returns
+        -------
+        list or None
+            returns the stored facts, or None if they are not cached.
+
+        """
+        connection = self._connect()
+        row = connection.execute(
+            "SELECT facts FROM facts WHERE file_id = ? AND key = ?",
+            (file_id, key)).fetchone()
+        if row is None:
+            return None
+        connection.execute(
+            "UPDATE facts SET last_used = ? WHERE file_id = ? AND key = ?",
+            (self._tick(), file_id, key))
+        self._written()
+        return json.loads(row[0])
+
+    def set(self, file_id, key, facts):
+        """Store the facts of a file, evicting the least recently used facts
+        if the cache grows over max_size.
+
+        Parameters
+        ----------
+        file_id : string
+            BigQuery file id.
+
+        key : string
+            Kind and version of the facts, as given by the analyzer's
+            fact_key.
+
+        facts : list
+            JSON serializable facts.
+
+        """
+        connection = self._connect()
+        value = json.dumps(facts, separators=(',', ':'))
+        old = connection.execute(
+            "SELECT size FROM facts WHERE file_id = ? AND key = ?",
+            (file_id, key)).fetchone()
+        if old is not None:
+            self._size -= old[0]
+        connection.execute(
+            "INSERT OR REPLACE INTO facts VALUES (?, ?, ?, ?, ?)",
+            (file_id, key, value, len(value), self._tick()))
+        self._size += len(value)
+        if self._size > self.max_size:
+            self._evict()
+        self._written()
+
+    def flush(self):
+        """Commit pending writes to disk."""
+        if self._connection is not None:
+            self._connection.commit()
+            self._pending = 0
+
+    def clear(self):
+        """Remove everything in the cache."""
+        self._connect().execute("DELETE FROM facts")
+        self._size = 0
+        self.flush()
+
+    def __len__(self):
+        """Number of stored facts."""
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM facts").fetchone()[0]
+
+    def __getstate__(self):
+        """Pickle the location and size cap only, not the connection."""
+        return {"path": self.path, "max_size": self.max_size}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _connect(self):
+        if self._connection is None:
+            if self.path != ":memory:" and os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._connection = sqlite3.connect(self.path, timeout=60)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS facts (file_id TEXT, key TEXT, "
+                "facts TEXT, size INTEGER, last_used INTEGER, "
+                "PRIMARY KEY (file_id, key))")
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS facts_last_used "
+                "ON facts (last_used)")
+            self._size, self._clock = self._connection.execute(
+                "SELECT COALESCE(SUM(size), 0), COALESCE(MAX(last_used), 0) "
+                "FROM facts").fetchone()
+        return self._connection
+
+    def _tick(self):
+        self._clock += 1
+        return self._clock
+
+    def _written(self):
+        self._pending += 1
+        if self._pending >= 1000:
+            self.flush()
+
+    def _evict(self):
+        # Evict down to 90% of max_size so eviction does not run on every set.
+        target = self.max_size * 0.9
+        evicted = []
+        for rowid, size in self._connection.execute(
+                "SELECT rowid, size FROM facts ORDER BY last_used"):
+            if self._size <= target:
+                break
+            evicted.append((rowid,))
+            self._size -= size
+        self._connection.executemany("DELETE FROM facts WHERE rowid = ?",
+                                     evicted)
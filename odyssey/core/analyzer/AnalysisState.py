@@ -0,0 +1,224 @@
+"""
+AnalysisState.py
+====================================
+The module that defines AnalysisState.
+
+"""
+import json
+import os
+import pickle
+import sqlite3
+from ..bigquery.BigQueryGithubEntry import BigQueryGithubEntry
+
+
+class AnalysisState:
+    """AnalysisState remembers the files an analysis has seen, the facts
+    extracted from each of them and the analyzers they were added to, so that
+    the analysis can be refreshed when the tables change: only new files are
+    fetched and parsed, and the facts of files that are gone are removed from
+    the analyzers.
+
+    The state is a SQLite file. Given to an AnalyzerPipeline as its cache, it
+    records the facts of every file the pipeline sees; facts it does not have
+    are looked up in (and stored to) the wrapped AnalysisCache, if any."""
+
+    def __init__(self, path, cache=None):
+        """Initialize the AnalysisState. The file is only created when the
+        state is first used.
+
+        Parameters
+        ----------
+        path : string
+            Path of the SQLite file. ":memory:" keeps the state in memory.
+
+        cache : AnalysisCache or None, optional (default=None)
+            Cache of the facts shared with other analyses.
+
+        Returns
+        -------
+
+        object
+            returns an initialized AnalysisState object.
+
+        """
+        self.path = path
+        self.cache = cache
+        self._connection = None
+
+    def get(self, file_id, key):
+        """Get the facts of a file, from the state or the wrapped cache. Facts
+        found in the cache are recorded in the state."""
+        row = self._connect().execute(
+            "SELECT facts FROM facts WHERE file_id = ? AND key = ?",
+            (file_id, key)).fetchone()
+        if row is not None:
+            return json.loads(row[0])
+        if self.cache is None:
+            return None
+        facts = self.cache.get(file_id, key)
+        if facts is not None:
+            self._set(file_id, key, facts)
+        return facts
+
+    def set(self, file_id, key, facts):
+        """Record the facts of a file, and store them in the wrapped cache."""
+        self._set(file_id, key, facts)
+        if self.cache is not None:
+            self.cache.set(file_id, key, facts)
+
+    def flush(self):
+        """Commit pending writes to disk."""
+        if self._connection is not None:
+            self._connection.commit()
+        if self.cache is not None:
+            self.cache.flush()
+
+    def add_entries(self, entries):
+        """Record the files being analyzed.
+
+        Parameters
+        ----------
+        entries : iterable of BigQueryGithubEntry
+            Entries to be recorded.
+
+        Returns
+        -------
+        generator
+            Yields the entries, once they are recorded.
+
+        """
+        connection = self._connect()
+        for entry in entries:
+            connection.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?)",
+                (entry.id, entry.repo_name, entry.path))
+            yield entry
+
+    def diff(self, ids):
+        """Compare the ids of the files in the tables to the recorded files.
+
+        Parameters
+        ----------
+        ids : iterable of string
+            Ids of the files currently in the tables.
+
+        Returns
+        -------
+        tuple
+            returns the list of new ids and the list of recorded ids that are
+            not in ids anymore.
+
+        """
+        connection = self._connect()
+        connection.execute("CREATE TEMP TABLE IF NOT EXISTS current_ids "
+                           "(id TEXT PRIMARY KEY)")
+        connection.execute("DELETE FROM current_ids")
+        connection.executemany("INSERT OR IGNORE INTO current_ids VALUES (?)",
+                               ((_id,) for _id in ids))
+        new = [_id for _id, in connection.execute(
+            "SELECT current_ids.id FROM current_ids LEFT JOIN files "
+            "ON files.id = current_ids.id WHERE files.id IS NULL")]
+        removed = [_id for _id, in connection.execute(
+            "SELECT files.id FROM files LEFT JOIN current_ids "
+            "ON current_ids.id = files.id WHERE current_ids.id IS NULL")]
+        connection.execute("DELETE FROM current_ids")
+        return new, removed
+
+    def pop_entries(self, ids):
+        """Forget files, returning what was recorded about them.
+
+        Parameters
+        ----------
+        ids : list of string
+            Ids of the files to forget.
+
+        Returns
+        -------
+        list
+            returns a list of (entry, facts) tuples, where entry is a
+            BigQueryGithubEntry without code and facts maps each fact key to
+            the facts of the file.
+
+        """
+        connection = self._connect()
+        popped = []
+        for _id in ids:
+            row = connection.execute(
+                "SELECT repo_name, path FROM files WHERE id = ?",
+                (_id,)).fetchone()
+            if row is None:
+                continue
+            facts = {key: json.loads(value) for key, value in
+                     connection.execute(
+                         "SELECT key, facts FROM facts WHERE file_id = ?",
+                         (_id,))}
+            popped.append((BigQueryGithubEntry(_id, None, *row), facts))
+            connection.execute("DELETE FROM files WHERE id = ?", (_id,))
+            connection.execute("DELETE FROM facts WHERE file_id = ?", (_id,))
+        return popped
+
+    def load_analyzers(self, config):
+        """Get the analyzers saved for config, or None if there are none.
+
+        Parameters
+        ----------
+        config : string
+            Description of the analysis (package, filter, accepted lists).
+            If the saved analyzers were made for another config, the state is
+            cleared.
+
+        Returns
+        -------
+        object or None
+            returns the saved analyzers.
+
+        """
+        row = self._connect().execute(
+            "SELECT config, analyzers FROM analyzers").fetchone()
+        if row is None:
+            return None
+        if row[0] != config:
+            self.clear()
+            return None
+        return pickle.loads(row[1])
+
+    def save_analyzers(self, config, analyzers):
+        """Save the analyzers of the analysis described by config."""
+        connection = self._connect()
+        connection.execute("DELETE FROM analyzers")
+        connection.execute("INSERT INTO analyzers VALUES (?, ?)",
+                           (config, pickle.dumps(analyzers)))
+        self.flush()
+
+    def clear(self):
+        """Forget all files, facts and analyzers."""
+        connection = self._connect()
+        for table in ("files", "facts", "analyzers"):
+            connection.execute("DELETE FROM %s" % table)
+        self.flush()
+
+    def __len__(self):
+        """Number of recorded files."""
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def _set(self, file_id, key, facts):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO facts VALUES (?, ?, ?)",
+            (file_id, key, json.dumps(facts, separators=(',', ':'))))
+
+    def _connect(self):
+        if self._connection is None:
+            if self.path != ":memory:" and os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._connection = sqlite3.connect(self.path, timeout=60)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS files (id TEXT PRIMARY KEY, "
+                "repo_name TEXT, path TEXT)")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS facts (file_id TEXT, key TEXT, "
+                "facts TEXT, PRIMARY KEY (file_id, key))")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS analyzers (config TEXT, "
+                "analyzers BLOB)")
+        return self._connection
@@ -0,0 +1,303 @@
+"""
+AnalyzerPipeline.py
+====================================
+The module that defines AnalyzerPipeline.
+
+"""
+from collections import defaultdict
+from itertools import islice
+from odyssey.utils.parse import parso_parse
+from ..bigquery.BigQueryGithubEntry import BigQueryGithubEntry
+from ..bigquery.BlobStore import BlobEntry
+
+
+class AnalyzerPipeline:
+    """AnalyzerPipeline parses each entry once and feeds every node of the
+    parso tree to all the analyzers that are interested in it.
+
+    Analyzers work in two steps: while the tree is walked, they extract facts
+    about the file (e.g. its import records), then the facts are added to
+    their counters. Analyzers that need the same facts share a ``fact_key``,
+    and the facts are only extracted once for all of them. If a cache is
+    given, facts are looked up by file id first and files whose facts are all
+    cached are not parsed at all. Analyzers that only need import records
+    get them from a fast import scanner instead of a parso tree. Analyzers
+    that scan for names (``leaf_names``) share one index of the name leaves
+    of each file, built only if one of them falls back to a parso tree."""
+
+    def __init__(self, analyzers, n_jobs=1, batch_size=1000, cache=None,
+                 fast_scan=True, verbose=0):
+        """Initialize the AnalyzerPipeline.
+
+        Parameters
+        ----------
+        analyzers: list
+            Analyzers to be run (ImportAnalyzer, RepoImportCounter,
+            InstantiationAnalyzer). Each analyzer declares the parso node
+            types it wants in its ``node_types`` attribute, and the values of
+            the name leaves it wants in its ``leaf_names`` attribute, if any.
+
+        n_jobs : int, optional (default=1)
+            The number of worker processes used to parse entries, as in
+            joblib. -1 means using all processors. With 1, entries are parsed
+            in the current process.
+
+        batch_size : int, optional (default=1000)
+            The number of entries sent to a worker process at a time. Only
+            used when n_jobs is not 1.
+
+        cache : AnalysisCache or None, optional (default=None)
+            Cache of the facts extracted from each file.
+
+        fast_scan : bool, optional (default=True)
+            If True, analyzers that provide a ``_scan`` method (such as
+            ImportAnalyzer and RepoImportCounter) extract their facts without
+            parso, and files are only parsed for the other analyzers.
+
+        verbose : int, optional (default=0)
+            If larger than 0, print the number of entries parsed every 1000
+            entries.
+
+        Returns
+        -------
+
+        object
+            returns an initialized AnalyzerPipeline object.
+
+        """
+        self.analyzers = list(analyzers)
+        self.n_jobs = n_jobs
+        self.batch_size = batch_size
+        self.cache = cache
+        self.fast_scan = fast_scan
+        self.verbose = verbose
+        self._groups = {}
+        for analyzer in self.analyzers:
+            self._groups.setdefault(analyzer.fact_key, []).append(analyzer)
+        # One analyzer per fact_key extracts the facts for the whole group.
+        self._extractors = {key: group[0]._empty_copy()
+                            for key, group in self._groups.items()}
+
+    def parse(self, entry):
+        """Parse a BigQueryGithubEntry once for all analyzers.
+
+        Parameters
+        ----------
+        entry: BigQueryGithubEntry
+            A BigQueryGithubEntry to be parsed
+
+        """
+        facts, missing = self._lookup(entry)
+        if missing:
+            extracted = _extract(self._extractors, missing, entry.code,
+                                 self.fast_scan)
+            self._store(entry, extracted)
+            facts.update(extracted)
+        self._add_facts(entry, facts)
+
+    def run(self, entries):
+        """Parse all the entries and return the analyzers.
+
+        Parameters
+        ----------
+        entries: iterable of BigQueryGithubEntry
+            Entries to be parsed.
+
+        Returns
+        -------
+        list
+            returns the analyzers, in the order they were given.
+
+        """
+        if self.n_jobs != 1:
+            self._run_parallel(entries)
+        else:
+            for i, entry in enumerate(entries):
+                if self.verbose > 0 and i % 1000 == 0:
+                    print(i)
+                self.parse(entry)
+        if self.cache is not None:
+            self.cache.flush()
+        return self.analyzers
+
+    def run_batches(self, batches):
+        """Parse the entries of column batches and return the analyzers.
+
+        Parameters
+        ----------
+        batches: iterable of pyarrow.RecordBatch or pyarrow.Table
+            Batches with columns id, content, repo_name and path, such as
+            the record batches of a BigQuery result. Entries are built from
+            whole columns at a time.
+
+        Returns
+        -------
+        list
+            returns the analyzers, in the order they were given.
+
+        """
+        return self.run(entry for batch in batches
+                        for entry in BigQueryGithubEntry.from_arrow(batch))
+
+    def _run_parallel(self, entries):
+        # Entries are read, and cache lookups and counting done, in this
+        # process and thread; worker processes only parse the files and
+        # extract facts. joblib pulls lazily given tasks from its own
+        # threads, which may not use the SQLite connections of the caches or
+        # the stream of entries, so tasks are made here a window of batches
+        # at a time and dispatched all at once. Results come back in batch
+        # order, so the analyzers see the entries in the same order as when
+        # running serially.
+        from joblib import Parallel, delayed, effective_n_jobs
+        window = 4 * effective_n_jobs(self.n_jobs)
+        batches = _batches(entries, self.batch_size)
+        i = 0
+        with Parallel(n_jobs=self.n_jobs, return_as="generator",
+                      pre_dispatch="all") as parallel:
+            while True:
+                pending = list(islice(batches, window))
+                if not pending:
+                    return
+                lookups = [[self._lookup(entry) for entry in batch]
+                           for batch in pending]
+                tasks = [delayed(_extract_batch)(
+                    self._extractors,
+                    [_get_job(entry, missing)
+                     for entry, (_, missing) in zip(batch, batch_lookups)],
+                    self.fast_scan)
+                    for batch, batch_lookups in zip(pending, lookups)]
+                for extracted_batch, batch, batch_lookups in zip(
+                        parallel(tasks), pending, lookups):
+                    if self.verbose > 0:
+                        print(i * self.batch_size)
+                    i += 1
+                    for entry, (facts, _), extracted in zip(
+                            batch, batch_lookups, extracted_batch):
+                        self._store(entry, extracted)
+                        facts.update(extracted)
+                        self._add_facts(entry, facts)
+
+    def _lookup(self, entry):
+        """Return the cached facts of entry and the fact keys to extract."""
+        if self.cache is None or entry.id is None:
+            return {}, list(self._groups)
+        facts, missing = {}, []
+        for key in self._groups:
+            value = self.cache.get(entry.id, key)
+            if value is None:
+                missing.append(key)
+            else:
+                facts[key] = value
+        return facts, missing
+
+    def _store(self, entry, extracted):
+        if self.cache is None or entry.id is None:
+            return
+        for key, value in extracted.items():
+            self.cache.set(entry.id, key, value)
+
+    def _add_facts(self, entry, facts):
+        for key, analyzers in self._groups.items():
+            for analyzer in analyzers:
+                analyzer._add_facts(entry, facts[key])
+
+
+class _FileTree:
+    """The parso tree of a file and the index of its name leaves by value,
+    built at most once, when first needed, for all the analyzers of the
+    file."""
+
+    def __init__(self, code):
+        self.code = code
+        self._tree = None
+        self._names = None
+
+    def get_tree(self):
+        if self._tree is None:
+            self._tree = parso_parse(self.code)
+        return self._tree
+
+    def get_names(self, value):
+        """The name leaves with the given value, in the order of the code."""
+        if self._names is None:
+            self._names = defaultdict(list)
+            stack = [self.get_tree()]
+            while stack:
+                node = stack.pop()
+                if node.type == 'name':
+                    self._names[node.value].append(node)
+                else:
+                    stack.extend(reversed(getattr(node, 'children', ())))
+        return self._names.get(value, ())
+
+
+def _extract(extractors, keys, code, fast_scan=True):
+    facts = {}
+    walked = []
+    dispatch = defaultdict(list)
+    tree = _FileTree(code)
+    for key in keys:
+        extractor = extractors[key]
+        if fast_scan and hasattr(extractor, '_scan'):
+            if hasattr(extractor, 'leaf_names'):
+                facts[key] = extractor._scan(code, tree)
+            else:
+                facts[key] = extractor._scan(code)
+            continue
+        walked.append(key)
+        extractor._start()
+        for node_type in extractor.node_types:
+            dispatch[node_type].append(extractor)
+        for value in getattr(extractor, 'leaf_names', ()):
+            dispatch[('name', value)].append(extractor)
+    if walked:
+        _walk(tree.get_tree(), dispatch)
+        for key in walked:
+            facts[key] = extractors[key]._facts()
+    return facts
+
+
+def _get_job(entry, keys):
+    # A BlobEntry pickles as its store path and the place of the code in the
+    # store, so it is sent as is and the worker reads the code from the
+    # shared page cache, once it is written to the file. Other entries send
+    # their code.
+    if not keys:
+        return None, keys
+    if isinstance(entry, BlobEntry):
+        entry.store.flush()
+        return entry, keys
+    return entry.code, keys
+
+
+def _extract_batch(extractors, jobs, fast_scan=True):
+    return [_extract(extractors, keys,
+                     source.code if isinstance(source, BlobEntry) else source,
+                     fast_scan) if keys else {}
+            for source, keys in jobs]
+
+
+def _walk(node, dispatch):
+    # Iterative pre-order walk, so deeply nested files do not hit the
+    # recursion limit. Name leaves are also dispatched by value, under the
+    # key ('name', value).
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        for analyzer in dispatch.get(node.type, ()):
+            analyzer._visit(node)
+        if node.type == 'name':
+            for analyzer in dispatch.get(('name', node.value), ()):
+                analyzer._visit(node)
+        children = getattr(node, 'children', None)
+        if children:
+            stack.extend(reversed(children))
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
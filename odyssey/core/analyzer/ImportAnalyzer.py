@@ -4,17 +4,39 @@ ImportAnalyzer.py
 The module that defines ImportAnalyzer.
 
 """
-import parso
 import operator
+from array import array
+from collections import Counter
+from itertools import islice
 from odyssey.utils import sklearn_meta_data
-from odyssey.utils.parse import parso_parse
+from odyssey.utils.state import (decode_increasing, dump_state,
+                                 encode_increasing, load_state)
+from odyssey.utils.imports import (VERSION, get_import_records,
+                                   get_imported_paths, scan_import_records)
+from ..bigquery.BigQueryGithubEntry import BigQueryGithubEntry
+from ..bigquery.BlobStore import BlobEntry
+from .AnalyzerPipeline import AnalyzerPipeline
+from .SymbolIndex import SymbolIndex
 
 
 class ImportAnalyzer:
     """ImportAnalyzer analyzes how classes, submodules and functions are
-    imported."""
-
-    def __init__(self, package, accepted_list):
+    imported.
+
+    ``counter`` maps each value to the number of files importing it, and
+    ``qualified_counter`` does the same for the dotted path of each value
+    (e.g. "sklearn.metrics.auc"), so values of the same name imported from
+    different modules are counted apart. The
+    files themselves are numbered in the order they are first counted, and
+    the sources of each value are kept as an array of these numbers. Unless
+    entries read their code lazily, only the id, repo name and path of a file
+    are kept, and ``loader`` is used to fetch the code when sources are
+    requested."""
+
+    node_types = ('import_from', 'import_name')
+    fact_key = "imports-%d" % VERSION
+
+    def __init__(self, package, accepted_list, loader=None):
         """Initialize the ImportAnalyzer.
 
         Parameters
@@ -23,7 +45,15 @@ class ImportAnalyzer:
             Python package to be counted.
 
         accepted_list : string
-            A list of tokens that will be extracted out and counted.
+            A list of tokens that will be extracted out and counted. Tokens
+            can be bare names, accepted wherever they are imported from in
+            the package, or dotted paths starting with the package name
+            (e.g. "sklearn.metrics.auc"), only accepted from that module.
+
+        loader : callable or None, optional (default=None)
+            Called with a list of file ids, returns the BigQueryGithubEntry
+            objects of these files. If None, the entries are kept as they are
+            parsed, code included.
 
         Returns
         -------
@@ -32,11 +62,16 @@ class ImportAnalyzer:
             returns an initialized ImportAnalyzer object.
 
         """
-        from collections import defaultdict
         self.package = package
         self.accepted_list = self._get_default_accepted_list(accepted_list)
-        self.counter = defaultdict(list)
-        self.entry = None
+        self.loader = loader
+        self._index = SymbolIndex(self.accepted_list)
+        self.counter = Counter()
+        self.qualified_counter = Counter()
+        self._sources = {}
+        self._qualified_sources = {}
+        self._files = []
+        self._removed = set()
 
     def parse(self, entry):
         """Parse a BigQueryGithubEntry for import analysis.
@@ -47,11 +82,24 @@ class ImportAnalyzer:
             A BigQueryGithubEntry to be parsed
 
         """
-        self.entry = entry
-        node = parso_parse(entry.code)
-        self._dfs(node)
+        AnalyzerPipeline([self]).parse(entry)
+
+    def parse_all(self, entries, n_jobs=1):
+        """Parse BigQueryGithubEntry objects, possibly in parallel.
+
+        Parameters
+        ----------
+        entries: iterable of BigQueryGithubEntry
+            BigQueryGithubEntry objects to be parsed
 
-    def get_common(self, n=None, _reverse=True):
+        n_jobs : int, optional (default=1)
+            The number of worker processes, as in joblib. -1 means using all
+            processors.
+
+        """
+        AnalyzerPipeline([self], n_jobs=n_jobs).run(entries)
+
+    def get_common(self, n=None, _reverse=True, qualified=False):
         """Get common imported values.
 
         Parameters
@@ -63,20 +111,23 @@ class ImportAnalyzer:
         _reverse : bool, optional (default=True)
             if _reverse, returns value in descending order.
 
+        qualified : bool, optional (default=False)
+            if qualified, values are dotted paths instead of bare names.
+
         Returns
         -------
         list
             return a list of tuples containing (value, count)
 
         """
-        output = self._entry_list_to_count()
+        output = self.qualified_counter if qualified else self.counter
         if n is None:
             return sorted(output.items(), key=operator.itemgetter(1),
                           reverse=_reverse)
         return sorted(output.items(), key=operator.itemgetter(1),
                       reverse=_reverse)[:n]
 
-    def get_source(self, s):
+    def get_source(self, s, page=None, page_size=100, qualified=False):
         """Get the source entries for a specific value
 
         Parameters
@@ -84,15 +135,59 @@ class ImportAnalyzer:
         s : string
             Value to get source for. Should be in accepted_list.
 
+        page : int or None, optional (default=None)
+            If given, only return the page-th page_size entries (starting
+            from 0). If None, all entries are returned.
+
+        page_size : int, optional (default=100)
+            Number of entries per page.
+
+        qualified : bool, optional (default=False)
+            if qualified, s is a dotted path instead of a bare name.
+
         Returns
         -------
         list
             return a list of BigQueryGithubEntry.
 
         """
-        return self.counter[s] if s in self.counter else []
+        if page is None:
+            return list(self.iter_source(s, qualified=qualified))
+        return list(islice(self.iter_source(s, page * page_size, page_size,
+                                            qualified),
+                           page_size))
+
+    def iter_source(self, s, start=0, page_size=1000, qualified=False):
+        """Iterate over the source entries for a specific value, loading
+        page_size entries at a time.
 
-    def get_most_common(self, n=None):
+        Parameters
+        ----------
+        s : string
+            Value to get source for. Should be in accepted_list.
+
+        start : int, optional (default=0)
+            Number of sources to skip.
+
+        page_size : int, optional (default=1000)
+            Number of entries loaded at a time.
+
+        qualified : bool, optional (default=False)
+            if qualified, s is a dotted path instead of a bare name.
+
+        Returns
+        -------
+        generator
+            Yields BigQueryGithubEntry objects.
+
+        """
+        self._compact()
+        sources = self._qualified_sources if qualified else self._sources
+        indices = sources.get(s, ())
+        for i in range(start, len(indices), page_size):
+            yield from self._resolve(indices[i:i + page_size])
+
+    def get_most_common(self, n=None, qualified=False):
         """Get most common n imported values.
 
         Parameters
@@ -101,15 +196,18 @@ class ImportAnalyzer:
             the top n most imported values to be returned. If set to None, all
             results will be returned.
 
+        qualified : bool, optional (default=False)
+            if qualified, values are dotted paths instead of bare names.
+
         Returns
         -------
         list
             return a list of tuples containing (value, count)
 
         """
-        return self.get_common(n)
+        return self.get_common(n, qualified=qualified)
 
-    def get_least_common(self, n=None):
+    def get_least_common(self, n=None, qualified=False):
         """Get least common n imported values.
 
         Parameters
@@ -118,15 +216,18 @@ class ImportAnalyzer:
             the top n least imported values to be returned. If set to None, all
             results will be returned.
 
+        qualified : bool, optional (default=False)
+            if qualified, values are dotted paths instead of bare names.
+
         Returns
         -------
         list
             return a list of tuples containing (value, count)
 
         """
-        return self.get_common(n, _reverse=False)
+        return self.get_common(n, _reverse=False, qualified=qualified)
 
-    def get_by_filter(self, f):
+    def get_by_filter(self, f, qualified=False):
         """Get imported values, filtered by f.
 
         Parameters
@@ -134,16 +235,136 @@ class ImportAnalyzer:
         f : function
             used as filter(f, get_most_common())
 
+        qualified : bool, optional (default=False)
+            if qualified, values are dotted paths instead of bare names.
+
         Returns
         -------
         list
             return a list of tuples containing (value, count)
 
         """
-        return filter(f, self.get_most_common())
+        return filter(f, self.get_most_common(qualified=qualified))
+
+    def _empty_copy(self):
+        return ImportAnalyzer(self.package, self.accepted_list)
+
+    def __getstate__(self):
+        """Pickle without the loader, which is set by the owner of the
+        analyzer."""
+        self._compact()
+        state = self.__dict__.copy()
+        state["loader"] = None
+        return state
+
+    def merge(self, other):
+        """Add the results of another ImportAnalyzer, e.g. one that analyzed
+        another part of the files.
+
+        Parameters
+        ----------
+        other : ImportAnalyzer
+            analyzer with the same settings.
+
+        Returns
+        -------
+        ImportAnalyzer
+            returns self.
+
+        """
+        self._compact()
+        other._compact()
+        offset = len(self._files)
+        self._files.extend(other._files)
+        if self.loader is None:
+            self.loader = other.loader
+        self.counter.update(other.counter)
+        self.qualified_counter.update(other.qualified_counter)
+        for sources, other_sources in (
+                (self._sources, other._sources),
+                (self._qualified_sources, other._qualified_sources)):
+            for value, indices in other_sources.items():
+                sources.setdefault(value, array('I')).extend(
+                    i + offset for i in indices)
+        return self
+
+    def save(self, path):
+        """Save the results to a gzip compressed JSON file.
+
+        Parameters
+        ----------
+        path : string
+            Path of the file to write.
+
+        """
+        dump_state(self._get_state(), path)
+
+    @classmethod
+    def load(cls, path):
+        """Load results saved with save.
+
+        Parameters
+        ----------
+        path : string
+            Path of the file to read.
 
-    def _entry_list_to_count(self):
-        return {k: len(v) for k, v in self.counter.items()}
+        Returns
+        -------
+        ImportAnalyzer
+            returns the loaded analyzer.
+
+        """
+        return cls._from_state(load_state(path))
+
+    def _get_state(self):
+        self._compact()
+        return {
+            "package": self.package,
+            "accepted_list": list(self.accepted_list),
+            "counter": list(self.counter.items()),
+            "qualified_counter": list(self.qualified_counter.items()),
+            "files": [None if entry is None
+                      else [entry.id, entry.repo_name, entry.path]
+                      for entry in self._files],
+            "sources": {value: encode_increasing(indices)
+                        for value, indices in self._sources.items()},
+            "qualified_sources": {
+                value: encode_increasing(indices)
+                for value, indices in self._qualified_sources.items()},
+        }
+
+    @classmethod
+    def _from_state(cls, state):
+        analyzer = cls(state["package"], state["accepted_list"])
+        analyzer.counter.update(dict(state["counter"]))
+        analyzer.qualified_counter.update(dict(state["qualified_counter"]))
+        analyzer._files = [None if f is None
+                           else BigQueryGithubEntry(f[0], None, f[1], f[2])
+                           for f in state["files"]]
+        for sources, saved in ((analyzer._sources, state["sources"]),
+                               (analyzer._qualified_sources,
+                                state["qualified_sources"])):
+            for value, deltas in saved.items():
+                sources[value] = array('I', decode_increasing(deltas))
+        return analyzer
+
+    def _reference(self, entry):
+        """What is kept of a counted entry."""
+        if self.loader is None or isinstance(entry, BlobEntry):
+            return entry
+        return BigQueryGithubEntry(entry.id, None, entry.repo_name,
+                                   entry.path)
+
+    def _resolve(self, indices):
+        entries = [self._files[i] for i in indices]
+        if self.loader is None:
+            return entries
+        missing = [entry.id for entry in entries
+                   if not isinstance(entry, BlobEntry) and entry.code is None]
+        if not missing:
+            return entries
+        loaded = {entry.id: entry for entry in self.loader(missing)}
+        return [loaded.get(entry.id, entry) for entry in entries]
 
     def _get_default_accepted_list(self, accepted_list):
         if type(accepted_list) is str:
@@ -163,80 +384,68 @@ class ImportAnalyzer:
         else:
             return accepted_list
 
-    def _dfs(self, node):
-        if node.type == 'import_from':
-            self._handle_import_from(node)
-        elif node.type == 'import_name':
-            self._handle_import_name(node)
-        elif hasattr(node, 'children'):
-            for child in node.children:
-                self._dfs(child)
-        else:
-            pass
-
-    def _count(self, value):
-        if value in self.accepted_list:
-            if (len(self.counter[value]) == 0
-                    or self.counter[value][-1] != self.entry):
-                # Count by file, so do not count the same value twice
-                self.counter[value].append(self.entry)
-
-    def _handle_import_from(self, node):
-        def get_imports(node):
-            if (isinstance(node.children[3], parso.python.tree.Operator)
-                    and node.children[3].value == "("):
-                return node.children[4]
-            else:
-                return node.children[3]
-        module = node.children[1]
-        imports = get_imports(node)
-        if (module.type == 'dotted_name'
-                and module.children[0].value == self.package):
-            # Case 1: from Library.B import C
-            for dotted_name in module.children:
-                if dotted_name.type == 'name':
-                    self._count(dotted_name.value)
-
-        if ((module.type == 'name' and module.value == self.package)
-                or (module.type == 'dotted_name'
-                    and module.children[0].value == self.package)):
-            if imports.type == "name":
-                # Case 2: from Library import A
-                self._count(imports.value)
-            elif imports.type == "import_as_names":
-                for child in imports.children:
-                    if child.type == "name":
-                        # Case 3: from Library import A, B
-                        self._count(child.value)
-                    elif child.type == "import_as_name":
-                        # Case 4: from Library import A, B as C
-                        if child.children[0].type == "name":
-                            self._count(child.children[0].value)
-            elif imports.type == "operator" and imports.value == "*":
-                # Do not handle 'from Library import *' yet
-                pass
-            elif imports.type == "import_as_name":
-                if imports.children[0].type == "name":
-                    # Case 5: from Library import A as B
-                    self._count(imports.children[0].value)
-            else:
-                raise Exception("Unexpected import line! %r" % node)
-
-    def _handle_import_name(self, node):
-        imports = node.children[1]
-        if (imports.type == 'dotted_name'
-                and imports.children[0].type == "name"
-                and imports.children[0].value == self.package):
-            # Case 6: import Library.A
-            for child in imports.children[1:]:
-                if child.type == "name":
-                    self._count(child.value)
-        elif (imports.type == 'dotted_as_name'
-              and imports.children[0].type == "dotted_name"):
-            # Case 7: import Library.A as B
-            import_dot = imports.children[0]
-            if (import_dot.children[0].type == "name"
-                    and import_dot.children[0].value == self.package):
-                for child in import_dot.children[1:]:
-                    if child.type == "name":
-                        self._count(child.value)
+    def _start(self):
+        self._records = []
+
+    def _visit(self, node):
+        self._records.extend(get_import_records(node))
+
+    def _facts(self):
+        return self._records
+
+    def _scan(self, code):
+        return scan_import_records(code)
+
+    def _add_facts(self, entry, records):
+        values, paths = self._get_accepted_values(records)
+        if not values:
+            return
+        index = len(self._files)
+        self._files.append(self._reference(entry))
+        for counter, sources, keys in (
+                (self.counter, self._sources, values),
+                (self.qualified_counter, self._qualified_sources, paths)):
+            for key in keys:
+                counter[key] += 1
+                sources.setdefault(key, array('I')).append(index)
+
+    def _remove_facts(self, entry, records):
+        values, paths = self._get_accepted_values(records)
+        if not values:
+            return
+        for counter, keys in ((self.counter, values),
+                              (self.qualified_counter, paths)):
+            for key in keys:
+                counter[key] -= 1
+                if counter[key] <= 0:
+                    del counter[key]
+        # Sources are removed in one pass, the next time they are used.
+        self._removed.add(entry.id)
+
+    def _get_accepted_values(self, records):
+        # Count by file, so do not count the same value twice
+        values, paths = {}, {}
+        for record in records:
+            for path in get_imported_paths(record, self.package):
+                qualified = self._index.resolve(path)
+                if qualified is not None:
+                    values[path[-1]] = None
+                    paths[qualified] = None
+        return values, paths
+
+    def _compact(self):
+        if not self._removed:
+            return
+        removed = set()
+        for i, entry in enumerate(self._files):
+            if entry is not None and entry.id in self._removed:
+                self._files[i] = None
+                removed.add(i)
+        for sources in (self._sources, self._qualified_sources):
+            for value, indices in list(sources.items()):
+                kept = array('I', (i for i in indices if i not in removed))
+                if kept:
+                    sources[value] = kept
+                else:
+                    del sources[value]
+        self._removed = set()
@@ -4,13 +4,26 @@ InstantiationAnalyzer.py
 The module that defines InstantiationAnalyzer.
 
 """
+import re
 from collections import defaultdict
+from functools import partial
 from odyssey.utils.parse import parso_parse
+from .AnalyzerPipeline import AnalyzerPipeline, _FileTree, _walk
+from ..bigquery.BigQueryGithubEntry import BigQueryGithubEntry
+from odyssey.utils.state import dump_state, load_state
 
 
 class InstantiationAnalyzer:
     """InstantiationAnalyzer parses the code to get the instantiation of
-    classes."""
+    classes.
+
+    Files are not parsed as a whole: the calls to the class are found with a
+    regular expression that skips over strings and comments, and only the
+    text of each call, from the class name to the closing parenthesis, is
+    parsed. Files where a call cannot be delimited are parsed as a whole."""
+
+    node_types = ()
+    version = 1
 
     def __init__(self, class_name):
         """Initialize the InstantiationAnalyzer.
@@ -28,8 +41,12 @@ class InstantiationAnalyzer:
 
         """
         self.class_name = class_name
-        self.d = defaultdict(lambda: defaultdict(int))
+        self.fact_key = "instantiation-%d:%s" % (self.version, class_name)
+        self.leaf_names = (class_name,)
+        self.d = defaultdict(partial(defaultdict, int))
         self.counter = 0
+        self._call_re = re.compile(_CALL_PATTERN % re.escape(class_name),
+                                   re.MULTILINE | re.VERBOSE)
 
     def parse(self, code):
         """Parse code and analyze for instantiation.
@@ -40,18 +57,146 @@ class InstantiationAnalyzer:
             code string to be parsed.
 
         """
-        node = parso_parse(code)
-        self._dfs(node)
+        AnalyzerPipeline([self]).parse(BigQueryGithubEntry(None, code, None,
+                                                           None))
 
-    def _dfs(self, node):
-        if hasattr(node, 'children'):
-            for child in node.children:
-                self._dfs(child)
-        else:
-            if node.value == self.class_name:
-                p = node.parent
-                if p.type == "atom_expr" and p.children[0] == node:
-                    self._parseArg(p.children[1].children[1])
+    def parse_all(self, codes, n_jobs=1):
+        """Parse code strings and analyze for instantiation, possibly in
+        parallel.
+
+        Parameters
+        ----------
+        codes: iterable of string
+            code strings to be parsed.
+
+        n_jobs : int, optional (default=1)
+            The number of worker processes, as in joblib. -1 means using all
+            processors.
+
+        """
+        entries = (BigQueryGithubEntry(None, code, None, None)
+                   for code in codes)
+        AnalyzerPipeline([self], n_jobs=n_jobs).run(entries)
+
+    def _empty_copy(self):
+        return InstantiationAnalyzer(self.class_name)
+
+    def merge(self, other):
+        """Add the results of another InstantiationAnalyzer, e.g. one that
+        analyzed another part of the files.
+
+        Parameters
+        ----------
+        other : InstantiationAnalyzer
+            analyzer with the same settings.
+
+        Returns
+        -------
+        InstantiationAnalyzer
+            returns self.
+
+        """
+        for keyword, values in other.d.items():
+            for val, count in values.items():
+                self.d[keyword][val] += count
+        self.counter += other.counter
+        return self
+
+    def save(self, path):
+        """Save the results to a gzip compressed JSON file.
+
+        Parameters
+        ----------
+        path : string
+            Path of the file to write.
+
+        """
+        dump_state(self._get_state(), path)
+
+    @classmethod
+    def load(cls, path):
+        """Load results saved with save.
+
+        Parameters
+        ----------
+        path : string
+            Path of the file to read.
+
+        Returns
+        -------
+        InstantiationAnalyzer
+            returns the loaded analyzer.
+
+        """
+        return cls._from_state(load_state(path))
+
+    def _get_state(self):
+        # Keywords and values can be None, so d is saved as a list of
+        # (keyword, value, count) triples rather than as nested objects.
+        return {"class_name": self.class_name, "counter": self.counter,
+                "d": [[keyword, val, count]
+                      for keyword, values in self.d.items()
+                      for val, count in values.items()]}
+
+    @classmethod
+    def _from_state(cls, state):
+        analyzer = cls(state["class_name"])
+        analyzer.counter = state["counter"]
+        for keyword, val, count in state["d"]:
+            analyzer.d[keyword][val] += count
+        return analyzer
+
+    def _start(self):
+        self._pairs = []
+
+    def _visit(self, node):
+        if node.value == self.class_name:
+            p = node.parent
+            if p.type == "atom_expr" and p.children[0] == node:
+                self._parseArg(p.children[1].children[1])
+
+    def _facts(self):
+        return self._pairs
+
+    def _scan(self, code, tree=None):
+        """Extract the facts of code. tree is the _FileTree of code, shared
+        with the other analyzers of the file by AnalyzerPipeline."""
+        if self.class_name not in code:
+            return []
+        self._start()
+        dispatch = {('name', self.class_name): [self]}
+        pos = 0
+        while True:
+            match = self._call_re.search(code, pos)
+            if match is None:
+                return self._pairs
+            pos = match.end()
+            if match.group('call') is None:
+                if _is_fstring_with(match.group(), self.class_name):
+                    # Calls in f-strings are part of the parso tree.
+                    break
+                continue
+            start = match.start('call')
+            if not _is_call(code, start):
+                continue
+            end = _find_closing_bracket(code, match.end() - 1)
+            region = parso_parse(code[start:end]) if end else None
+            if region is None or _has_errors(region):
+                break
+            # Calls nested in the arguments are visited with this one.
+            _walk(region, dispatch)
+            pos = end
+        self._start()
+        if tree is None:
+            tree = _FileTree(code)
+        for leaf in tree.get_names(self.class_name):
+            self._visit(leaf)
+        return self._pairs
+
+    def _add_facts(self, entry, pairs):
+        for keyword, val in pairs:
+            self.d[keyword][val] += 1
+            self.counter += 1
 
     def _parseArg(self, node):
         if node.type == "arglist":
@@ -61,8 +206,7 @@ class InstantiationAnalyzer:
                     val = None
                     if len(child.children) >= 3:
                         val = self._getVal(child.children[2])
-                    self.d[keyword][val] += 1
-                    self.counter += 1
+                    self._pairs.append([keyword, val])
         elif node.type == "argument":
             keyword = self._getVal(node.children[0])
             val = None
@@ -70,8 +214,7 @@ class InstantiationAnalyzer:
                 val = self._getVal(node.children[2])
             else:
                 keyword = node.get_code()
-            self.d[keyword][val] += 1
-            self.counter += 1
+            self._pairs.append([keyword, val])
 
     def _getVal(self, node):
         if (node.type != "factor" and node.type != "atom"
@@ -80,3 +223,69 @@ class InstantiationAnalyzer:
             return node.value
         else:
             return node.get_code()
+
+
+# Strings and comments are skipped over as a whole, so that the only other
+# matches are "name(" outside of them.
+_CALL_PATTERN = r"""
+    (?:[rRbBuUfF]{1,2})?
+    (?:\"\"\"(?:\\[\s\S]|[^\\])*?\"\"\"
+      |'''(?:\\[\s\S]|[^\\])*?'''
+      |"(?:\\[\s\S]|[^"\\\n])*"
+      |'(?:\\[\s\S]|[^'\\\n])*')
+  | \#[^\n]*
+  | (?<![\w.])(?P<call>%s)[ \t]*\(
+"""
+
+_BRACKETS_RE = re.compile(r"""
+    (?:[rRbBuUfF]{1,2})?
+    (?:\"\"\"(?:\\[\s\S]|[^\\])*?\"\"\"
+      |'''(?:\\[\s\S]|[^\\])*?'''
+      |"(?:\\[\s\S]|[^"\\\n])*"
+      |'(?:\\[\s\S]|[^'\\\n])*')
+  | \#[^\n]*
+  | (?P<open>[(\[{])
+  | (?P<close>[)\]}])
+""", re.VERBOSE)
+
+# Only the current line, and the lines it continues with a backslash, are
+# looked at: a name at the start of a line is not an attribute of the end of
+# the previous line.
+_NOT_CALL_RE = re.compile(
+    r"(?:\.|\b(?:def|class|await))(?:[ \t]|\\\r?\n)*\Z")
+
+
+def _is_call(code, start):
+    """Whether the name at start is the first name of an expression, as in
+    the parso tree of the whole file, rather than an attribute or a
+    definition."""
+    return _NOT_CALL_RE.search(code, max(0, start - 80), start) is None
+
+
+def _is_fstring_with(text, class_name):
+    prefix = text[:len(text) - len(text.lstrip('rRbBuUfF'))]
+    return 'f' in prefix.lower() and class_name in text
+
+
+def _find_closing_bracket(code, pos):
+    """Return the position after the bracket closing the one at pos, or None
+    if it is not closed."""
+    depth = 0
+    for match in _BRACKETS_RE.finditer(code, pos):
+        if match.group('open'):
+            depth += 1
+        elif match.group('close'):
+            depth -= 1
+            if depth == 0:
+                return match.end()
+    return None
+
+
+def _has_errors(tree):
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if node.type in ('error_node', 'error_leaf'):
+            return True
+        stack.extend(getattr(node, 'children', ()))
+    return False
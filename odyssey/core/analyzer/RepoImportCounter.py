@@ -5,14 +5,19 @@ The module that defines RepoImportCounter.
 
 """
 from ..bigquery.BigQueryGithubEntry import BigQueryGithubEntry
-import parso
-from odyssey.utils.parse import parso_parse
+from .AnalyzerPipeline import AnalyzerPipeline
+from odyssey.utils.imports import (VERSION, get_import_records,
+                                   imports_package, scan_import_records)
+from odyssey.utils.state import dump_state, load_state
 
 
 class RepoImportCounter:
     """RepoImportCounter counts how many times other repos import the analyzed
     package."""
 
+    node_types = ('import_from', 'import_name')
+    fact_key = "imports-%d" % VERSION
+
     def __init__(self, package):
         """Initialize the RepoImportCounter.
 
@@ -31,8 +36,6 @@ class RepoImportCounter:
         from collections import Counter
         self.package = package
         self.counter = Counter()
-        self.entry = None
-        self.hasImport = False
 
     def parse(self, entry):
         """Parse a BigQueryGithubEntry for repo import count.
@@ -45,11 +48,22 @@ class RepoImportCounter:
         """
         if not isinstance(entry, BigQueryGithubEntry):
             print("Cannot parse non-BigQueryGithubEntry!")
-        self.entry = entry
-        node = parso_parse(entry.code)
-        self._dfs(node)
-        if self.hasImport:
-            self.counter[entry.repo_name] += 1
+        AnalyzerPipeline([self]).parse(entry)
+
+    def parse_all(self, entries, n_jobs=1):
+        """Parse BigQueryGithubEntry objects, possibly in parallel.
+
+        Parameters
+        ----------
+        entries: iterable of BigQueryGithubEntry
+            BigQueryGithubEntry objects to be parsed
+
+        n_jobs : int, optional (default=1)
+            The number of worker processes, as in joblib. -1 means using all
+            processors.
+
+        """
+        AnalyzerPipeline([self], n_jobs=n_jobs).run(entries)
 
     def get_most_common(self, n=None):
         """Get most common n repos.
@@ -70,79 +84,83 @@ class RepoImportCounter:
             return self.counter.most_common(len(self.counter))
         return self.counter.most_common(n)
 
-    def _dfs(self, node):
-        if self.hasImport:
-            return
-        if node.type == 'import_from':
-            self._handleImportFrom(node)
-        elif node.type == 'import_name':
-            self._handleImportName(node)
-        elif hasattr(node, 'children'):
-            for child in node.children:
-                self._dfs(child)
-        else:
-            pass
-
-    def _count(self, value):
-        # set hasImport to true so we can break from dfs earlier.
-        self.hasImport = True
-
-    def _handleImportFrom(self, node):
-        def getImports(node):
-            if (isinstance(node.children[3], parso.python.tree.Operator)
-                    and node.children[3].value == "("):
-                return node.children[4]
-            else:
-                return node.children[3]
-        if self.hasImport:
-            return
-        module = node.children[1]
-        imports = getImports(node)
-        if (module.type == 'dotted_name'
-                and module.children[0].value == self.package):
-            # Case 1: from Library.B import C
-            for dotted_name in module.children:
-                if dotted_name.type == 'name':
-                    self._count(dotted_name.value)
-
-        if ((module.type == 'name' and module.value == self.package)
-                or (module.type == 'dotted_name'
-                    and module.children[0].value == self.package)):
-            if imports.type == "name":
-                # Case 2: from Library import A
-                self._count(imports.value)
-            elif imports.type == "import_as_names":
-                for child in imports.children:
-                    if child.type == "name":
-                        # Case 3: from Library import A, B
-                        self._count(child.value)
-                    elif child.type == "import_as_name":
-                        # Case 4: from Library import A, B as C
-                        if child.children[0].type == "name":
-                            self._count(child.children[0].value)
-            elif imports.type == "operator" and imports.value == "*":
-                # Do not handle 'from Library import *' yet
-                pass
-            elif imports.type == "import_as_name":
-                if imports.children[0].type == "name":
-                    # Case 5: from Library import A as B
-                    self._count(imports.children[0].value)
-            else:
-                raise Exception("Unexpected import line! %r" % node)
-
-    def _handleImportName(self, node):
-        if self.hasImport:
-            return
-        imports = node.children[1]
-        if (imports.type == 'dotted_name'
-                and imports.children[0] == self.package):
-            # Case 6: import Library.A
-            for child in imports.children[1:]:
-                if child.type == "name":
-                    self._count(child.value)
-        elif (imports.type == 'dotted_as_name'
-              and imports.children[0] == self.package):
-            # Case 7: import Library.A as B
-            for child in imports.children[1:]:
-                if child.type == "name":
-                    self._count(child.value)
+    def _empty_copy(self):
+        return RepoImportCounter(self.package)
+
+    def merge(self, other):
+        """Add the results of another RepoImportCounter, e.g. one that analyzed
+        another part of the files.
+
+        Parameters
+        ----------
+        other : RepoImportCounter
+            analyzer with the same settings.
+
+        Returns
+        -------
+        RepoImportCounter
+            returns self.
+
+        """
+        self.counter.update(other.counter)
+        return self
+
+    def save(self, path):
+        """Save the results to a gzip compressed JSON file.
+
+        Parameters
+        ----------
+        path : string
+            Path of the file to write.
+
+        """
+        dump_state(self._get_state(), path)
+
+    @classmethod
+    def load(cls, path):
+        """Load results saved with save.
+
+        Parameters
+        ----------
+        path : string
+            Path of the file to read.
+
+        Returns
+        -------
+        RepoImportCounter
+            returns the loaded analyzer.
+
+        """
+        return cls._from_state(load_state(path))
+
+    def _get_state(self):
+        return {"package": self.package,
+                "counter": list(self.counter.items())}
+
+    @classmethod
+    def _from_state(cls, state):
+        analyzer = cls(state["package"])
+        analyzer.counter.update(dict(state["counter"]))
+        return analyzer
+
+    def _start(self):
+        self._records = []
+
+    def _visit(self, node):
+        self._records.extend(get_import_records(node))
+
+    def _facts(self):
+        return self._records
+
+    def _scan(self, code):
+        return scan_import_records(code)
+
+    def _add_facts(self, entry, records):
+        if any(imports_package(record, self.package) for record in records):
+            self.counter[entry.repo_name] += 1
+
+    def _remove_facts(self, entry, records):
+        if any(imports_package(record, self.package) for record in records):
+            self.counter[entry.repo_name] -= 1
+            if self.counter[entry.repo_name] <= 0:
+                del self.counter[entry.repo_name]
@@ -0,0 +1,80 @@
+"""
+SymbolIndex.py
+====================================
+The module that defines SymbolIndex.
+
+"""
+
+
+class SymbolIndex:
+    """SymbolIndex tells which imported values are in an accepted list.
+
+    Bare names (e.g. "auc") are kept in a set and match a value of that name
+    imported from anywhere in the package. Dotted names (e.g.
+    "sklearn.metrics.auc") are kept in a trie of their parts and only match
+    that path, so values of the same name in different modules can be told
+    apart."""
+
+    def __init__(self, symbols):
+        """Initialize the SymbolIndex.
+
+        Parameters
+        ----------
+        symbols : list of string
+            Bare names and dotted paths (starting with the package name) to
+            be accepted.
+
+        Returns
+        -------
+
+        object
+            returns an initialized SymbolIndex object.
+
+        """
+        self.names = set()
+        self._trie = {}
+        for symbol in symbols:
+            if "." not in symbol:
+                self.names.add(symbol)
+                continue
+            node = self._trie
+            for part in symbol.split("."):
+                node = node.setdefault(part, {})
+            node[None] = symbol
+
+    def resolve(self, path):
+        """Get the qualified name of an imported value if it is accepted.
+
+        Parameters
+        ----------
+        path : list of string
+            The parts of the dotted path of the value, starting with the
+            package name (e.g. ["sklearn", "linear_model",
+            "LogisticRegression"]).
+
+        Returns
+        -------
+        string or None
+            returns the dotted path, or None if the value is not accepted.
+
+        """
+        if path[-1] in self.names:
+            return ".".join(path)
+        node = self._trie
+        for part in path:
+            node = node.get(part)
+            if node is None:
+                return None
+        return node.get(None)
+
+    def __contains__(self, symbol):
+        """Whether a bare name or dotted path is accepted."""
+        return self.resolve(symbol.split(".")) is not None
+
+    def __len__(self):
+        """Number of indexed bare names and dotted paths."""
+        return len(self.names) + self._count(self._trie)
+
+    def _count(self, node):
+        return sum(1 if key is None else self._count(child)
+                   for key, child in node.items())
@@ -1,3 +1,7 @@
+from .AnalysisCache import AnalysisCache
+from .AnalysisState import AnalysisState
+from .AnalyzerPipeline import AnalyzerPipeline
 from .ImportAnalyzer import ImportAnalyzer
 from .InstantiationAnalyzer import InstantiationAnalyzer
 from .RepoImportCounter import RepoImportCounter
+from .SymbolIndex import SymbolIndex
@@ -4,11 +4,19 @@ BigQueryGithubEntry.py
 The module that defines BigQueryGithubEntry class.
 
 """
+import sys
 
 
 class BigQueryGithubEntry:
     """A struct that contains relevant information about an entry in BigQuery
-    Github table."""
+    Github table.
+
+    Entries are kept compact since there are millions of them: there is no
+    per-instance ``__dict__``, hex ids are stored as 20 bytes, code is stored
+    encoded in utf-8 and only decoded when accessed, and repo names and
+    directories are interned so entries of the same repo share them."""
+
+    __slots__ = ('_id', '_code', '_repo_name', '_dirname', '_basename')
 
     def __init__(self, _id, code, repo_name, path):
         """Initialize the BigQueryGithubEntry object.
@@ -40,6 +48,86 @@ class BigQueryGithubEntry:
         self.repo_name = repo_name
         self.path = path
 
+    @classmethod
+    def from_arrow(cls, data):
+        """Build entries directly from the columns of an Arrow table or record
+        batch, without going through pandas. Contents are taken as the utf-8
+        bytes entries store them in, so they are not decoded.
+
+        Parameters
+        ----------
+        data : pyarrow.Table or pyarrow.RecordBatch
+                Result with columns id, content, repo_name and path.
+
+        Returns
+        -------
+        generator
+                Yields BigQueryGithubEntry objects, one per row.
+
+        """
+        import pyarrow as pa
+        content = data.column("content")
+        if pa.types.is_string(content.type):
+            content = content.cast(pa.binary())
+        for row in zip(data.column("id").to_pylist(), content.to_pylist(),
+                       data.column("repo_name").to_pylist(),
+                       data.column("path").to_pylist()):
+            yield cls(*row)
+
+    @property
+    def id(self):
+        """hashed value representing the file entry."""
+        if isinstance(self._id, bytes):
+            return self._id.hex()
+        return self._id
+
+    @id.setter
+    def id(self, _id):
+        if isinstance(_id, str) and len(_id) == 40:
+            try:
+                _id = bytes.fromhex(_id)
+            except ValueError:
+                pass
+        self._id = _id
+
+    @property
+    def code(self):
+        """code string."""
+        if self._code is None:
+            return None
+        return self._code.decode('utf-8', 'surrogatepass')
+
+    @code.setter
+    def code(self, code):
+        if isinstance(code, str):
+            code = code.encode('utf-8', 'surrogatepass')
+        self._code = code
+
+    @property
+    def repo_name(self):
+        """name of the repo."""
+        return self._repo_name
+
+    @repo_name.setter
+    def repo_name(self, repo_name):
+        self._repo_name = (sys.intern(repo_name)
+                           if isinstance(repo_name, str) else repo_name)
+
+    @property
+    def path(self):
+        """path of the file."""
+        if self._dirname is None:
+            return self._basename
+        return self._dirname + '/' + self._basename
+
+    @path.setter
+    def path(self, path):
+        if isinstance(path, str) and '/' in path:
+            dirname, _, self._basename = path.rpartition('/')
+            self._dirname = sys.intern(dirname)
+        else:
+            self._dirname, self._basename = None, path
+
     def __str__(self):
         """Encode the code string in utf-8 and return. For printing purpose."""
         return str(self.code.encode('utf-8'))
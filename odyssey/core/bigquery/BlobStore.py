@@ -0,0 +1,154 @@
+"""
+BlobStore.py
+====================================
+The module that defines BlobStore, an append-only file of code strings read
+through a memory map, and BlobEntry, a BigQueryGithubEntry that reads its code
+from a BlobStore only when it is accessed.
+
+"""
+import mmap
+import os
+import tempfile
+import weakref
+from odyssey.core.bigquery.BigQueryGithubEntry import BigQueryGithubEntry
+
+# BlobStores opened in this process, by path, so that unpickled BlobEntry
+# objects share one memory map per file.
+_open_stores = weakref.WeakValueDictionary()
+
+
+class BlobStore:
+    """An append-only file holding code strings encoded in utf-8. A string is
+    addressed by its (offset, length) in the file, which the owner of the
+    store keeps in its index. Reads go through a memory map, so processes
+    reading the same store share the operating system's page cache."""
+
+    def __init__(self, path=None):
+        """Initialize the BlobStore.
+
+        Parameters
+        ----------
+        path : string or None, optional (default=None)
+                Path of the blob file, created if it does not exist. If None,
+                a temporary file is used and removed with the store.
+
+        Returns
+        -------
+
+        object
+                returns an initialized BlobStore object.
+
+        """
+        if path is None:
+            fd, path = tempfile.mkstemp(suffix=".blobs")
+            os.close(fd)
+            weakref.finalize(self, os.remove, path)
+        elif not os.path.exists(path):
+            open(path, "wb").close()
+        self.path = path
+        self._writer = None
+        self._map = None
+        _open_stores[path] = self
+
+    def append(self, code):
+        """Append a code string to the store.
+
+        Parameters
+        ----------
+        code : string
+                code string to be stored.
+
+        Returns
+        -------
+        tuple
+                returns the (offset, length) of the stored string.
+
+        """
+        if self._writer is None:
+            self._writer = open(self.path, "ab")
+        data = code.encode("utf-8", "surrogatepass")
+        offset = self._writer.tell()
+        self._writer.write(data)
+        return offset, len(data)
+
+    def flush(self):
+        """Write appended strings to disk."""
+        if self._writer is not None:
+            self._writer.flush()
+
+    def read(self, offset, length):
+        """Read the code string stored at (offset, length)."""
+        end = offset + length
+        if self._map is None or len(self._map) < end:
+            self._remap()
+        return self._map[offset:end].decode("utf-8", "surrogatepass")
+
+    def __reduce__(self):
+        """Pickle by path; unpickling reuses the store already open in the
+        process, if any."""
+        return (_open_store, (self.path,))
+
+    def _remap(self):
+        self.flush()
+        if self._map is not None:
+            self._map.close()
+        if os.path.getsize(self.path) == 0:
+            self._map = b""
+            return
+        with open(self.path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _open_store(path):
+    store = _open_stores.get(path)
+    return store if store is not None else BlobStore(path)
+
+
+class BlobEntry(BigQueryGithubEntry):
+    """A BigQueryGithubEntry whose code is read from a BlobStore when it is
+    accessed, so that keeping or pickling the entry costs a few bytes."""
+
+    __slots__ = ('store', 'offset', 'length')
+
+    def __init__(self, _id, store, offset, length, repo_name, path):
+        """Initialize the BlobEntry object.
+
+        Parameters
+        ----------
+        _id : string
+                a hashed value representing a file entry in BigQuery Github
+                table.
+
+        store : BlobStore
+                store holding the code string.
+
+        offset : int
+                offset of the code string in the store.
+
+        length : int
+                length of the utf-8 encoded code string.
+
+        repo_name : string
+                name of the repo. (e.g.: scikit-learn/scikit-learn)
+
+        path: string
+                path of the file. (e.g.: doc/HOWTO_DOCUMENT.rst)
+
+        Returns
+        -------
+
+        object
+                returns an initialized BlobEntry object.
+
+        """
+        self.id = _id
+        self.store = store
+        self.offset = offset
+        self.length = length
+        self.repo_name = repo_name
+        self.path = path
+
+    @property
+    def code(self):
+        """code string, read from the store."""
+        return self.store.read(self.offset, self.length)
@@ -5,40 +5,218 @@ The module for using Google BigQuery on Github Data.
 
 """
 
+import asyncio
+import re
+import warnings
+from functools import partial
+from itertools import combinations, islice
 from odyssey.utils.query_builder import connect_with_and, connect_with_or
-from odyssey.core.analyzer import (RepoImportCounter, ImportAnalyzer,
-                                   InstantiationAnalyzer)
+from odyssey.utils.pushdown import count_imports, get_import_count_query
+from odyssey.utils.sampling import (SAMPLE_BUCKETS, sample_bucket,
+                                    scale_count, scale_counts)
+from odyssey.core.analyzer import (AnalysisCache, AnalysisState,
+                                   AnalyzerPipeline, RepoImportCounter,
+                                   ImportAnalyzer, InstantiationAnalyzer)
 from odyssey.core.bigquery.BigQueryGithubEntry import BigQueryGithubEntry
+from odyssey.core.bigquery.filter import get_conjuncts, join_with_and
+from odyssey.core.bigquery.LocalCorpus import LocalCorpus
+from odyssey.core.bigquery.QueryCache import QueryCache
 from google.cloud import bigquery
 
-from joblib import Memory
+# Seconds between two status checks of a running job, in the asyncio API.
+POLL_INTERVAL = 0.5
+# Filters with more And conjuncts are not answered from the cached results
+# of broader filters, as every subset of the conjuncts is looked up.
+MAX_NARROWED_CONJUNCTS = 8
+# Schema metadata key holding the percent of the table a result was computed
+# on, when its query was rewritten to a TABLESAMPLE to fit the byte budget.
+SAMPLE_PERCENT_KEY = b"odyssey.sample_percent"
+# Packages with default accepted lists, see ImportAnalyzer.
+DEFAULT_LIST_PACKAGES = ("sklearn",)
+# Most file ids passed to one query as an array parameter. BigQuery limits
+# the size of query requests, and ids take about 40 bytes each.
+MAX_QUERY_IDS = 100000
+# Longest list of fork repos written into queries, in characters. BigQuery
+# queries are at most 1024K characters long.
+MAX_INLINED_FORKS_LENGTH = 500000
+_TABLESAMPLE_RE = re.compile(r"TABLESAMPLE SYSTEM \(([\d.]+) PERCENT\)")
+
+
+class QueryBudgetExceeded(Exception):
+    """Raised when a query would process more bytes than allowed."""
+    pass
+
+
+def start_query(query, project, dry_run=False, maximum_bytes_billed=None,
+                query_parameters=None):
+    """Start a SQL query job with Google BigQuery.
 
-memory = Memory(location=".", verbose=0)
+    Parameters
+    ----------
+    query: string
+            SQL query to be executed.
+
+    project: string
+            Project to run the query on.
+
+    dry_run: bool, optional (default=False)
+            If True, the query is only validated and its cost estimated.
+
+    maximum_bytes_billed: int or None, optional (default=None)
+            If given, BigQuery fails the query instead of billing more bytes.
+
+    query_parameters: list or None, optional (default=None)
+            Parameters of the query, such as bigquery.ArrayQueryParameter.
+
+    Returns
+    -------
+    google.cloud.bigquery.QueryJob
+            Returns the query job.
 
+    """
+    job_config = bigquery.QueryJobConfig(
+        dry_run=dry_run, use_query_cache=not dry_run,
+        query_parameters=query_parameters or [])
+    if maximum_bytes_billed is not None:
+        job_config.maximum_bytes_billed = maximum_bytes_billed
+    client = bigquery.Client(project=project)
+    return client.query(query, job_config=job_config)
 
-@memory.cache
-def run_query(query, project):
-    """Run SQL query with Google BigQuery. Allow large results. Timeout set
-    to 99999999.
+
+def estimate_query(query, project, query_parameters=None):
+    """Estimate the number of bytes a SQL query would process, with a dry
+    run. Dry runs are free.
+
+    Parameters
+    ----------
+    query: string
+            SQL query to be estimated.
+
+    project: string
+            Project to run the query on.
+
+    query_parameters: list or None, optional (default=None)
+            Parameters of the query.
+
+    Returns
+    -------
+    google.cloud.bigquery.QueryJob
+            Returns the dry run job. Its total_bytes_processed is the
+            estimate and its schema the columns of the result.
+
+    """
+    return start_query(query, project, dry_run=True,
+                       query_parameters=query_parameters)
+
+
+def _run_query(query, project, maximum_bytes_billed=None):
+    job = start_query(query, project,
+                      maximum_bytes_billed=maximum_bytes_billed)
+    return job.result().to_arrow(), _get_job_stats(job)
+
+
+def _iter_batches(job, chunk_size):
+    return job.result(page_size=chunk_size).to_arrow_iterable()
+
+
+def _iter_rows(batches):
+    # Convert whole columns at once rather than boxing each row.
+    for batch in batches:
+        yield from zip(*(column.to_pylist() for column in batch.columns))
+
+
+def _mark_sampled(query, result):
+    """Record the sampled percent of a TABLESAMPLE query in the schema
+    metadata of its result (a Table or RecordBatch), so it is kept in the
+    query cache. Results of other queries are returned as is."""
+    match = _TABLESAMPLE_RE.search(query)
+    if match is None:
+        return result
+    metadata = dict(result.schema.metadata or {})
+    metadata[SAMPLE_PERCENT_KEY] = match.group(1).encode("ascii")
+    return result.replace_schema_metadata(metadata)
+
+
+def _get_sampled_fraction(result):
+    """Fraction of the table a result was computed on, see _mark_sampled."""
+    percent = (result.schema.metadata or {}).get(SAMPLE_PERCENT_KEY)
+    return float(percent) / 100 if percent else 1
+
+
+def _filter_batches(batches, match):
+    """Yield the rows of each record batch whose content matches, as
+    record batches."""
+    import pyarrow as pa
+    for batch in batches:
+        content = batch.column(batch.schema.get_field_index("content"))
+        yield batch.filter(pa.array(
+            [bool(match(code)) for code in content.to_pylist()],
+            pa.bool_()))
+
+
+async def _to_thread(func, *args):
+    """Run func(*args) in the default executor of the running loop, as
+    asyncio.to_thread does in Python 3.9."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, partial(func, *args))
+
+
+def _get_job_stats(job):
+    return {"bytes_billed": job.total_bytes_billed or 0,
+            "slot_millis": job.slot_millis or 0}
+
+
+def run_query(query, project, cache=None):
+    """Run SQL query with Google BigQuery.
 
     Parameters
     ----------
     query: string
             SQL query to be executed.
 
+    project: string
+            Project to run the query on.
+
+    cache: QueryCache or None, optional (default=None)
+            If given, the result is looked up in and stored to the cache.
+
 
     Returns
     -------
-    list
-            Returns result in python list.
+    pandas.DataFrame
+            Returns the result.
 
     """
-    job_config = bigquery.QueryJobConfig()
-    client = bigquery.Client(project=project)
-    result = client.query(query, job_config=job_config)
-    job_config.allowLargeResults = True
-    result.__done_timeout = 99999999
-    return result.result().to_dataframe()
+    result = cache.get(query, project) if cache is not None else None
+    if result is None:
+        result = _run_query(query, project)[0]
+        if cache is not None:
+            cache.set(query, project, result)
+    return result.to_pandas()
+
+
+def iter_query(query, project, chunk_size=10000):
+    """Run SQL query with Google BigQuery and yield the result rows lazily,
+    fetching chunk_size rows at a time.
+
+    Parameters
+    ----------
+    query: string
+            SQL query to be executed.
+
+    project: string
+            Project to run the query on.
+
+    chunk_size: int, optional (default=10000)
+            Number of rows fetched per page.
+
+    Returns
+    -------
+    generator
+            Yields each row as a tuple of column values.
+
+    """
+    return _iter_rows(_iter_batches(start_query(query, project), chunk_size))
 
 
 class GithubPython:
@@ -47,7 +225,11 @@ class GithubPython:
     def __init__(self, package="", exclude_forks="auto", limit=None,
                  project="odyssey-193217193217",
                  py_files_unique='`Odyssey_github_sklearn.content_py_unique`',
-                 py_files_all='`Odyssey_github_sklearn.content_py_full`'):
+                 py_files_all='`Odyssey_github_sklearn.content_py_full`',
+                 n_jobs=1, analysis_cache=True, corpus=None, shard=None,
+                 dry_run=False, max_bytes_billed=None, over_budget="raise",
+                 query_cache=True, import_engine="local",
+                 sample_fraction=None, verbose=0):
         """Initialize the GithubPython object.
 
         Parameters
@@ -76,7 +258,73 @@ class GithubPython:
         py_files_all : string
                 Dataset name for all python files.
 
-
+        n_jobs : int, optional (default=1)
+                The number of worker processes used to parse files, as in
+                joblib. -1 means using all processors.
+
+        analysis_cache : bool or AnalysisCache, optional (default=True)
+                Cache of the facts extracted from each file, so files already
+                analyzed are not parsed again. If True, an AnalysisCache with
+                default settings is used. If False, nothing is cached.
+
+        corpus : LocalCorpus or None, optional (default=None)
+                Local copy of the python file tables. If given, queries are
+                answered from it instead of BigQuery.
+
+        shard : tuple or None, optional (default=None)
+                (index, n_shards): only analyze the files whose id hashes to
+                shard index out of n_shards. See ShardedRunner.
+
+        dry_run : bool, optional (default=False)
+                If True, queries are not run: their estimated cost is
+                appended to ``estimates`` and they return no rows.
+
+        max_bytes_billed : int or None, optional (default=None)
+                Budget of bytes processed per query. Queries are estimated
+                with a dry run before running, and BigQuery fails queries
+                billing more than the budget.
+
+        over_budget : string, optional (default="raise")
+                What to do with queries estimated over max_bytes_billed:
+                "raise" raises QueryBudgetExceeded, "sample" runs the query
+                on a random sample of the unique python files (TABLESAMPLE)
+                small enough to fit the budget, with a warning. Counts
+                computed on such a sample are scaled back up, as with
+                sample_fraction; the sampled percent is kept in the schema
+                metadata of the result (SAMPLE_PERCENT_KEY). TABLESAMPLE
+                samples storage blocks rather than files, so the confidence
+                intervals are too narrow.
+
+        query_cache : bool or QueryCache, optional (default=True)
+                Cache of the query results. If True, a QueryCache with
+                default settings is used. If False, nothing is cached.
+
+        import_engine : string, optional (default="local")
+                How get_most_imported_class etc. count imports: "local"
+                fetches and parses the files with ImportAnalyzer, "pushdown"
+                finds import lines with regular expressions in BigQuery and
+                only downloads the counts (see odyssey.utils.pushdown). With
+                "pushdown", get_import_source returns no sources. See
+                compare_import_engines for how the counts differ.
+
+        sample_fraction : float or None, optional (default=None)
+                If given, only analyze the files whose id hashes into this
+                fraction of the files. The sample is the same on every run,
+                so repeated queries hit the cache. get_count, the
+                get_*_imported_* functions, get_top_import_repo and the
+                import reports return counts scaled back up to all files, as
+                Estimate objects holding a 95% confidence interval (see
+                odyssey.utils.sampling). The sample is a WHERE predicate, and
+                BigQuery bills the columns it scans, not the rows it keeps:
+                a sampled query still bills (and is checked against
+                max_bytes_billed for) a full scan. Only the download and the
+                parsing shrink. If the scan cost matters, materialize the
+                sample once with create_sample_table and give its name as
+                py_files_unique, with the same sample_fraction.
+
+        verbose : int, optional (default=0)
+                If larger than 0, print the number of files parsed every 1000
+                files while analyzing.
 
         Returns
         -------
@@ -88,12 +336,37 @@ class GithubPython:
         self._reset(package)
         self.exclude_forks = exclude_forks
         self.limit = limit
-        self.get_all = memory.cache(self.get_all)
-        self.get_count = memory.cache(self.get_count)
         self.class_list = self.submodule_list = self.function_list = None
         self.project = project
         self.py_files_all = py_files_all
         self.py_files_unique = py_files_unique
+        self.n_jobs = n_jobs
+        if analysis_cache is True:
+            analysis_cache = AnalysisCache()
+        elif analysis_cache is False:
+            analysis_cache = None
+        self.analysis_cache = analysis_cache
+        if query_cache is True:
+            query_cache = QueryCache()
+        elif query_cache is False:
+            query_cache = None
+        self.query_cache = query_cache
+        self.import_engine = import_engine
+        self.corpus = corpus
+        self.shard = tuple(shard) if shard is not None else None
+        if sample_fraction is not None:
+            sample_bucket(sample_fraction)
+        self.sample_fraction = sample_fraction
+        self.verbose = verbose
+        self.dry_run = dry_run
+        self.max_bytes_billed = max_bytes_billed
+        self.over_budget = over_budget
+        # Estimates of the queries made, and totals of the queries run.
+        self.estimates = []
+        self.bytes_billed = 0
+        self.slot_millis = 0
+        # Fork repos by fork keywords, see _get_fork_repos.
+        self._fork_repos = {}
 
     def _reset(self, package):
         """Reset package attribute and import analyzers when package is reset.
@@ -117,9 +390,56 @@ class GithubPython:
             Returns a list of BigQueryGithubEntry object
 
         """
-        res = self.run(self._get_all_query(_filter))
-        return [BigQueryGithubEntry(_id, code, repo_name, path)
-                for _, (_id, code, repo_name, path) in res.iterrows()]
+        if self.corpus is not None:
+            return list(self.iter_entries(_filter))
+        query = self._get_all_query(_filter)
+        entries = self._get_narrowed_entries(query, _filter)
+        if entries is None:
+            entries = list(BigQueryGithubEntry.from_arrow(
+                self.run_arrow(query)))
+        return entries
+
+    def iter_entries(self, _filter=None, chunk_size=10000):
+        """Iterate over all data (id, code, repo_name and path) subject to
+        filter, without holding the whole result in memory.
+
+        Parameters
+        ----------
+        _filter : Filter object or None, optional (default=None)
+                Filter the result as defined in the filter object.
+
+        chunk_size : int, optional (default=10000)
+                Number of files fetched from BigQuery at a time.
+
+        Returns
+        -------
+        generator
+            Yields BigQueryGithubEntry objects
+
+        """
+        return self._iter_entries(_filter, chunk_size)
+
+    def _iter_entries(self, _filter=None, chunk_size=10000, package=None):
+        """Same as iter_entries. package is the regular expression of the
+        packages the files contain, self.package if None."""
+        if self.corpus is not None:
+            package = self.package if package is None else package
+            yield from self.corpus.iter_entries(
+                package, _filter, self._get_fork_repos(package), self.limit,
+                chunk_size, self.shard, self.sample_fraction)
+            return
+        for batch in self._iter_entry_batches(_filter, chunk_size, package):
+            yield from BigQueryGithubEntry.from_arrow(batch)
+
+    def _iter_entry_batches(self, _filter=None, chunk_size=10000,
+                            package=None):
+        """The Arrow record batches of the files _iter_entries yields."""
+        query = self._get_all_query(_filter, package)
+        batches = self._get_narrowed(query, _filter, True, package,
+                                     chunk_size)
+        if batches is not None:
+            return batches
+        return self._iter_batches(query, chunk_size)
 
     def get_count(self, _filter=None):
         """Get count of files subject to filter.
@@ -135,7 +455,88 @@ class GithubPython:
             Returns an integer for count.
 
         """
-        return self.run(self._get_count_query(_filter))['f0_'][0]
+        if self.corpus is not None:
+            return self._scale(self.corpus.count(
+                self.package, _filter, self._get_fork_repos(), self.shard,
+                self.sample_fraction))
+        query = self._get_count_query(_filter)
+        counted = self._get_narrowed_count(query, _filter)
+        if counted is None:
+            res = self.run_arrow(query)
+            counted = (res.column(0)[0].as_py() if res.num_rows else 0,
+                       _get_sampled_fraction(res))
+        return self._scale(*counted)
+
+    def _get_narrowed(self, query, _filter, strict, package=None,
+                      chunk_size=10000):
+        """If query is not cached, try _narrow_cached."""
+        if self._is_cached(query):
+            return None
+        return self._narrow_cached(_filter, strict, package, chunk_size)
+
+    def _get_narrowed_entries(self, query, _filter):
+        """The entries of get_all from _get_narrowed, or None."""
+        batches = self._get_narrowed(query, _filter, True)
+        if batches is None:
+            return None
+        return [entry for batch in batches
+                for entry in BigQueryGithubEntry.from_arrow(batch)]
+
+    def _get_narrowed_count(self, query, _filter):
+        """The count of get_count from _get_narrowed and the fraction of the
+        table it was computed on, or None."""
+        batches = self._get_narrowed(query, _filter, False)
+        if batches is None:
+            return None
+        count, fraction = 0, 1
+        for batch in batches:
+            count += batch.num_rows
+            fraction = _get_sampled_fraction(batch)
+        return count, fraction
+
+    def _narrow_cached(self, _filter, strict, package=None,
+                       chunk_size=10000):
+        """Answer get_all for _filter from the cached get_all result of a
+        broader filter, if there is one: a filter made of some of the And
+        conjuncts of _filter, in the same order. The conjuncts left out are
+        evaluated locally on the cached files. If strict, the cached result
+        of _filter itself is not used.
+
+        Returns an iterator over the Arrow record batches of the narrowed
+        result, read and filtered chunk_size rows at a time, or None."""
+        if self.query_cache is None or self.limit:
+            # With a limit, a cached result is not the whole superset.
+            return None
+        conjuncts = get_conjuncts(_filter)
+        if len(conjuncts) > MAX_NARROWED_CONJUNCTS:
+            return None
+        # Narrowest supersets first, they have the fewest files to filter.
+        largest = len(conjuncts) - 1 if strict else len(conjuncts)
+        for size in range(largest, -1, -1):
+            for kept in combinations(range(len(conjuncts)), size):
+                query = self._get_all_query(
+                    join_with_and(conjuncts[i] for i in kept), package)
+                if not self._is_cached(query):
+                    continue
+                rest = join_with_and(conjunct for i, conjunct
+                                     in enumerate(conjuncts)
+                                     if i not in kept)
+                try:
+                    match = rest.compile() if rest is not None else None
+                except NotImplementedError:
+                    return None
+                batches = self._get_cached_batches(query, chunk_size,
+                                                   self.query_cache)
+                if batches is None:
+                    continue
+                if match is None:
+                    return batches
+                return _filter_batches(batches, match)
+        return None
+
+    def _is_cached(self, query):
+        return (self.query_cache is not None
+                and self.query_cache.contains(query, self.project))
 
     def get_top_import_repo(self, n=None, _filter=None):
         """Get top imported repo. See RepoImportCounter for details.
@@ -152,15 +553,235 @@ class GithubPython:
             Returns a list of repo name.
 
         """
-        entries = self.get_all(_filter)
         ric = RepoImportCounter(self.package)
-        i = 0
-        for entry in entries:
-            if (i % 1000 == 0):
-                print(i)
-            ric.parse(entry)
-            i += 1
-        return ric.get_most_common(n)
+        fraction = self._run_analyzers([ric], _filter)
+        return self._scale_counts(ric.get_most_common(n), fraction)
+
+    def get_import_report(self, n=None, _filter=None, qualified=False):
+        """Get most imported classes, submodules, functions and top imported
+        repos with a single parse of every file.
+
+        Parameters
+        ----------
+        n : int or None, optional (default=None)
+                the top n results of each kind to be returned. If set to None,
+                all results will be returned.
+        _filter : Filter object or None (default=None)
+                Filter the result as defined in the filter object.
+        qualified : bool, optional (default=False)
+                If True, classes, submodules and functions are reported by
+                dotted path (e.g. "sklearn.metrics.auc") instead of by name.
+
+        Returns
+        -------
+        dict
+                Returns a dict with keys "CLASS", "SUBMODULE", "FUNCTION" and
+                "REPO", each mapping to a list of tuple (name, count).
+
+        """
+        analyzers = {ia_to_use: self._get_import_analyzer(ia_to_use)
+                     for ia_to_use in ("CLASS", "SUBMODULE", "FUNCTION")}
+        ric = RepoImportCounter(self.package)
+        fraction = self._run_analyzers(list(analyzers.values()) + [ric],
+                                       _filter)
+        analyzers["REPO"] = ric
+        return self._get_import_report(analyzers, n, qualified, fraction)
+
+    def get_import_reports(self, packages, n=None, _filter=None,
+                           qualified=False):
+        """Same as get_import_report for several packages at once: the files
+        containing any of the packages are fetched with a single query and
+        parsed once, and each file is analyzed for every package. With
+        exclude_forks="auto", the forks of any of the packages are excluded
+        for all of them.
+
+        Parameters
+        ----------
+        packages : list of string or dict
+                Names of the packages. A dict maps each name to its accepted
+                lists: a dict with keys "CLASS", "SUBMODULE" and "FUNCTION",
+                as given to set_class_list etc. Kinds without a list use the
+                default lists of the package, which only sklearn has; for
+                other packages they default to empty lists, so only their
+                "REPO" counts are reported unless lists are given.
+        n : int or None, optional (default=None)
+                the top n results of each kind to be returned. If set to None,
+                all results will be returned.
+        _filter : Filter object or None (default=None)
+                Filter the result as defined in the filter object.
+        qualified : bool, optional (default=False)
+                If True, classes, submodules and functions are reported by
+                dotted path (e.g. "sklearn.metrics.auc") instead of by name.
+
+        Returns
+        -------
+        dict
+                Returns a dict mapping each package to a dict as returned by
+                get_import_report.
+
+        """
+        if not isinstance(packages, dict):
+            packages = {package: {} for package in packages}
+        analyzers = {}
+        for package, accepted_lists in packages.items():
+            for ia_to_use in ("CLASS", "SUBMODULE", "FUNCTION"):
+                accepted_list = accepted_lists.get(
+                    ia_to_use, package.upper() + '_' + ia_to_use
+                    if package.lower() in DEFAULT_LIST_PACKAGES else [])
+                analyzers[package, ia_to_use] = ImportAnalyzer(
+                    package, accepted_list, loader=self._load_entries)
+            analyzers[package, "REPO"] = RepoImportCounter(package)
+        # Select the files containing any of the packages, as one regular
+        # expression.
+        fraction = self._run_analyzers(
+            list(analyzers.values()), _filter,
+            "|".join(re.escape(package) for package in packages))
+        reports = {package: {} for package in packages}
+        for (package, ia_to_use), analyzer in analyzers.items():
+            reports[package][ia_to_use] = self._scale_counts(
+                analyzer.get_most_common(n) if ia_to_use == "REPO" else
+                analyzer.get_most_common(n, qualified=qualified), fraction)
+        return reports
+
+    def refresh_import_report(self, state, n=None, _filter=None,
+                              qualified=False):
+        """Same as get_import_report, but only the files that changed since
+        the last refresh with the same state are analyzed: the ids of the
+        files are compared to the ids in the state, only new files are
+        fetched and parsed, and files that are gone are removed from the
+        saved results.
+
+        Parameters
+        ----------
+        state : AnalysisState or string
+                State of the analysis, or the path of its SQLite file. A state
+                only holds one analysis; if package, filter or accepted lists
+                change, it starts over.
+        n : int or None, optional (default=None)
+                the top n results of each kind to be returned. If set to None,
+                all results will be returned.
+        _filter : Filter object or None (default=None)
+                Filter the result as defined in the filter object.
+        qualified : bool, optional (default=False)
+                If True, classes, submodules and functions are reported by
+                dotted path (e.g. "sklearn.metrics.auc") instead of by name.
+
+        Returns
+        -------
+        dict
+                Returns a dict with keys "CLASS", "SUBMODULE", "FUNCTION" and
+                "REPO", each mapping to a list of tuple (name, count).
+
+        """
+        if not isinstance(state, AnalysisState):
+            state = AnalysisState(state, self.analysis_cache)
+        config = repr((self.package, str(_filter), self.exclude_forks,
+                       self.limit, self.class_list, self.submodule_list,
+                       self.function_list, self.sample_fraction))
+        analyzers = state.load_analyzers(config)
+        if analyzers is None:
+            analyzers = {ia_to_use: self._get_import_analyzer(ia_to_use)
+                         for ia_to_use in ("CLASS", "SUBMODULE", "FUNCTION")}
+            analyzers["REPO"] = RepoImportCounter(self.package)
+        new, removed = state.diff(self._iter_ids(_filter))
+        for entry, facts in state.pop_entries(removed):
+            for analyzer in analyzers.values():
+                if analyzer.fact_key in facts:
+                    analyzer._remove_facts(entry, facts[analyzer.fact_key])
+        # On the first refresh, or after a large change, all the files are
+        # fetched with the query the ids came from.
+        entries = state.add_entries(self._iter_entries_by_id(
+            new, superset=self._get_all_query(_filter)))
+        AnalyzerPipeline(list(analyzers.values()), n_jobs=self.n_jobs,
+                         cache=state, verbose=self.verbose).run(entries)
+        state.save_analyzers(config, analyzers)
+        for ia_to_use in ("CLASS", "SUBMODULE", "FUNCTION"):
+            analyzers[ia_to_use].loader = self._load_entries
+        return self._get_import_report(analyzers, n, qualified)
+
+    def _get_import_report(self, analyzers, n, qualified, fraction=1):
+        self.ia_class = analyzers["CLASS"]
+        self.ia_submodule = analyzers["SUBMODULE"]
+        self.ia_function = analyzers["FUNCTION"]
+        return {ia_to_use: self._scale_counts(
+                    analyzer.get_most_common(n) if ia_to_use == "REPO" else
+                    analyzer.get_most_common(n, qualified=qualified),
+                    fraction)
+                for ia_to_use, analyzer in analyzers.items()}
+
+    def _scale(self, count, fraction=1):
+        """Scale a count made on a sample up to all files: the files are
+        sampled with sample_fraction, and the table with fraction if the
+        query was run on a TABLESAMPLE. Without sampling, the count is
+        returned as is."""
+        fraction *= self.sample_fraction or 1
+        if fraction == 1:
+            return count
+        return scale_count(count, fraction)
+
+    def _scale_counts(self, counts, fraction=1):
+        """Same as _scale for a list of tuple (name, count)."""
+        fraction *= self.sample_fraction or 1
+        if fraction == 1:
+            return counts
+        return scale_counts(counts, fraction)
+
+    def _iter_ids(self, _filter=None, chunk_size=10000):
+        """Iterate over the ids of the files iter_entries would return."""
+        if self.corpus is not None:
+            return (entry.id for entry in self.iter_entries(_filter,
+                                                            chunk_size))
+        return (_id for batch in self._iter_batches(
+            self._get_query("id", _filter), chunk_size, allow_sample=False)
+            for _id in batch.column(0).to_pylist())
+
+    def _iter_entries_by_id(self, ids, chunk_size=10000, superset=None):
+        """Fetch the files with the given ids. BigQuery bills the whole
+        content column for every query, so the ids are looked up with as few
+        queries as possible, MAX_QUERY_IDS at a time passed as an array
+        parameter. If there are more ids and superset, a query of files
+        including all of them, is given, it is run instead (for the same
+        bytes billed as one lookup) and the files are picked from its
+        result. Files are streamed chunk_size at a time."""
+        if self.corpus is not None:
+            for i in range(0, len(ids), chunk_size):
+                yield from self.corpus.get_entries(ids[i:i + chunk_size])
+            return
+        if superset is not None and len(ids) > MAX_QUERY_IDS:
+            import pyarrow as pa
+            import pyarrow.compute as pc
+            wanted = pa.array(list(ids), pa.string())
+            for batch in self._iter_batches(superset, chunk_size,
+                                            allow_sample=False):
+                yield from BigQueryGithubEntry.from_arrow(batch.filter(
+                    pc.is_in(batch.column(0), value_set=wanted)))
+            return
+        query = ("SELECT id, content, repo_name, path FROM %s "
+                 "WHERE id IN UNNEST(@ids)" % self.py_files_unique)
+        for i in range(0, len(ids), MAX_QUERY_IDS):
+            for batch in self._iter_batches(query, chunk_size, [
+                    bigquery.ArrayQueryParameter(
+                        "ids", "STRING", list(ids[i:i + MAX_QUERY_IDS]))],
+                    allow_sample=False):
+                yield from BigQueryGithubEntry.from_arrow(batch)
+
+    def _run_analyzers(self, analyzers, _filter=None, package=None):
+        """Parse every entry subject to filter once, feeding all analyzers.
+        package is as in _iter_entries. Returns the fraction of the table the
+        entries were read from: less than 1 if the query was over budget and
+        run on a TABLESAMPLE."""
+        fractions = [1]
+
+        def iter_entries():
+            for batch in self._iter_entry_batches(_filter, package=package):
+                fractions.append(_get_sampled_fraction(batch))
+                yield from BigQueryGithubEntry.from_arrow(batch)
+        entries = (self._iter_entries(_filter, package=package)
+                   if self.corpus is not None else iter_entries())
+        AnalyzerPipeline(analyzers, n_jobs=self.n_jobs,
+                         cache=self.analysis_cache,
+                         verbose=self.verbose).run(entries)
+        return min(fractions)
 
     # The following functions are related to ImportAnalyzer
     def set_class_list(self, L):
@@ -198,9 +819,6 @@ class GithubPython:
 
     def _get_most_imported_helper(self, ia_to_use, n, use_count_less_than=None,
                                   use_count_more_than=None, _filter=None):
-        accepted_list = (self._get_accepted_list(ia_to_use)
-                         if self._get_accepted_list(ia_to_use)
-                         else self.package.upper() + '_' + ia_to_use)
         f = None
         if (not (use_count_more_than is None)
                 and not (use_count_less_than is None)):
@@ -209,7 +827,14 @@ class GithubPython:
             def f(x): return x[1] > use_count_more_than
         elif not (use_count_less_than is None):
             def f(x): return x[1] < use_count_less_than
-        return self._get_imported_info(n, _filter, accepted_list, ia_to_use, f)
+        return self._get_imported_info(n, _filter, ia_to_use, f)
+
+    def _get_import_analyzer(self, ia_to_use):
+        accepted_list = (self._get_accepted_list(ia_to_use)
+                         if self._get_accepted_list(ia_to_use)
+                         else self.package.upper() + '_' + ia_to_use)
+        return ImportAnalyzer(self.package, accepted_list,
+                              loader=self._load_entries)
 
     def _get_accepted_list(self, ia_to_use):
         if ia_to_use == "CLASS":
@@ -394,11 +1019,12 @@ class GithubPython:
                                               use_count_less_than,
                                               use_count_more_than, _filter)
 
-    def _get_imported_info(self, n, _filter, accepted_list, ia_to_use, f=None):
-        ia = ImportAnalyzer(self.package, accepted_list)
-        entries = self.get_all(_filter)
-        for entry in entries:
-            ia.parse(entry)
+    def _get_imported_info(self, n, _filter, ia_to_use, f=None):
+        if self.import_engine == "pushdown":
+            ia, fraction = self._get_pushdown_analyzer(ia_to_use, _filter)
+        else:
+            ia = self._get_import_analyzer(ia_to_use)
+            fraction = self._run_analyzers([ia], _filter)
         if ia_to_use == "CLASS":
             self.ia_class = ia
         elif ia_to_use == "SUBMODULE":
@@ -408,32 +1034,108 @@ class GithubPython:
         else:
             print("Wrong ia_to_use value! " % ia_to_use)
         if f:
-            return ia.get_by_filter(f)
-        if n >= 0:
-            return ia.get_most_common(n)
+            # Use counts are compared to the scaled counts.
+            return self._scale_counts(ia.get_by_filter(
+                lambda x: f((x[0], self._scale(x[1], fraction)))), fraction)
+        if n is None or n >= 0:
+            return self._scale_counts(ia.get_most_common(n), fraction)
+        else:
+            return self._scale_counts(ia.get_least_common(-n), fraction)
+
+    def _get_pushdown_analyzer(self, ia_to_use, _filter=None):
+        """Get an ImportAnalyzer whose counters are filled by the pushdown
+        engine, and the fraction of the table it counted (see
+        _run_analyzers). It has no sources."""
+        ia = self._get_import_analyzer(ia_to_use)
+        if self.corpus is not None:
+            ia.counter, ia.qualified_counter = count_imports(
+                (entry.code for entry in self.iter_entries(_filter)),
+                self.package, ia.accepted_list)
+            return ia, 1
+        res = self.run_arrow(get_import_count_query(
+            self._get_query("id, content", _filter), self.package,
+            ia.accepted_list))
+        for kind, symbol, count in _iter_rows(res.to_batches()):
+            counter = ia.counter if kind == "value" else ia.qualified_counter
+            counter[symbol] = count
+        return ia, _get_sampled_fraction(res)
+
+    def compare_import_engines(self, ia_to_use="CLASS", _filter=None,
+                               qualified=False):
+        """Count imports with both the local and the pushdown engine, and
+        report the values whose counts differ.
+
+        Parameters
+        ----------
+        ia_to_use : string, optional (default="CLASS")
+                "CLASS", "SUBMODULE" or "FUNCTION".
+        _filter : Filter object or None (default=None)
+                Filter the result as defined in the filter object.
+        qualified : bool, optional (default=False)
+                If True, values are compared by dotted path.
+
+        Returns
+        -------
+        list
+                Returns a list of tuple (value, local count, pushdown count),
+                largest differences first.
+
+        """
+        local = self._get_import_analyzer(ia_to_use)
+        self._run_analyzers([local], _filter)
+        pushdown = self._get_pushdown_analyzer(ia_to_use, _filter)[0]
+        if qualified:
+            local = local.qualified_counter
+            pushdown = pushdown.qualified_counter
         else:
-            return ia.get_least_common(-n)
+            local, pushdown = local.counter, pushdown.counter
+        return sorted(((value, local[value], pushdown[value])
+                       for value in set(local) | set(pushdown)
+                       if local[value] != pushdown[value]),
+                      key=lambda x: (-abs(x[1] - x[2]), x[0]))
 
-    def get_import_source(self, val):
-        """Returns a list of BigQueryGithubEntry that imported val.
+    def get_import_source(self, val, page=None, page_size=100):
+        """Returns a list of BigQueryGithubEntry that imported val. The code of
+        the files is fetched again when they are requested, so large results
+        are best read page by page.
 
         Parameters
         ----------
         val : string
                 The class/submodule/function to examine sources file on
 
+        page : int or None, optional (default=None)
+                If given, only return the page-th page_size entries (starting
+                from 0). If None, all entries are returned.
+
+        page_size : int, optional (default=100)
+                Number of entries per page.
+
         Returns
         -------
         list
                 Returns a list of BigQueryGithubEntry
         """
-        return (self.ia_class.get_source(val)
-                + self.ia_submodule.get_source(val)
-                + self.ia_function.get_source(val))
+        analyzers = (self.ia_class, self.ia_submodule, self.ia_function)
+        if page is None:
+            return [entry for ia in analyzers for entry in ia.iter_source(val)]
+        entries = []
+        start = page * page_size
+        for ia in analyzers:
+            left = page_size - len(entries)
+            if left == 0:
+                break
+            if start < ia.counter[val]:
+                entries.extend(islice(ia.iter_source(val, start, left), left))
+            start = max(0, start - ia.counter[val])
+        return entries
+
+    def _load_entries(self, ids):
+        """Fetch the files with the given ids, for ImportAnalyzer sources."""
+        return list(self._iter_entries_by_id(list(ids)))
 
     def run(self, query):
-        """Run SQL query with Google BigQuery. Allow large results. Timeout set
-        to 99999999.
+        """Run SQL query with Google BigQuery. See run_arrow.
 
         Parameters
         ----------
@@ -443,21 +1145,214 @@ class GithubPython:
 
         Returns
         -------
-        list
-                Returns result in python list.
+        pandas.DataFrame
+                Returns the result. In dry run mode, an empty frame with the
+                columns of the result.
 
         """
-        return run_query(query, self.project)
+        return self.run_arrow(query).to_pandas()
+
+    def run_arrow(self, query):
+        """Run SQL query with Google BigQuery and get the result as an Arrow
+        table. Results are stored in the query cache; queries that are not
+        cached are estimated first if dry_run is set or max_bytes_billed is
+        given, and the bytes they bill are added to bytes_billed.
+
+        Parameters
+        ----------
+        query: string
+                SQL query to be executed.
+
+
+        Returns
+        -------
+        pyarrow.Table
+                Returns the result. In dry run mode, an empty table with the
+                columns of the result.
+
+        """
+        res = self._get_cached(query)
+        if res is not None:
+            return res
+        query, res = self._check_prepared(query, self._prepare_query(query))
+        if res is not None:
+            return res
+        job = self._start_query(query)
+        res = _mark_sampled(query, job.result().to_arrow())
+        self._finish_query(query, job, res)
+        return res
+
+    def _get_cached(self, query):
+        if self.query_cache is None:
+            return None
+        return self.query_cache.get(query, self.project)
+
+    def _check_prepared(self, query, prepared):
+        """Returns the query to run and its result, if it is already known:
+        empty in dry run mode, or cached when the query was rewritten to a
+        sample of the table. prepared is as returned by _prepare_query."""
+        prepared, estimate = prepared
+        if prepared is None:
+            import pyarrow as pa
+            return query, pa.table({name: pa.array([], pa.null())
+                                    for name in estimate["columns"]})
+        if prepared != query:
+            return prepared, self._get_cached(prepared)
+        return query, None
+
+    def _start_query(self, query, query_parameters=None):
+        return start_query(query, self.project,
+                           maximum_bytes_billed=self.max_bytes_billed,
+                           query_parameters=query_parameters)
+
+    def _finish_query(self, query, job, res):
+        self._add_stats(_get_job_stats(job))
+        if self.query_cache is not None:
+            self.query_cache.set(query, self.project, res)
+
+    def estimate(self, query, query_parameters=None):
+        """Estimate the cost of a query with a dry run, and append it to
+        ``estimates``.
+
+        Parameters
+        ----------
+        query: string
+                SQL query to be estimated.
+
+        query_parameters: list or None, optional (default=None)
+                Parameters of the query.
+
+        Returns
+        -------
+        int
+                Returns the number of bytes the query would process.
 
-    def _get_query(self, select, _filter=None):
+        """
+        return self._dry_run(query, query_parameters)["bytes_processed"]
+
+    def _dry_run(self, query, query_parameters=None):
+        """Estimate a query, append the estimate to ``estimates`` and return
+        it. The estimate is returned rather than read back from
+        ``estimates``, where concurrent queries append theirs too."""
+        job = estimate_query(query, self.project, query_parameters)
+        estimate = {
+            "query": query,
+            "bytes_processed": job.total_bytes_processed,
+            "columns": [field.name for field in job.schema or []],
+        }
+        self.estimates.append(estimate)
+        return estimate
+
+    def _prepare_query(self, query, query_parameters=None,
+                       allow_sample=True):
+        """Estimate the query if needed and apply the byte budget. Returns the
+        query to run, or None in dry run mode, and the estimate of the query
+        that would run (as in ``estimates``), or None if it was not
+        estimated. If allow_sample is False, the query is never sampled, as
+        when the whole result is needed."""
+        if not self.dry_run and self.max_bytes_billed is None:
+            return query, None
+        estimate = self._dry_run(query, query_parameters)
+        if (self.max_bytes_billed is not None
+                and estimate["bytes_processed"] > self.max_bytes_billed):
+            if self.over_budget != "sample" or not allow_sample:
+                raise self._over_budget(estimate["bytes_processed"])
+            query, estimate = self._sample_query(
+                query, estimate["bytes_processed"], query_parameters)
+        return (None if self.dry_run else query), estimate
+
+    def _sample_query(self, query, estimate, query_parameters=None):
+        # TABLESAMPLE reads a random subset of the blocks of the unique python
+        # files, so the bytes processed shrink with the sampled percentage.
+        # Other tables, such as the fork subquery, are still read in full, so
+        # the sampled query is estimated again. Its cost is taken to be fixed
+        # plus proportional to the percentage, fitted from the estimates.
+        if self.py_files_unique not in query:
+            raise self._over_budget(estimate)
+        percent = int(10000 * self.max_bytes_billed / estimate) / 100
+        for _ in range(3):
+            if percent <= 0:
+                break
+            sampled = query.replace(self.py_files_unique,
+                                    "%s TABLESAMPLE SYSTEM (%g PERCENT)"
+                                    % (self.py_files_unique, percent))
+            sampled_estimate = self._dry_run(sampled, query_parameters)
+            if sampled_estimate["bytes_processed"] <= self.max_bytes_billed:
+                warnings.warn("Query would process %d bytes, over the budget "
+                              "of %d bytes: it is run on a %g%% sample of %s "
+                              "and its counts are scaled up."
+                              % (estimate, self.max_bytes_billed, percent,
+                                 self.py_files_unique))
+                return sampled, sampled_estimate
+            per_percent = ((estimate - sampled_estimate["bytes_processed"])
+                           / (100 - percent))
+            if per_percent <= 0:
+                break
+            fixed = estimate - 100 * per_percent
+            fitted = int(100 * (self.max_bytes_billed - fixed)
+                         / per_percent) / 100
+            if fitted >= percent:
+                break
+            percent = fitted
+        raise self._over_budget(estimate)
+
+    def _over_budget(self, estimate):
+        return QueryBudgetExceeded(
+            "Query would process %d bytes, over the budget of %d bytes!"
+            % (estimate, self.max_bytes_billed))
+
+    def _iter_batches(self, query, chunk_size=10000, query_parameters=None,
+                      allow_sample=True):
+        """Run a query and yield the result as Arrow record batches of about
+        chunk_size rows, with the dry run mode and byte budget. Like
+        run_arrow, the result is read from the query cache if it is there,
+        and stored to it while it is streamed otherwise. Queries with
+        parameters are not cached."""
+        cache = self.query_cache if query_parameters is None else None
+        batches = self._get_cached_batches(query, chunk_size, cache)
+        if batches is None:
+            prepared, _ = self._prepare_query(query, query_parameters,
+                                              allow_sample)
+            if prepared is None:
+                return
+            if prepared != query:
+                batches = self._get_cached_batches(prepared, chunk_size,
+                                                   cache)
+            query = prepared
+        if batches is not None:
+            yield from batches
+            return
+        job = self._start_query(query, query_parameters)
+        batches = (_mark_sampled(query, batch)
+                   for batch in _iter_batches(job, chunk_size))
+        if cache is not None:
+            batches = cache.set_batches(query, self.project, batches)
+        yield from batches
+        self._add_stats(_get_job_stats(job))
+
+    def _get_cached_batches(self, query, chunk_size, cache):
+        if cache is None:
+            return None
+        return cache.get_batches(query, self.project, chunk_size)
+
+    def _add_stats(self, stats):
+        self.bytes_billed += stats["bytes_billed"]
+        self.slot_millis += stats["slot_millis"]
+
+    def _get_query(self, select, _filter=None, package=None):
+        # package is the regular expression of the packages the files
+        # contain, self.package if None.
+        package = self.package if package is None else package
         where_clause = ""
-        if _filter or self.package:
+        if _filter or package or self.shard or self.sample_fraction:
             _filter_string = str(_filter) if _filter else ""
             where_clause = "WHERE "
             where_clause += connect_with_and(
                 _filter_string,
-                self._contains_package_string(),
-                *self._exclude_forks_string_list()
+                self._contains_package_string(package) if package else "",
+                self._shard_string(),
+                self._sample_string(),
+                *self._exclude_forks_string_list(package)
             )
 
         limit_clause = ""
@@ -474,99 +1369,197 @@ class GithubPython:
         """ % (select, self.py_files_unique, where_clause, limit_clause)
         return query
 
-    def _get_all_query(self, _filter=None):
-        return self._get_query("id, content, repo_name, path", _filter)
+    def _get_all_query(self, _filter=None, package=None):
+        return self._get_query("id, content, repo_name, path", _filter,
+                               package)
 
     def _get_count_query(self, _filter=None):
         return self._get_query("count(*)", _filter)
 
-    def _contains_package_string(self):
-        return 'REGEXP_CONTAINS(content,"%s")' % self.package
+    def _contains_package_string(self, package=None):
+        package = self.package if package is None else package
+        return 'REGEXP_CONTAINS(content,"%s")' % _escape_string(package)
 
     def _contains_package_string_standard_sql(self):
         return "NOT(STRPOS(content, '%s') = 0)" % self.package
 
-    def _exclude_forks_string_list(self):
-        if not self.exclude_forks:
+    def _shard_string(self):
+        if self.shard is None:
             return ""
-        exclude_list = []
-        if self.exclude_forks == "auto":
-            if self.package is None or self.package == "":
-                raise ValueError("Need to set package to exclude forks")
-            exclude_list = [self.package]
-        elif (type(self.exclude_forks) == list
-              or type(self.exclude_forks) == tuple):
-            exclude_list = list(self.exclude_forks)
-        else:
-            print("Unsupported exclude_forks!")
+        index, n_shards = self.shard
+        return "MOD(ABS(FARM_FINGERPRINT(id)), %d) = %d" % (n_shards, index)
 
-        string_builder = []
-        for keyword in exclude_list:
-            string_builder.append('REGEXP_CONTAINS(path,"%s")' % keyword)
-            string_builder.append('REGEXP_CONTAINS(repo_name,"%s")' % keyword)
+    def _sample_string(self):
+        # The id is salted, so samples are independent of shards. This only
+        # filters rows: the columns are still scanned, and billed, in full.
+        if self.sample_fraction is None:
+            return ""
+        return ("MOD(ABS(FARM_FINGERPRINT(CONCAT('sample', id))), %d) < %d"
+                % (SAMPLE_BUCKETS, sample_bucket(self.sample_fraction)))
 
-        all_forks = '''
-        SELECT DISTINCT(repo_name)
+    def create_sample_table(self, table):
+        """Write the sample of the unique python files to a table, so that
+        sampled queries scan the sample only. The sample predicate only
+        filters rows and does not reduce the bytes billed; querying the
+        sample table does. Give the returned name as py_files_unique, with
+        the same sample_fraction: the predicate keeps all of its rows, and
+        the counts are still scaled up. The full scan is billed once here.
 
-        FROM
-            %s
-        WHERE
-            %s
-        ''' % (self.py_files_all, connect_with_or(*string_builder))
+        Parameters
+        ----------
+        table : string
+                Name of the table to create or replace, as
+                project.dataset.table.
+
+        Returns
+        -------
+        string
+                returns the name of the table, quoted for use as
+                py_files_unique.
 
-        res = self.run(all_forks)
-        excluded_repos = ["STRPOS(repo_name, '%s') = 0" % repo_name
-                          for repo_name in res['repo_name']]
-        return excluded_repos
+        """
+        if self.sample_fraction is None:
+            raise ValueError("sample_fraction is not set!")
+        name = "`%s`" % table.strip("`")
+        query = ("CREATE OR REPLACE TABLE %s AS SELECT * FROM %s WHERE %s"
+                 % (name, self.py_files_unique, self._sample_string()))
+        prepared, _ = self._prepare_query(query, allow_sample=False)
+        if prepared is not None:
+            job = self._start_query(prepared)
+            job.result()
+            self._add_stats(_get_job_stats(job))
+        return name
+
+    def _exclude_forks_string_list(self, package=None):
+        # The fork repos are fetched once (see _get_fork_repos) and written
+        # into the query, so queries do not scan py_files_all again. The list
+        # is sorted, so the query, and its cached result, stay the same.
+        # Lists too long for a query are left to a subquery.
+        if not self._get_fork_keywords(package):
+            return []
+        repos = ", ".join('"%s"' % _escape_string(repo).replace('"', '\\"')
+                          for repo in sorted(self._get_fork_repos(package)))
+        if len(repos) > MAX_INLINED_FORKS_LENGTH:
+            return ["repo_name NOT IN (%s)" % self._get_fork_query(package)]
+        return ["repo_name NOT IN UNNEST([%s])" % repos] if repos else []
 
     def _exclude_forks_string_list_standard_sql(self):
+        return self._exclude_forks_string_list()
+
+    def _get_fork_keywords(self, package=None):
+        """Get the keywords of exclude_forks: repos with a repo_name or path
+        containing any of them are forks. With "auto", the keyword is
+        package, self.package if None."""
         if not self.exclude_forks:
-            return ""
+            return []
+        package = self.package if package is None else package
         exclude_list = []
         if self.exclude_forks == "auto":
-            exclude_list = [self.package]
+            if package is None or package == "":
+                raise ValueError("Need to set package to exclude forks")
+            exclude_list = [package]
         elif (type(self.exclude_forks) == list
               or type(self.exclude_forks) == tuple):
             exclude_list = list(self.exclude_forks)
         else:
             print("Unsupported exclude_forks!")
+        return exclude_list
 
+    def _get_fork_query(self, package=None):
         string_builder = []
-        for keyword in exclude_list:
+        for keyword in self._get_fork_keywords(package):
+            keyword = _escape_string(keyword)
             string_builder.append('REGEXP_CONTAINS(path,"%s")' % keyword)
             string_builder.append('REGEXP_CONTAINS(repo_name,"%s")' % keyword)
 
-        all_forks = '''
-        SELECT
-            DISTINCT(repo_name)
+        # NOT IN is never true if the subquery has a NULL.
+        return '''
+        SELECT DISTINCT(repo_name)
+
         FROM
             %s
         WHERE
-            %s
+            repo_name IS NOT NULL AND (%s)
         ''' % (self.py_files_all, connect_with_or(*string_builder))
-        res = self.run(all_forks)
-        excluded_repos = ["STRPOS(repo_name, '%s') = 0" % repo_name
-                          for repo_name in res['repo_name']]
-        return excluded_repos
 
-    def get_context(self, class_name):
-        """Get context for class usage.
+    def _get_fork_repos(self, package=None):
+        """Get the repos excluded as forks, i.e. the repos with a repo_name or
+        path containing any of exclude_forks. The repos are computed once per
+        set of keywords."""
+        exclude_list = self._get_fork_keywords(package)
+        if not exclude_list:
+            return []
+        key = tuple(exclude_list)
+        if key in self._fork_repos:
+            return self._fork_repos[key]
+        if self.corpus is not None:
+            repos = self.corpus.get_fork_repos(exclude_list)
+        else:
+            repos = self.run_arrow(self._get_fork_query(package)).column(
+                "repo_name").to_pylist()
+        # A dry run only estimates the fork query and has no repos.
+        if self.corpus is not None or not self.dry_run:
+            self._fork_repos[key] = repos
+        return repos
+
+    def export_corpus(self, path, _filter=None, chunk_size=10000):
+        """Download the files containing package (and matching the filter)
+        once into a LocalCorpus, together with what is needed to exclude
+        forks locally. Give the result as corpus to work offline.
+
+        Parameters
+        ----------
+        path : string
+                Path of the SQLite file to write.
+
+        _filter : Filter object or None, optional (default=None)
+                Only export files matching the filter.
+
+        chunk_size : int, optional (default=10000)
+                Number of rows fetched from BigQuery at a time.
+
+        Returns
+        -------
+        LocalCorpus
+                returns the exported corpus.
+
+        """
+        where_unique = connect_with_and(str(_filter) if _filter else "",
+                                        self._contains_package_string()
+                                        if self.package else "")
+        keywords = self._get_fork_keywords()
+        where_all = connect_with_or(*(
+            ['REGEXP_CONTAINS(path,"%s")' % k for k in keywords]
+            + ['REGEXP_CONTAINS(repo_name,"%s")' % k for k in keywords]))
+        return LocalCorpus.export(
+            path, self.project, self.py_files_unique, self.py_files_all,
+            "WHERE " + where_unique if where_unique else "",
+            "WHERE " + where_all if where_all else "WHERE FALSE", chunk_size)
+
+    def get_context(self, class_name, window=3):
+        """Get context for class usage: the lines that contain class_name,
+        with window lines before and after them. Lines are matched and cut
+        out by BigQuery, so only the snippets are downloaded.
 
         Parameters
         ----------
         class_name: string
                 Which class to examine context.
 
+        window : int, optional (default=3)
+                Number of lines kept before and after each matching line.
+
         Returns
         -------
-        list
-                Returns a list of tuple of (context_string, path, repo_name,
-                count).
+        pandas.DataFrame
+                Returns a frame with columns id, repo_name, path, line (the
+                number of the matching line, starting at 1), start_line (the
+                number of the first line of the snippet) and snippet.
 
         """
-        return self._get_context_all(class_name)
+        return _get_context_frame(self._get_snippets([class_name], window))
 
-    def get_instantiation(self, class_name):
+    def get_instantiation(self, class_name, window=20):
         """Get instantiation information for class usage.
 
         Parameters
@@ -574,6 +1567,11 @@ class GithubPython:
         class_name: string
                 Which class to examine instantiation.
 
+        window : int, optional (default=20)
+                Number of lines around each line containing class_name that
+                are parsed. Calls spanning more lines are only partly
+                analyzed.
+
         Returns
         -------
         dict
@@ -581,63 +1579,296 @@ class GithubPython:
                 value=dict(key=value_that_arg_sets_to, value=count))
 
         """
-        contexts = self._get_context_all(class_name)
-        analyzer = InstantiationAnalyzer(class_name)
-        #FIXME
-        for i in range(1, len(contexts)):
-            code = contexts[i][0]
-            analyzer.parse(code)
-        return analyzer.d
+        return self.get_instantiations([class_name], window)[class_name]
+
+    def get_instantiations(self, class_names, window=20):
+        """Get instantiation information for several classes, with a single
+        query for the lines containing any of them. Only the snippets around
+        these lines are parsed, each of them once.
+
+        Parameters
+        ----------
+        class_names: list of string
+                Which classes to examine instantiation.
+
+        window : int, optional (default=20)
+                Number of lines around each line containing a class that are
+                parsed. Calls spanning more lines are only partly analyzed.
 
-    def _get_context_all(self, class_name):
+        Returns
+        -------
+        dict
+                Returns a dict mapping each class name to a nested dict:
+                dict(key=arg, value=dict(key=value_that_arg_sets_to,
+                value=count))
+
+        """
+        return self._count_instantiations(
+            class_names, self._get_snippets(class_names, window)
+            if class_names else [])
+
+    def _count_instantiations(self, class_names, snippets):
+        analyzers = [InstantiationAnalyzer(class_name)
+                     for class_name in class_names]
+        if analyzers:
+            # Snippets are not whole files, so their facts are not cached by
+            # file id.
+            regions = (BigQueryGithubEntry(None, code, repo_name, path)
+                       for repo_name, path, code in _merge_snippets(snippets))
+            AnalyzerPipeline(analyzers, n_jobs=self.n_jobs).run(regions)
+        return {analyzer.class_name: analyzer.d for analyzer in analyzers}
+
+    def _get_snippets(self, class_names, window):
+        if self.corpus is not None:
+            return self.corpus.get_snippets(_get_pattern(class_names),
+                                            self.package,
+                                            self._get_fork_repos(), self.limit,
+                                            window, self.shard,
+                                            self.sample_fraction)
+        return list(_iter_rows(self.run_arrow(
+            self._get_snippets_query(class_names, window)).to_batches()))
+
+    def _get_snippets_query(self, class_names, window):
+        pattern = _get_pattern(class_names)
         limit_clause = ""
         if self.limit:
             limit_clause = "LIMIT %s" % self.limit
-        query = '''
-        #standardSQL
-        CREATE TEMPORARY FUNCTION parsePythonFile(a STRING)
-        RETURNS STRING
-        LANGUAGE js AS """
-        if (a === null) {
-          return null;
-        }
-        var lines = a.split('\\\\n');
-        for (i=0;i<lines.length;i++) {
-          if (lines[i].indexOf("%s")!==-1){
-            return a;
-          }
-        }
-        """;
-
-        CREATE TEMPORARY FUNCTION parsePythonFile2(a STRING, b STRING)
-        RETURNS STRING
-        LANGUAGE js AS """
-        if (a === null) {
-          return null;
-        }
-        var lines = a.split('\\\\n');
-        for (i=0;i<lines.length;i++) {
-          if (lines[i].indexOf("%s")!==-1){
-            return b;
-          }
-        }
-        """;
-
+        query = r"""
         SELECT
-        parsePythonFile(content) match,
-        parsePythonFile2(content,path) path,
-        parsePythonFile2(content,repo_name) repo_name,
-        count(*) count
-        FROM
-        `%s`
-        WHERE
-         %s
-        GROUP BY
-        1,2,3
-        ORDER BY
-        count DESC
-        ''' % (class_name, class_name, self.py_files_unique, connect_with_and(
+            id, repo_name, path, line_number + 1 AS line,
+            GREATEST(line_number - %d, 0) + 1 AS start_line,
+            ARRAY_TO_STRING(ARRAY(
+                SELECT text FROM UNNEST(lines) AS text WITH OFFSET AS n
+                WHERE n BETWEEN line_number - %d AND line_number + %d
+                ORDER BY n), '\n') AS snippet
+        FROM (
+            SELECT id, repo_name, path, SPLIT(content, '\n') AS lines
+            FROM %s
+            WHERE %s
+        ), UNNEST(lines) AS line_text WITH OFFSET AS line_number
+        WHERE REGEXP_CONTAINS(line_text, r'%s')
+        ORDER BY repo_name, path, line
+        %s
+        """ % (window, window, window, self.py_files_unique, connect_with_and(
+            "REGEXP_CONTAINS(content, r'%s')" % pattern,
             self._contains_package_string_standard_sql(),
+            self._shard_string(),
+            self._sample_string(),
             *self._exclude_forks_string_list_standard_sql()
-        )) + limit_clause
-        return self.run(query)
+        ), pattern, limit_clause)
+        return query
+
+    # The following functions are the asyncio variants of the functions
+    # above. BigQuery jobs are submitted and polled without blocking the
+    # event loop, so independent queries run concurrently when gathered.
+    # With a local corpus, they run the synchronous functions.
+    async def arun_arrow(self, query):
+        """Asyncio variant of run_arrow.
+
+        Parameters
+        ----------
+        query: string
+                SQL query to be executed.
+
+
+        Returns
+        -------
+        pyarrow.Table
+                Returns the result.
+
+        """
+        # Cache lookups and writes read and write files, and may look up the
+        # tables in BigQuery, so they run in worker threads too.
+        res = await _to_thread(self._get_cached, query)
+        if res is not None:
+            return res
+        prepared = await _to_thread(self._prepare_query, query)
+        query, res = await _to_thread(self._check_prepared, query, prepared)
+        if res is not None:
+            return res
+        job = await _to_thread(self._start_query, query)
+        # Only hold a thread for each status check, not for the whole job.
+        while not await _to_thread(job.done):
+            await asyncio.sleep(POLL_INTERVAL)
+        res = await _to_thread(
+            lambda: _mark_sampled(query, job.result().to_arrow()))
+        await _to_thread(self._finish_query, query, job, res)
+        return res
+
+    async def arun(self, query):
+        """Asyncio variant of run.
+
+        Parameters
+        ----------
+        query: string
+                SQL query to be executed.
+
+
+        Returns
+        -------
+        pandas.DataFrame
+                Returns the result.
+
+        """
+        return (await self.arun_arrow(query)).to_pandas()
+
+    async def aget_all(self, _filter=None):
+        """Asyncio variant of get_all.
+
+        Parameters
+        ----------
+        _filter : Filter object or None, optional (default=None)
+                Filter the result as defined in the filter object.
+
+        Returns
+        -------
+        list
+            Returns a list of BigQueryGithubEntry object
+
+        """
+        if self.corpus is not None:
+            return self.get_all(_filter)
+        # Building the query may fetch the fork repos.
+        query = await _to_thread(self._get_all_query, _filter)
+        entries = await _to_thread(self._get_narrowed_entries, query,
+                                   _filter)
+        if entries is None:
+            entries = list(BigQueryGithubEntry.from_arrow(
+                await self.arun_arrow(query)))
+        return entries
+
+    async def aget_count(self, _filter=None):
+        """Asyncio variant of get_count.
+
+        Parameters
+        ----------
+        _filter : Filter object or None, optional (default=None)
+                Filter the result as defined in the filter object.
+
+        Returns
+        -------
+        int
+            Returns an integer for count.
+
+        """
+        if self.corpus is not None:
+            return self.get_count(_filter)
+        query = await _to_thread(self._get_count_query, _filter)
+        counted = await _to_thread(self._get_narrowed_count, query, _filter)
+        if counted is None:
+            res = await self.arun_arrow(query)
+            counted = (res.column(0)[0].as_py() if res.num_rows else 0,
+                       _get_sampled_fraction(res))
+        return self._scale(*counted)
+
+    async def aget_context(self, class_name, window=3):
+        """Asyncio variant of get_context.
+
+        Parameters
+        ----------
+        class_name: string
+                Which class to examine context.
+
+        window : int, optional (default=3)
+                Number of lines kept before and after each matching line.
+
+        Returns
+        -------
+        pandas.DataFrame
+                Returns a frame with columns id, repo_name, path, line,
+                start_line and snippet.
+
+        """
+        return _get_context_frame(
+            await self._aget_snippets([class_name], window))
+
+    async def aget_instantiation(self, class_name, window=20):
+        """Asyncio variant of get_instantiation.
+
+        Parameters
+        ----------
+        class_name: string
+                Which class to examine instantiation.
+
+        window : int, optional (default=20)
+                Number of lines around each line containing class_name that
+                are parsed.
+
+        Returns
+        -------
+        dict
+                Returns a nested dict: dict(key=arg,
+                value=dict(key=value_that_arg_sets_to, value=count))
+
+        """
+        return (await self.aget_instantiations([class_name],
+                                               window))[class_name]
+
+    async def aget_instantiations(self, class_names, window=20):
+        """Asyncio variant of get_instantiations. The snippets are parsed in
+        a worker thread.
+
+        Parameters
+        ----------
+        class_names: list of string
+                Which classes to examine instantiation.
+
+        window : int, optional (default=20)
+                Number of lines around each line containing a class that are
+                parsed.
+
+        Returns
+        -------
+        dict
+                Returns a dict mapping each class name to a nested dict:
+                dict(key=arg, value=dict(key=value_that_arg_sets_to,
+                value=count))
+
+        """
+        snippets = (await self._aget_snippets(class_names, window)
+                    if class_names else [])
+        return await _to_thread(self._count_instantiations, class_names,
+                                snippets)
+
+    async def _aget_snippets(self, class_names, window):
+        if self.corpus is not None:
+            return self._get_snippets(class_names, window)
+        query = await _to_thread(self._get_snippets_query, class_names,
+                                 window)
+        return list(_iter_rows((await self.arun_arrow(query)).to_batches()))
+
+
+def _escape_string(string):
+    """Escape the backslashes of a regular expression in a BigQuery string
+    literal."""
+    return string.replace("\\", "\\\\")
+
+
+def _get_pattern(class_names):
+    return "|".join(re.escape(class_name) for class_name in class_names)
+
+
+def _get_context_frame(snippets):
+    import pandas as pd
+    return pd.DataFrame(snippets, columns=["id", "repo_name", "path", "line",
+                                           "start_line", "snippet"])
+
+
+def _merge_snippets(snippets):
+    """Merge the overlapping snippets of each file, so every line is parsed
+    once. Yields (repo_name, path, code) tuples."""
+    files = {}
+    for _id, repo_name, path, _, start_line, snippet in snippets:
+        lines = files.setdefault(_id, (repo_name, path, {}))[2]
+        for i, line in enumerate(snippet.split("\n")):
+            lines[start_line + i] = line
+    for repo_name, path, lines in files.values():
+        region = []
+        for number in sorted(lines):
+            if region and number != previous + 1:
+                yield repo_name, path, "\n".join(region) + "\n"
+                region = []
+            region.append(lines[number])
+            previous = number
+        if region:
+            yield repo_name, path, "\n".join(region) + "\n"
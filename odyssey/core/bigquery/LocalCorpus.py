@@ -0,0 +1,364 @@
+"""
+LocalCorpus.py
+====================================
+The module that defines LocalCorpus, a local copy of the BigQuery Github
+tables.
+
+"""
+import os
+import re
+import sqlite3
+import zlib
+from odyssey.core.bigquery.BlobStore import BlobStore, BlobEntry
+from odyssey.core.bigquery.filter import Contains
+from odyssey.utils.sampling import SAMPLE_BUCKETS, sample_bucket
+
+
+class LocalCorpus:
+    """A local copy of the python file tables (content_py_unique and
+    content_py_full). File contents are kept in a memory mapped BlobStore next
+    to a SQLite file holding ids, repo names, paths and the offset of each
+    content in the BlobStore. Given to GithubPython as ``corpus``, it answers
+    get_all, get_count, get_context and get_instantiation without running
+    BigQuery queries; filters, the package and fork exclusion are evaluated
+    locally, and the entries it returns read their code lazily."""
+
+    def __init__(self, path):
+        """Initialize the LocalCorpus. The file is created when data is first
+        added to it.
+
+        Parameters
+        ----------
+        path : string
+                Path of the SQLite file. Contents are stored in path +
+                ".blobs". ":memory:" keeps the index in memory and the
+                contents in a temporary file.
+
+        Returns
+        -------
+
+        object
+                returns an initialized LocalCorpus object.
+
+        """
+        self.path = path
+        self._connection = None
+        self._store = None
+
+    @classmethod
+    def export(cls, path, project, py_files_unique, py_files_all,
+               where_unique="", where_all="", chunk_size=10000):
+        """Download the BigQuery tables once into a LocalCorpus.
+
+        Parameters
+        ----------
+        path : string
+                Path of the SQLite file to write.
+
+        project : string
+                Project to run the export queries on.
+
+        py_files_unique : string
+                Dataset name for unique python files.
+
+        py_files_all : string
+                Dataset name for all python files.
+
+        where_unique : string, optional (default="")
+                WHERE clause restricting the unique files to export.
+
+        where_all : string, optional (default="")
+                WHERE clause restricting the (repo_name, path) rows exported
+                from all python files. Only used for fork exclusion.
+
+        chunk_size : int, optional (default=10000)
+                Number of rows fetched from BigQuery at a time.
+
+        Returns
+        -------
+        LocalCorpus
+                returns the exported corpus.
+
+        """
+        from odyssey.core.bigquery.GithubPython import iter_query
+        corpus = cls(path)
+        corpus.add_files(iter_query(
+            "SELECT id, content, repo_name, path FROM %s %s"
+            % (py_files_unique, where_unique), project, chunk_size))
+        corpus.add_all_files(iter_query(
+            "SELECT repo_name, path FROM %s %s"
+            % (py_files_all, where_all), project, chunk_size))
+        return corpus
+
+    def add_files(self, rows):
+        """Add unique python files.
+
+        Parameters
+        ----------
+        rows : iterable
+                Rows of (id, content, repo_name, path), or
+                BigQueryGithubEntry objects.
+
+        """
+        connection = self._connect()
+        store = self._get_store()
+
+        def stored(rows):
+            for row in rows:
+                if hasattr(row, 'code'):
+                    row = (row.id, row.code, row.repo_name, row.path)
+                _id, content, repo_name, path = row
+                offset, length = store.append(content)
+                yield _id, repo_name, path, offset, length
+
+        connection.executemany(
+            "INSERT OR REPLACE INTO content_py_unique VALUES (?, ?, ?, ?, ?)",
+            stored(rows))
+        store.flush()
+        connection.commit()
+
+    def add_all_files(self, rows):
+        """Add (repo_name, path) rows of all python files, forks included.
+
+        Parameters
+        ----------
+        rows : iterable
+                Rows of (repo_name, path).
+
+        """
+        connection = self._connect()
+        connection.executemany(
+            "INSERT INTO content_py_full VALUES (?, ?)",
+            (tuple(row) for row in rows))
+        connection.commit()
+
+    def iter_entries(self, package="", _filter=None, excluded_repos=(),
+                     limit=None, chunk_size=10000, shard=None,
+                     sample_fraction=None):
+        """Iterate over the unique files that contain package, match the
+        filter and do not belong to an excluded repo.
+
+        Parameters
+        ----------
+        package : string, optional (default="")
+                Regular expression the content has to contain.
+
+        _filter : Filter object or None, optional (default=None)
+                Filter the result as defined in the filter object.
+
+        excluded_repos : list of string, optional (default=())
+                Files of these repos are skipped.
+
+        limit : int or None, optional (default=None)
+                Maximum number of entries.
+
+        chunk_size : int, optional (default=10000)
+                Number of rows read from the SQLite file at a time.
+
+        shard : tuple or None, optional (default=None)
+                (index, n_shards): only return the files whose id hashes to
+                shard index out of n_shards.
+
+        sample_fraction : float or None, optional (default=None)
+                Only return the files whose id hashes into this fraction of
+                the files, see in_sample.
+
+        Returns
+        -------
+        generator
+                Yields BlobEntry objects, which read their code from the
+                BlobStore when it is accessed.
+
+        """
+        package = Contains(package).compile() if package else None
+        match = _filter.compile() if _filter is not None else None
+        excluded = set(excluded_repos)
+        store = self._get_store()
+        n = 0
+        cursor = self._connect().execute(
+            "SELECT id, repo_name, path, blob_offset, blob_length "
+            "FROM content_py_unique ORDER BY rowid")
+        while limit is None or n < limit:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                return
+            for _id, repo_name, path, offset, length in rows:
+                if shard is not None and get_shard(_id, shard[1]) != shard[0]:
+                    continue
+                if (sample_fraction is not None
+                        and not in_sample(_id, sample_fraction)):
+                    continue
+                if repo_name in excluded:
+                    continue
+                if package is not None or match is not None:
+                    content = store.read(offset, length)
+                    if package is not None and not package(content):
+                        continue
+                    if match is not None and not match(content):
+                        continue
+                yield BlobEntry(_id, store, offset, length, repo_name, path)
+                n += 1
+                if limit is not None and n >= limit:
+                    return
+
+    def iter_rows(self, package="", _filter=None, excluded_repos=(),
+                  limit=None, chunk_size=10000, shard=None,
+                  sample_fraction=None):
+        """Same as iter_entries, but yields rows of (id, content, repo_name,
+        path)."""
+        for entry in self.iter_entries(package, _filter, excluded_repos,
+                                       limit, chunk_size, shard,
+                                       sample_fraction):
+            yield entry.id, entry.code, entry.repo_name, entry.path
+
+    def get_entries(self, ids):
+        """Get the unique files with the given ids.
+
+        Parameters
+        ----------
+        ids : list of string
+                File ids to look up. Unknown ids are skipped.
+
+        Returns
+        -------
+        list
+                Returns a list of BlobEntry objects, in no particular order.
+
+        """
+        store = self._get_store()
+        connection = self._connect()
+        entries = []
+        ids = list(ids)
+        # Stay below SQLite's limit on the number of query parameters.
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            entries.extend(
+                BlobEntry(_id, store, offset, length, repo_name, path)
+                for _id, repo_name, path, offset, length in connection.execute(
+                    "SELECT id, repo_name, path, blob_offset, blob_length "
+                    "FROM content_py_unique WHERE id IN (%s)"
+                    % ", ".join("?" * len(chunk)), chunk))
+        return entries
+
+    def count(self, package="", _filter=None, excluded_repos=(), shard=None,
+              sample_fraction=None):
+        """Count the unique files that iter_rows would return without a
+        limit."""
+        return sum(1 for _ in self.iter_entries(
+            package, _filter, excluded_repos, shard=shard,
+            sample_fraction=sample_fraction))
+
+    def get_fork_repos(self, keywords):
+        """Get the repos in all python files whose repo_name or path contain
+        any of keywords.
+
+        Parameters
+        ----------
+        keywords : list of string
+                Regular expressions to look for.
+
+        Returns
+        -------
+        list
+                Returns a list of distinct repo names.
+
+        """
+        keywords = re.compile("|".join("(?:%s)" % k for k in keywords))
+        repos = {}
+        for repo_name, path in self._connect().execute(
+                "SELECT repo_name, path FROM content_py_full"):
+            if keywords.search(path) or keywords.search(repo_name):
+                repos[repo_name] = None
+        return list(repos)
+
+    def get_snippets(self, pattern, package="", excluded_repos=(),
+                     limit=None, window=3, shard=None, sample_fraction=None):
+        """Get the lines matching pattern with window lines around them, like
+        GithubPython.get_context.
+
+        Parameters
+        ----------
+        pattern : string
+                Regular expression searched for in each line.
+
+        package : string, optional (default="")
+                Regular expression the content has to contain.
+
+        excluded_repos : list of string, optional (default=())
+                Files of these repos are skipped.
+
+        limit : int or None, optional (default=None)
+                Maximum number of snippets.
+
+        window : int, optional (default=3)
+                Number of lines kept before and after each matching line.
+
+        shard : tuple or None, optional (default=None)
+                (index, n_shards), see iter_entries.
+
+        sample_fraction : float or None, optional (default=None)
+                Fraction of the files sampled, see iter_entries.
+
+        Returns
+        -------
+        list
+                Returns a list of (id, repo_name, path, line, start_line,
+                snippet) tuples sorted by repo_name, path and line. Line
+                numbers start at 1.
+
+        """
+        regex = re.compile(pattern)
+        snippets = []
+        for _id, content, repo_name, path in self.iter_rows(
+                package, None, excluded_repos, shard=shard,
+                sample_fraction=sample_fraction):
+            if not regex.search(content):
+                continue
+            lines = content.split("\n")
+            for i, line in enumerate(lines):
+                if regex.search(line):
+                    start = max(i - window, 0)
+                    snippets.append((_id, repo_name, path, i + 1, start + 1,
+                                     "\n".join(lines[start:i + window + 1])))
+        snippets.sort(key=lambda row: (row[1], row[2], row[3]))
+        return snippets[:limit] if limit is not None else snippets
+
+    def __getstate__(self):
+        """Pickle the location only, not the connection."""
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _connect(self):
+        if self._connection is None:
+            if self.path != ":memory:" and os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._connection = sqlite3.connect(self.path)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS content_py_unique (id TEXT "
+                "PRIMARY KEY, repo_name TEXT, path TEXT, blob_offset INTEGER, "
+                "blob_length INTEGER)")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS content_py_full (repo_name TEXT, "
+                "path TEXT)")
+        return self._connection
+
+    def _get_store(self):
+        if self._store is None:
+            self._store = BlobStore(None if self.path == ":memory:"
+                                    else self.path + ".blobs")
+        return self._store
+
+
+def get_shard(file_id, n_shards):
+    """The shard, out of n_shards, a file belongs to in a LocalCorpus. Stable
+    across processes and machines."""
+    return zlib.crc32(file_id.encode("utf-8")) % n_shards
+
+
+def in_sample(file_id, fraction):
+    """Whether a file is in the deterministic sample of the given fraction of
+    a LocalCorpus. The id is salted, so samples are independent of shards."""
+    return (zlib.crc32(("sample" + file_id).encode("utf-8")) % SAMPLE_BUCKETS
+            < sample_bucket(fraction))
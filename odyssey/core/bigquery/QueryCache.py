@@ -0,0 +1,331 @@
+"""
+QueryCache.py
+====================================
+The module that defines QueryCache.
+
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from odyssey.utils.cache_dir import get_cache_dir
+
+
+class QueryCache:
+    """QueryCache stores the results of BigQuery queries, keyed by the query
+    and the project, in a directory: one Parquet file per result and a SQLite
+    index of them. The cache has a size cap; the least recently used results
+    are evicted first. A result is dropped when one of the tables the query
+    reads (the names between backticks) was modified after it was stored."""
+
+    def __init__(self, directory=None, max_size=2 ** 30, check_tables=True,
+                 check_interval=300):
+        """Initialize the QueryCache. The directory is only created when the
+        cache is first used.
+
+        Parameters
+        ----------
+        directory : string or None, optional (default=None)
+            Directory of the stored results. If None, the queries directory
+            of the per-user cache directory is used, see
+            odyssey.utils.cache_dir.
+
+        max_size : int, optional (default=2 ** 30)
+            Maximum size of the stored results in bytes.
+
+        check_tables : bool, optional (default=True)
+            If True, results are dropped when the tables they were computed
+            from were modified since. If False, results never expire.
+
+        check_interval : int, optional (default=300)
+            Number of seconds the last modified time of a table is trusted
+            before it is looked up again.
+
+        Returns
+        -------
+
+        object
+            returns an initialized QueryCache object.
+
+        """
+        if directory is None:
+            directory = os.path.join(get_cache_dir(), "queries")
+        self.directory = directory
+        self.max_size = max_size
+        self.check_tables = check_tables
+        self.check_interval = check_interval
+        self.hits = 0
+        self.misses = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        # SQLite connections can only be used in the thread that made them,
+        # so each thread has its own.
+        self._local = threading.local()
+        self._modified = {}
+
+    def get(self, query, project):
+        """Get the stored result of a query.
+
+        Parameters
+        ----------
+        query : string
+            SQL query.
+
+        project : string
+            Project the query is run on.
+
+        Returns
+        -------
+        pyarrow.Table or None
+            returns the stored result, or None if it is not cached or stale.
+
+        """
+        path = self._lookup(query, project)
+        if path is None:
+            return None
+        import pyarrow.parquet as pq
+        return pq.read_table(path)
+
+    def get_batches(self, query, project, chunk_size=10000):
+        """Same as get, but the stored result is read lazily, chunk_size rows
+        at a time.
+
+        Returns
+        -------
+        iterator or None
+            returns an iterator over the record batches of the stored result,
+            or None if it is not cached or stale.
+
+        """
+        path = self._lookup(query, project)
+        if path is None:
+            return None
+        import pyarrow.parquet as pq
+        # The file is opened now, so it stays readable if it is evicted.
+        return pq.ParquetFile(path).iter_batches(batch_size=chunk_size)
+
+    def contains(self, query, project):
+        """Whether a result is stored for a query. It may be stale, and is not
+        counted as a hit or a miss."""
+        row = self._connect().execute(
+            "SELECT 1 FROM results WHERE key = ?",
+            (_get_key(query, project),)).fetchone()
+        return row is not None
+
+    def set(self, query, project, result):
+        """Store the result of a query, evicting the least recently used
+        results if the cache grows over max_size.
+
+        Parameters
+        ----------
+        query : string
+            SQL query.
+
+        project : string
+            Project the query was run on.
+
+        result : pyarrow.Table
+            Result of the query.
+
+        """
+        key = _get_key(query, project)
+        tables = self._get_tables_modified(query, project)
+        self._connect()
+        path = self._get_path(key)
+        # Write to a temporary file first, so other processes only ever read
+        # complete results.
+        import pyarrow.parquet as pq
+        pq.write_table(result, path + ".tmp")
+        os.replace(path + ".tmp", path)
+        self._add(key, tables)
+
+    def set_batches(self, query, project, batches):
+        """Store the result of a query while it is streamed: the batches are
+        yielded as they come and written to the cache at the same time. The
+        result is only stored once all the batches were consumed.
+
+        Parameters
+        ----------
+        query : string
+            SQL query.
+
+        project : string
+            Project the query was run on.
+
+        batches : iterable of pyarrow.RecordBatch
+            Result of the query.
+
+        Returns
+        -------
+        generator
+            Yields the batches.
+
+        """
+        key = _get_key(query, project)
+        tables = self._get_tables_modified(query, project)
+        path = self._get_path(key)
+        temporary = "%s.%s.tmp" % (path, uuid.uuid4().hex)
+        import pyarrow.parquet as pq
+        writer = None
+        complete = False
+        try:
+            for batch in batches:
+                if writer is None:
+                    self._connect()
+                    writer = pq.ParquetWriter(temporary, batch.schema)
+                writer.write_batch(batch)
+                yield batch
+            complete = True
+        finally:
+            if writer is not None:
+                writer.close()
+                if complete:
+                    os.replace(temporary, path)
+                    self._add(key, tables)
+                else:
+                    os.remove(temporary)
+
+    def get_size(self):
+        """Total size of the stored results in bytes."""
+        return self._connect().execute(
+            "SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+
+    def get_stats(self):
+        """Get the statistics of the cache.
+
+        Returns
+        -------
+        dict
+            returns the number of hits and misses and the bytes read and
+            written since the cache was initialized, and the number and size
+            of the stored results.
+
+        """
+        return {"hits": self.hits, "misses": self.misses,
+                "bytes_read": self.bytes_read,
+                "bytes_written": self.bytes_written,
+                "entries": len(self), "size": self.get_size()}
+
+    def clear(self):
+        """Remove everything in the cache."""
+        self._delete([key for key, in self._connect().execute(
+            "SELECT key FROM results")])
+
+    def __len__(self):
+        """Number of stored results."""
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def __getstate__(self):
+        """Pickle the settings only, not the connection."""
+        return {"directory": self.directory, "max_size": self.max_size,
+                "check_tables": self.check_tables,
+                "check_interval": self.check_interval}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _connect(self):
+        if getattr(self._local, "connection", None) is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._local.connection = sqlite3.connect(
+                os.path.join(self.directory, "index.sqlite"), timeout=60)
+            self._local.connection.execute(
+                "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, "
+                "size INTEGER, tables TEXT, last_used REAL)")
+        return self._local.connection
+
+    def _lookup(self, query, project):
+        """Path of the stored result of a query, or None if it is not cached
+        or stale. Counts the hit or miss."""
+        key = _get_key(query, project)
+        connection = self._connect()
+        row = connection.execute(
+            "SELECT size, tables FROM results WHERE key = ?",
+            (key,)).fetchone()
+        path = self._get_path(key)
+        if (row is None or not os.path.exists(path)
+                or self._is_stale(json.loads(row[1]), project)):
+            if row is not None:
+                self._delete([key])
+            self.misses += 1
+            return None
+        connection.execute("UPDATE results SET last_used = ? WHERE key = ?",
+                           (time.time(), key))
+        connection.commit()
+        self.hits += 1
+        self.bytes_read += row[0]
+        return path
+
+    def _add(self, key, tables):
+        """Index the result file of key, once it is written."""
+        connection = self._connect()
+        size = os.path.getsize(self._get_path(key))
+        connection.execute(
+            "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+            (key, size, json.dumps(tables), time.time()))
+        connection.commit()
+        self.bytes_written += size
+        if self.get_size() > self.max_size:
+            self._evict()
+
+    def _get_tables_modified(self, query, project):
+        """Last modified time of the tables the query reads, when the result
+        is stored."""
+        if not self.check_tables:
+            return {}
+        return {table: self._get_modified(table, project)
+                for table in _get_tables(query)}
+
+    def _get_path(self, key):
+        return os.path.join(self.directory, key + ".parquet")
+
+    def _is_stale(self, tables, project):
+        return any(self._get_modified(table, project) > modified
+                   for table, modified in tables.items())
+
+    def _get_modified(self, table, project):
+        """Last modified time of a table, as a timestamp."""
+        checked, modified = self._modified.get((table, project), (0, None))
+        if time.time() - checked > self.check_interval:
+            from google.cloud import bigquery
+            client = bigquery.Client(project=project)
+            modified = client.get_table(table).modified.timestamp()
+            self._modified[table, project] = (time.time(), modified)
+        return modified
+
+    def _delete(self, keys):
+        connection = self._connect()
+        for key in keys:
+            if os.path.exists(self._get_path(key)):
+                os.remove(self._get_path(key))
+        connection.executemany("DELETE FROM results WHERE key = ?",
+                               ((key,) for key in keys))
+        connection.commit()
+
+    def _evict(self):
+        # Evict down to 90% of max_size so eviction does not run on every set.
+        target = self.max_size * 0.9
+        size = self.get_size()
+        evicted = []
+        for key, entry_size in self._connect().execute(
+                "SELECT key, size FROM results ORDER BY last_used").fetchall():
+            if size <= target:
+                break
+            evicted.append(key)
+            size -= entry_size
+        self._delete(evicted)
+
+
+def _get_key(query, project):
+    return hashlib.sha256(
+        ("%s\n%s" % (project, query)).encode("utf-8")).hexdigest()
+
+
+def _get_tables(query):
+    """Names of the tables a query reads: the names between backticks."""
+    return sorted(set(re.findall(r"`([^`]+)`", query)))
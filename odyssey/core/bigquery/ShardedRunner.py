@@ -0,0 +1,222 @@
+"""
+ShardedRunner.py
+====================================
+The module that defines ShardedRunner.
+
+"""
+import json
+import os
+from odyssey.core.analyzer import (AnalysisCache, ImportAnalyzer,
+                                   InstantiationAnalyzer, RepoImportCounter)
+from odyssey.core.bigquery.GithubPython import GithubPython
+from odyssey.core.bigquery.LocalCorpus import LocalCorpus
+from odyssey.utils.cache_dir import get_cache_dir
+from odyssey.utils.state import dump_state, load_state
+
+IMPORT_KINDS = ("CLASS", "SUBMODULE", "FUNCTION")
+
+
+class ShardedRunner:
+    """ShardedRunner splits an analysis into shards of files by hash of the
+    file id, runs each shard in a separate process or on a separate machine,
+    and merges the results of the shards into one.
+
+    The analysis is described by a JSON manifest written once with create:
+    the GithubPython settings, the accepted lists, the classes analyzed for
+    instantiation, the number of shards and the file each shard saves its
+    analyzers to (next to the manifest). Each worker reads the manifest and
+    runs one shard with run_shard; reduce then merges the saved analyzers.
+    run does both with local processes."""
+
+    def __init__(self, manifest_path):
+        """Initialize the ShardedRunner from a manifest written by create.
+
+        Parameters
+        ----------
+        manifest_path : string
+                Path of the JSON manifest.
+
+        Returns
+        -------
+
+        object
+                returns an initialized ShardedRunner object.
+
+        """
+        self.manifest_path = manifest_path
+        with open(manifest_path) as f:
+            self.manifest = json.load(f)
+
+    @classmethod
+    def create(cls, manifest_path, n_shards, package, class_list=None,
+               submodule_list=None, function_list=None, instantiations=(),
+               **kwargs):
+        """Write the manifest of an analysis.
+
+        Parameters
+        ----------
+        manifest_path : string
+                Path of the JSON manifest to write.
+
+        n_shards : int
+                Number of shards the files are split into.
+
+        package : string
+                Name of python package to analyze.
+
+        class_list, submodule_list, function_list : list or None, optional
+                Accepted lists of the import analyzers, as given to
+                GithubPython.set_class_list etc. If None, the defaults of the
+                package are used.
+
+        instantiations : list of string, optional (default=())
+                Classes to analyze for instantiation.
+
+        kwargs :
+                Other GithubPython settings (exclude_forks, limit, project,
+                py_files_unique, py_files_all, analysis_cache,
+                query_cache). corpus is given as the path of a LocalCorpus
+                file. With analysis_cache, each shard uses its own
+                AnalysisCache file in the cache directory, so that shards
+                run at the same time do not wait for each other.
+
+        Returns
+        -------
+        ShardedRunner
+                returns the runner of the analysis.
+
+        """
+        name = os.path.splitext(os.path.basename(manifest_path))[0]
+        manifest = {
+            "n_shards": n_shards,
+            "github_python": dict(kwargs, package=package),
+            "class_list": class_list,
+            "submodule_list": submodule_list,
+            "function_list": function_list,
+            "instantiations": list(instantiations),
+            "shards": ["%s-%d.json.gz" % (name, i) for i in range(n_shards)],
+        }
+        with open(manifest_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        return cls(manifest_path)
+
+    def run_shard(self, index, n_jobs=1):
+        """Analyze the files of one shard and save the analyzers.
+
+        Parameters
+        ----------
+        index : int
+                Index of the shard, from 0 to n_shards - 1.
+
+        n_jobs : int, optional (default=1)
+                The number of worker processes used to parse files.
+
+        """
+        gp = self._get_github_python(shard=(index,
+                                            self.manifest["n_shards"]),
+                                     n_jobs=n_jobs,
+                                     analysis_cache=self._get_cache(index))
+        analyzers = self._get_analyzers(gp)
+        gp._run_analyzers(list(analyzers.values()))
+        path = self._get_shard_path(index)
+        # Write to a temporary file first, so a shard file is only ever seen
+        # complete.
+        dump_state({key: analyzer._get_state()
+                    for key, analyzer in analyzers.items()}, path + ".tmp")
+        os.replace(path + ".tmp", path)
+
+    def run(self, n_jobs=1):
+        """Run the shards that have not been saved yet in local processes,
+        then merge all shards.
+
+        Parameters
+        ----------
+        n_jobs : int, optional (default=1)
+                The number of shards run at the same time, as in joblib.
+
+        Returns
+        -------
+        dict
+                returns the merged analyzers, see reduce.
+
+        """
+        from joblib import Parallel, delayed
+        missing = [i for i in range(self.manifest["n_shards"])
+                   if not os.path.exists(self._get_shard_path(i))]
+        Parallel(n_jobs=n_jobs)(delayed(_run_shard)(self.manifest_path, i)
+                                for i in missing)
+        return self.reduce()
+
+    def reduce(self):
+        """Merge the analyzers saved by all shards.
+
+        Returns
+        -------
+        dict
+                returns a dict mapping "CLASS", "SUBMODULE" and "FUNCTION" to
+                ImportAnalyzer objects, "REPO" to a RepoImportCounter and each
+                class in instantiations to an InstantiationAnalyzer.
+
+        """
+        merged = None
+        for i in range(self.manifest["n_shards"]):
+            states = load_state(self._get_shard_path(i))
+            analyzers = {key: _get_analyzer_class(key)._from_state(state)
+                         for key, state in states.items()}
+            if merged is None:
+                merged = analyzers
+            else:
+                for key, analyzer in analyzers.items():
+                    merged[key].merge(analyzer)
+        gp = self._get_github_python()
+        for kind in IMPORT_KINDS:
+            merged[kind].loader = gp._load_entries
+        return {(key.split(":", 1)[1] if ":" in key else key): analyzer
+                for key, analyzer in merged.items()}
+
+    def _get_shard_path(self, index):
+        return os.path.join(os.path.dirname(self.manifest_path),
+                            self.manifest["shards"][index])
+
+    def _get_cache(self, index):
+        # Each shard has its own AnalysisCache file. SQLite lets one process
+        # write at a time and the cache keeps its write transaction open
+        # between flushes, so shards sharing the default cache would run
+        # one after the other. A shard always has the same files, so its
+        # cache is still used when it is run again.
+        if not self.manifest["github_python"].get("analysis_cache", True):
+            return False
+        return AnalysisCache(os.path.join(
+            get_cache_dir(), "analysis-shard-%d-of-%d.sqlite"
+            % (index, self.manifest["n_shards"])))
+
+    def _get_github_python(self, **kwargs):
+        settings = dict(self.manifest["github_python"], **kwargs)
+        if settings.get("corpus") is not None:
+            settings["corpus"] = LocalCorpus(settings["corpus"])
+        gp = GithubPython(**settings)
+        gp.set_class_list(self.manifest["class_list"])
+        gp.set_submodule_list(self.manifest["submodule_list"])
+        gp.set_function_list(self.manifest["function_list"])
+        return gp
+
+    def _get_analyzers(self, gp):
+        analyzers = {kind: gp._get_import_analyzer(kind)
+                     for kind in IMPORT_KINDS}
+        analyzers["REPO"] = RepoImportCounter(gp.package)
+        for class_name in self.manifest["instantiations"]:
+            analyzers["INSTANTIATION:" + class_name] = InstantiationAnalyzer(
+                class_name)
+        return analyzers
+
+
+def _get_analyzer_class(key):
+    if key == "REPO":
+        return RepoImportCounter
+    if key.startswith("INSTANTIATION:"):
+        return InstantiationAnalyzer
+    return ImportAnalyzer
+
+
+def _run_shard(manifest_path, index):
+    ShardedRunner(manifest_path).run_shard(index)
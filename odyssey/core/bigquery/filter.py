@@ -4,11 +4,52 @@ filter.py
 The module that defines Filters.
 
 """
+import re
 
 
 class Filter:
-    """Base class for other filters to inherit."""
-    pass
+    """Base class for other filters to inherit.
+
+    Besides their SQL string, filters compile into local predicates, so files
+    that were already downloaded can be filtered again without a query.
+    Subclasses that do not define compile still work in queries, but are
+    not evaluated locally."""
+
+    def compile(self):
+        """Compile the filter into a local predicate. Regular expressions are
+        compiled once, and And/Or stop at the first filter that decides.
+
+        Returns
+        -------
+        function
+                returns a function of the code content that returns whether it
+                matches the filter, as a bool.
+
+        Raises
+        ------
+        NotImplementedError
+                If the filter cannot be evaluated locally.
+
+        """
+        raise NotImplementedError("%s cannot be evaluated locally!"
+                                  % type(self).__name__)
+
+    def filter_entries(self, entries):
+        """Select the entries whose code matches the filter.
+
+        Parameters
+        ----------
+        entries: iterable of BigQueryGithubEntry
+                Entries to be filtered.
+
+        Returns
+        -------
+        generator
+                Yields the matching entries.
+
+        """
+        match = self.compile()
+        return (entry for entry in entries if match(entry.code))
 
 
 class Contains(Filter):
@@ -38,6 +79,14 @@ class Contains(Filter):
         appear in SQL query"""
         return "REGEXP_CONTAINS(content,'%s')" % self.s
 
+    def compile(self):
+        if re.escape(self.s) == self.s:
+            # A plain string, substring search is faster than a regex.
+            s = self.s
+            return lambda code: s in code
+        search = re.compile(self.s).search
+        return lambda code: search(code) is not None
+
 
 class And(Filter):
     """And filter takes in two filters and requires both to be true."""
@@ -69,6 +118,10 @@ class And(Filter):
         appear in SQL query"""
         return "(%s AND %s)" % (self.f1, self.f2)
 
+    def compile(self):
+        predicates = [f.compile() for f in _flatten(self, And)]
+        return lambda code: all(match(code) for match in predicates)
+
 
 class Or(Filter):
     """Or filter takes in two filters and requires one of them to be true."""
@@ -99,3 +152,43 @@ class Or(Filter):
         """String representation of the filter. Also the string that will
         appear in SQL query"""
         return "(%s OR %s)" % (self.f1, self.f2)
+
+    def compile(self):
+        predicates = [f.compile() for f in _flatten(self, Or)]
+        return lambda code: any(match(code) for match in predicates)
+
+
+def get_conjuncts(_filter):
+    """Get the filters joined by nested And filters, in order. A filter that
+    is not an And is its only conjunct, and None has none.
+
+    Parameters
+    ----------
+    _filter: Filter or None
+            Filter to be split.
+
+    Returns
+    -------
+    list
+            returns a list of filters.
+
+    """
+    if _filter is None:
+        return []
+    return _flatten(_filter, And)
+
+
+def join_with_and(filters):
+    """Inverse of get_conjuncts: join filters with nested And filters, left
+    to right. Returns None if there are no filters."""
+    joined = None
+    for _filter in filters:
+        joined = _filter if joined is None else And(joined, _filter)
+    return joined
+
+
+def _flatten(_filter, cls):
+    """The filters joined by nested filters of class cls, in order."""
+    if not isinstance(_filter, cls):
+        return [_filter]
+    return _flatten(_filter.f1, cls) + _flatten(_filter.f2, cls)
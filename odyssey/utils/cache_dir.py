@@ -0,0 +1,30 @@
+"""
+cache_dir.py
+====================================
+The module contains the helper function that locates the default directory
+of the caches of odyssey (AnalysisCache and QueryCache).
+
+"""
+import os
+
+# Environment variable overriding the default cache directory.
+CACHE_DIR_VARIABLE = "ODYSSEY_CACHE_DIR"
+
+
+def get_cache_dir():
+    """Get the default directory of the caches: $ODYSSEY_CACHE_DIR if it is
+    set, else the odyssey directory of the per-user cache directory
+    ($XDG_CACHE_HOME, or ~/.cache).
+
+    Returns
+    -------
+    string
+        returns the path of the directory. It is not created.
+
+    """
+    directory = os.environ.get(CACHE_DIR_VARIABLE)
+    if directory:
+        return os.path.expanduser(directory)
+    cache_home = (os.environ.get("XDG_CACHE_HOME")
+                  or os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(cache_home, "odyssey")
@@ -0,0 +1,326 @@
+"""
+imports.py
+====================================
+The module contains helper functions to turn import statements into import
+records, and to read which values of a package an import record imports.
+
+An import record is a list ``[kind, module, names]``: ``kind`` is "from" or
+"import", ``module`` is the list of names in the dotted module path and
+``names`` is the list of names imported from it (``["*"]`` for a star import,
+empty for plain imports). For example, ``from sklearn.svm import SVC as S``
+becomes ``["from", ["sklearn", "svm"], ["SVC"]]`` and ``import sklearn.svm``
+becomes ``["import", ["sklearn", "svm"], []]``. Relative imports have no
+record.
+
+Records only hold plain lists and strings, so they can be cached as JSON.
+
+"""
+import keyword
+import re
+from odyssey.utils.parse import parso_parse
+
+# Bump when the records extracted for a file change.
+VERSION = 1
+
+
+def get_import_records(node):
+    """Get the import records of an import_from or import_name parso node.
+
+    Parameters
+    ----------
+    node : parso node
+        An import_from or import_name node.
+
+    Returns
+    -------
+    list
+        returns a list of import records.
+
+    """
+    if node.type == 'import_from':
+        if node.level > 0:
+            return []
+        module = [name.value for name in node.get_from_names()]
+        return [["from", module, _get_from_import_names(node)]]
+    return [["import", [name.value for name in path], []]
+            for path in node.get_paths()]
+
+
+def get_imported_values(record, package):
+    """Get the values of package imported by an import record, in the order
+    they are written. The module path of a "from" import is included, so
+    ``from sklearn.svm import SVC`` imports "sklearn", "svm" and "SVC".
+
+    Parameters
+    ----------
+    record : list
+        An import record.
+
+    package : string
+        Python package to be counted.
+
+    Returns
+    -------
+    list
+        returns a list of imported values.
+
+    """
+    kind, module, names = record
+    if not module or module[0] != package:
+        return []
+    if kind == "import":
+        # import Library.A / import Library.A as B
+        return module[1:]
+    values = list(module) if len(module) > 1 else []
+    return values + [name for name in names if name != "*"]
+
+
+def get_imported_paths(record, package):
+    """Get the dotted paths of the values returned by get_imported_values, as
+    lists of names. ``from sklearn.svm import SVC`` imports ["sklearn"],
+    ["sklearn", "svm"] and ["sklearn", "svm", "SVC"].
+
+    Parameters
+    ----------
+    record : list
+        An import record.
+
+    package : string
+        Python package to be counted.
+
+    Returns
+    -------
+    list
+        returns a list of paths, in the same order as get_imported_values.
+
+    """
+    kind, module, names = record
+    if not module or module[0] != package:
+        return []
+    if kind == "import":
+        return [module[:i + 1] for i in range(1, len(module))]
+    paths = ([module[:i + 1] for i in range(len(module))]
+             if len(module) > 1 else [])
+    return paths + [module + [name] for name in names if name != "*"]
+
+
+def imports_package(record, package):
+    """Whether an import record imports package, or anything inside it."""
+    return bool(record[1]) and record[1][0] == package
+
+
+def _get_from_import_names(node):
+    if node.is_star_import():
+        return ["*"]
+    imports = node.children[-1]
+    if imports.type == 'operator' and imports.value == ")":
+        imports = node.children[-2]
+    if imports.type == "name":
+        # from Library import A
+        return [imports.value]
+    elif imports.type == "import_as_name":
+        # from Library import A as B
+        return [imports.children[0].value]
+    elif imports.type == "import_as_names":
+        names = []
+        for child in imports.children:
+            if child.type == "name":
+                # from Library import A, B
+                names.append(child.value)
+            elif child.type == "import_as_name":
+                # from Library import A, B as C
+                names.append(child.children[0].value)
+        return names
+    return []
+
+
+# Strings and comments are skipped over as a whole, so that the only other
+# matches are positions where a statement starts with "from" or "import":
+# the start of a line, or after ";" or ":" (e.g. "try: import x").
+_STATEMENT_RE = re.compile(r"""
+    (?:[rRbBuUfF]{1,2})?
+    (?:\"\"\"(?:\\[\s\S]|[^\\])*?\"\"\"
+      |'''(?:\\[\s\S]|[^\\])*?'''
+      |"(?:\\[\s\S]|[^"\\\n])*"
+      |'(?:\\[\s\S]|[^'\\\n])*')
+  | \#[^\n]*
+  | (?:^|[;:])[ \t\f]*(?P<start>(?=(?:from|import)\b))
+""", re.MULTILINE | re.VERBOSE)
+
+_TOKEN_RE = re.compile(r"""
+    (?P<skip>[ \t\f]+|\\\r?\n|\#[^\r\n]*)
+  | (?P<newline>\r?\n)
+  | (?P<name>[^\W\d]\w*)
+  | (?P<op>[.,()*;])
+  | (?P<other>.)
+""", re.VERBOSE)
+
+
+def scan_import_records(code):
+    """Get the import records of a file without building a parso tree.
+
+    A regular expression skips over strings and comments to find the
+    statements that start with "from" or "import", which are then tokenized
+    and classified on their own. Statements that cannot be classified are
+    parsed with parso. This gives the same records as walking the parso tree
+    of the whole file.
+
+    Parameters
+    ----------
+    code : string
+        code string to be scanned.
+
+    Returns
+    -------
+    list
+        returns a list of import records, in the order they are written.
+
+    """
+    if code.startswith('\ufeff'):
+        code = code[1:]
+    records = []
+    pos = 0
+    while True:
+        match = _STATEMENT_RE.search(code, pos)
+        if match is None:
+            return records
+        if match.group('start') is None:
+            pos = match.end()
+            continue
+        start = match.start('start')
+        tokens, end, complete = _tokenize_statement(code, start)
+        statement = _classify(tokens) if complete else None
+        if statement is None:
+            statement = _parse_statement(code[start:end])
+        records.extend(statement)
+        pos = max(end, start + 1)
+
+
+def _tokenize_statement(code, pos):
+    """Tokenize the logical line that starts at pos. Returns the tokens, the
+    position where the statement ends and whether it only contains tokens
+    that can appear in an import statement."""
+    tokens = []
+    depth = 0
+    complete = True
+    length = len(code)
+    while pos < length:
+        match = _TOKEN_RE.match(code, pos)
+        kind = match.lastgroup
+        if kind == 'newline' and depth == 0:
+            break
+        if kind == 'op':
+            value = match.group()
+            if value == ';' and depth == 0:
+                break
+            if value == '(':
+                depth += 1
+            elif value == ')':
+                depth -= 1
+            tokens.append(value)
+        elif kind == 'name':
+            tokens.append(match.group())
+        elif kind == 'other':
+            complete = False
+        pos = match.end()
+    return tokens, pos, complete and depth == 0
+
+
+def _classify(tokens):
+    """Turn the tokens of an import statement into import records, or return
+    None if the statement is not a well formed import."""
+    if tokens[0] == 'import':
+        records = []
+        i = 1
+        while True:
+            module, i = _dotted_name(tokens, i)
+            if module is None:
+                return None
+            if i < len(tokens) and tokens[i] == 'as':
+                if not _is_name(tokens, i + 1):
+                    return None
+                i += 2
+            records.append(["import", module, []])
+            if i == len(tokens):
+                return records
+            if tokens[i] != ',':
+                return None
+            i += 1
+    if len(tokens) > 1 and tokens[1] == '.':
+        # Relative import: check that it is well formed, it has no record.
+        i = 1
+        while i < len(tokens) and tokens[i] == '.':
+            i += 1
+        if tokens[i:i + 1] != ['import']:
+            _, i = _dotted_name(tokens, i)
+        if i is None or tokens[i:i + 1] != ['import']:
+            return None
+        return [] if _import_names(tokens, i + 1) is not None else None
+    module, i = _dotted_name(tokens, 1)
+    if module is None or tokens[i:i + 1] != ['import']:
+        return None
+    names = _import_names(tokens, i + 1)
+    if names is None:
+        return None
+    return [["from", module, names]]
+
+
+def _import_names(tokens, i):
+    if tokens[i:] == ['*']:
+        return ["*"]
+    end = len(tokens)
+    if tokens[i:i + 1] == ['(']:
+        if tokens[-1] != ')':
+            return None
+        i, end = i + 1, end - 1
+        if i < end and tokens[end - 1] == ',':
+            # A trailing comma is only allowed inside parentheses.
+            end -= 1
+    names = []
+    while True:
+        if not _is_name(tokens[:end], i):
+            return None
+        names.append(tokens[i])
+        i += 1
+        if i < end and tokens[i] == 'as':
+            if not _is_name(tokens[:end], i + 1):
+                return None
+            i += 2
+        if i == end:
+            return names
+        if tokens[i] != ',':
+            return None
+        i += 1
+
+
+def _dotted_name(tokens, i):
+    if not _is_name(tokens, i):
+        return None, None
+    names = [tokens[i]]
+    i += 1
+    while i + 1 < len(tokens) and tokens[i] == '.':
+        if not _is_name(tokens, i + 1):
+            return None, None
+        names.append(tokens[i + 1])
+        i += 2
+    return names, i
+
+
+def _is_name(tokens, i):
+    return (i < len(tokens) and tokens[i] not in _NOT_NAMES
+            and (tokens[i][0].isalpha() or tokens[i][0] == '_'))
+
+
+_NOT_NAMES = frozenset(keyword.kwlist)
+
+
+def _parse_statement(statement):
+    records = []
+    stack = [parso_parse(statement)]
+    while stack:
+        node = stack.pop()
+        if node.type in ('import_from', 'import_name'):
+            records.extend(get_import_records(node))
+        elif hasattr(node, 'children'):
+            stack.extend(reversed(node.children))
+    return records
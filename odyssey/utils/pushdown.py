@@ -0,0 +1,201 @@
+"""
+pushdown.py
+====================================
+The module contains helper functions to count imported values without parsing
+files: import statements are found line by line with regular expressions, in
+BigQuery (see get_import_count_query) or locally (see count_imports), and only
+the counts are returned.
+
+Statements are only found at the start of a line, outside of parentheses,
+so this is an approximation of ImportAnalyzer. Imports after ``;`` or ``:``
+(e.g. ``try: import sklearn.svm``) are missed, and imports inside strings are
+counted. The regular expressions are written in the syntax common to Python
+and BigQuery (RE2).
+
+"""
+import re
+from collections import Counter
+
+# An import statement at the start of a line. Parenthesized names of a
+# "from" import may span lines.
+STATEMENT_RE = (r"(?m)^[ \t]*("
+                r"from[ \t]+[\w.]+[ \t]+import[ \t]*\([^)]*\)"
+                r"|from[ \t]+[\w.]+[ \t]+import[^\n#;]*"
+                r"|import[ \t]+[^\n#;]*)")
+FROM_MODULE_RE = r"^from[ \t]+([\w.]+)"
+FROM_NAMES_RE = r"[ \t]import[ \t]*\(?([^)]*)"
+IMPORT_NAMES_RE = r"^import[ \t]+(.*)"
+NAME_RE = r"^[\s\\]*(\w+)"
+DOTTED_NAME_RE = r"^\s*([\w.]+)"
+
+
+def get_import_count_query(files_query, package, accepted_list):
+    """Build a BigQuery query counting, for each accepted value, the number of
+    distinct files importing it.
+
+    Parameters
+    ----------
+    files_query : string
+        Query selecting the id and content of the files to be analyzed.
+
+    package : string
+        Python package to be counted.
+
+    accepted_list : list of string
+        Bare names and dotted paths to be counted, as in SymbolIndex.
+
+    Returns
+    -------
+    string
+        returns a query with columns kind ("value" or "path"), symbol and
+        count. Rows of kind "value" count bare names, rows of kind "path"
+        count dotted paths.
+
+    """
+    names = [symbol for symbol in accepted_list if "." not in symbol]
+    dotted = [symbol for symbol in accepted_list if "." in symbol]
+    return r"""
+    WITH files AS (%s
+    ),
+    statements AS (
+        SELECT id, statement
+        FROM files, UNNEST(REGEXP_EXTRACT_ALL(content, r'%s')) AS statement
+    ),
+    modules AS (
+        SELECT
+            id, REGEXP_EXTRACT(statement, r'%s') AS module,
+            ARRAY(SELECT REGEXP_EXTRACT(piece, r'%s')
+                  FROM UNNEST(SPLIT(REGEXP_EXTRACT(statement, r'%s'), ','))
+                  AS piece) AS names,
+            1 AS min_parts
+        FROM statements
+        WHERE STARTS_WITH(statement, 'from')
+        UNION ALL
+        SELECT
+            id, REGEXP_EXTRACT(piece, r'%s') AS module,
+            ARRAY<STRING>[] AS names, 2 AS min_parts
+        FROM statements,
+            UNNEST(SPLIT(REGEXP_EXTRACT(statement, r'%s'), ',')) AS piece
+        WHERE STARTS_WITH(statement, 'import')
+    ),
+    paths AS (
+        SELECT DISTINCT id, path FROM (
+            SELECT id, ARRAY_TO_STRING(ARRAY(
+                SELECT part FROM UNNEST(SPLIT(module, '.')) AS part
+                WITH OFFSET AS j WHERE j <= i ORDER BY j), '.') AS path
+            FROM modules, UNNEST(SPLIT(module, '.')) WITH OFFSET AS i
+            WHERE STRPOS(module, '.') > 0 AND i + 1 >= min_parts
+            UNION ALL
+            SELECT id, CONCAT(module, '.', name) AS path
+            FROM modules, UNNEST(names) AS name
+            WHERE name IS NOT NULL
+        )
+    ),
+    accepted AS (
+        SELECT id, path, REGEXP_EXTRACT(path, r'(\w+)$') AS value
+        FROM paths
+        WHERE (path = '%s' OR STARTS_WITH(path, '%s.'))
+            AND (REGEXP_EXTRACT(path, r'(\w+)$') IN UNNEST(%s)
+                 OR path IN UNNEST(%s))
+    )
+    SELECT 'value' AS kind, value AS symbol, COUNT(DISTINCT id) AS count
+    FROM accepted GROUP BY value
+    UNION ALL
+    SELECT 'path' AS kind, path AS symbol, COUNT(DISTINCT id) AS count
+    FROM accepted GROUP BY path
+    """ % (files_query, STATEMENT_RE, FROM_MODULE_RE, NAME_RE,
+           FROM_NAMES_RE, DOTTED_NAME_RE, IMPORT_NAMES_RE, package, package,
+           _string_array(names), _string_array(dotted))
+
+
+def get_line_import_paths(code, package):
+    """Get the dotted paths of the values of package imported by a file, the
+    way get_import_count_query finds them.
+
+    Parameters
+    ----------
+    code : string
+        Content of the file.
+
+    package : string
+        Python package to be counted.
+
+    Returns
+    -------
+    set
+        returns the set of dotted paths, as lists of names joined by ".".
+
+    """
+    paths = set()
+    for statement in _STATEMENT.findall(code):
+        if statement.startswith("from"):
+            module = _FROM_MODULE.search(statement).group(1)
+            names = _FROM_NAMES.search(statement)
+            pieces = names.group(1).split(",") if names else []
+            modules = [(module, 1, [_search(_NAME, piece)
+                                    for piece in pieces])]
+        else:
+            modules = [(_search(_DOTTED_NAME, piece), 2, [])
+                       for piece in _search(_IMPORT_NAMES,
+                                            statement).split(",")]
+        for module, min_parts, names in modules:
+            if module is None:
+                continue
+            parts = module.split(".")
+            if "." in module:
+                paths.update(".".join(parts[:i + 1])
+                             for i in range(min_parts - 1, len(parts)))
+            paths.update(module + "." + name for name in names
+                         if name is not None)
+    return {path for path in paths
+            if path == package or path.startswith(package + ".")}
+
+
+def count_imports(codes, package, accepted_list):
+    """Count, for each accepted value, the number of files importing it, the
+    way get_import_count_query does.
+
+    Parameters
+    ----------
+    codes : iterable of string
+        Contents of the files.
+
+    package : string
+        Python package to be counted.
+
+    accepted_list : list of string
+        Bare names and dotted paths to be counted, as in SymbolIndex.
+
+    Returns
+    -------
+    tuple
+        returns a Counter of bare names and a Counter of dotted paths.
+
+    """
+    names = {symbol for symbol in accepted_list if "." not in symbol}
+    dotted = {symbol for symbol in accepted_list if "." in symbol}
+    values, qualified = Counter(), Counter()
+    for code in codes:
+        accepted = {path for path in get_line_import_paths(code, package)
+                    if path.rpartition(".")[2] in names or path in dotted}
+        values.update({path.rpartition(".")[2] for path in accepted})
+        qualified.update(accepted)
+    return values, qualified
+
+
+_STATEMENT = re.compile(STATEMENT_RE)
+_FROM_MODULE = re.compile(FROM_MODULE_RE)
+_FROM_NAMES = re.compile(FROM_NAMES_RE)
+_IMPORT_NAMES = re.compile(IMPORT_NAMES_RE)
+_NAME = re.compile(NAME_RE)
+_DOTTED_NAME = re.compile(DOTTED_NAME_RE)
+
+
+def _search(regex, string):
+    match = regex.search(string)
+    return match.group(1) if match else None
+
+
+def _string_array(strings):
+    return "ARRAY<STRING>[%s]" % ", ".join("'%s'" % string
+                                           for string in strings)
@@ -0,0 +1,78 @@
+"""
+sampling.py
+====================================
+The module contains helper functions to scale counts made on a sample of the
+files back up to the whole table, with confidence intervals.
+
+Files are sampled independently with probability ``fraction``, so a count x
+made on the sample estimates x / fraction files, with a standard error of
+sqrt(x * (1 - fraction)) / fraction (normal approximation of the binomial).
+
+"""
+import math
+
+# Files are in the sample if the hash of their id modulo SAMPLE_BUCKETS is
+# less than fraction * SAMPLE_BUCKETS.
+SAMPLE_BUCKETS = 1000000
+
+
+class Estimate(int):
+    """A count scaled up from a sample. It is the estimated count itself, so
+    it can be used wherever counts are, and holds its confidence interval in
+    ``low`` and ``high`` and the count in the sample in ``sample_count``."""
+
+    def __new__(cls, value, low, high, sample_count):
+        estimate = super().__new__(cls, value)
+        estimate.low = low
+        estimate.high = high
+        estimate.sample_count = sample_count
+        return estimate
+
+    def __repr__(self):
+        """Show the estimate with its confidence interval."""
+        return "Estimate(%d, low=%d, high=%d)" % (self, self.low, self.high)
+
+    def __reduce__(self):
+        return (Estimate, (int(self), self.low, self.high,
+                           self.sample_count))
+
+
+def scale_count(count, fraction, z=1.96):
+    """Scale a count made on a sample up to the whole table.
+
+    Parameters
+    ----------
+    count : int
+        Count in the sample.
+
+    fraction : float
+        Fraction of the files in the sample.
+
+    z : float, optional (default=1.96)
+        Number of standard errors on each side of the confidence interval.
+        1.96 gives a 95% interval.
+
+    Returns
+    -------
+    Estimate
+        returns the estimated count with its confidence interval. The lower
+        bound is never less than the count in the sample.
+
+    """
+    estimate = count / fraction
+    error = z * math.sqrt(count * (1 - fraction)) / fraction
+    return Estimate(round(estimate), max(count, math.floor(estimate - error)),
+                    math.ceil(estimate + error), count)
+
+
+def scale_counts(counts, fraction, z=1.96):
+    """Scale the counts of a list of tuple (name, count) with scale_count."""
+    return [(name, scale_count(count, fraction, z)) for name, count in counts]
+
+
+def sample_bucket(fraction):
+    """Number of hash buckets, out of SAMPLE_BUCKETS, in a sample of the given
+    fraction."""
+    if not 0 < fraction <= 1:
+        raise ValueError("sample_fraction should be in (0, 1]!")
+    return int(round(fraction * SAMPLE_BUCKETS))
@@ -0,0 +1,60 @@
+"""
+state.py
+====================================
+The module contains helper functions to save and load the state of analyzers,
+a dict of plain lists, numbers and strings, as gzip compressed JSON.
+
+"""
+import gzip
+import json
+from itertools import accumulate
+
+
+def dump_state(state, path):
+    """Save a state to path.
+
+    Parameters
+    ----------
+    state : dict
+        JSON serializable state.
+
+    path : string
+        Path of the file to write.
+
+    """
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        json.dump(state, f, separators=(',', ':'))
+
+
+def load_state(path):
+    """Load a state saved with dump_state.
+
+    Parameters
+    ----------
+    path : string
+        Path of the file to read.
+
+    Returns
+    -------
+    dict
+        returns the saved state.
+
+    """
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def encode_increasing(values):
+    """Encode increasing integers as the differences between consecutive
+    values, which are small and compress well."""
+    previous = 0
+    deltas = []
+    for value in values:
+        deltas.append(value - previous)
+        previous = value
+    return deltas
+
+
+def decode_increasing(deltas):
+    """Inverse of encode_increasing."""
+    return list(accumulate(deltas))
@@ -4,7 +4,9 @@ setup(
     name="odyssey",
     version="0.1",
     packages=find_packages(exclude=['joblib', 'docs', 'tests', '.cache']),
-    install_requires=['google-cloud-bigquery', 'parso', 'joblib'],
+    install_requires=['google-cloud-bigquery', 'parso', 'joblib>=1.3',
+                      'pyarrow'],
+    python_requires='>=3.7',
     author="Aishwarya Srinivasan",
     author_email="aishgrt@gmail.com",
     description="Tools for analyzing python package usage on GitHub through"
@@ -0,0 +1,41 @@
+import unittest
+from odyssey.core.analyzer import (AnalysisCache, AnalyzerPipeline,
+                                   ImportAnalyzer, RepoImportCounter)
+from .BigQueryGithubEntry_test import BigQueryGithubEntryMock
+
+
+class TestAnalysisCache(unittest.TestCase):
+
+    def test_get_set(self):
+        cache = AnalysisCache(":memory:")
+        self.assertIsNone(cache.get("a", "imports-1"))
+        cache.set("a", "imports-1", [["from", ["sklearn"], ["SVC"]]])
+        self.assertEqual(cache.get("a", "imports-1"),
+                         [["from", ["sklearn"], ["SVC"]]])
+        self.assertIsNone(cache.get("a", "imports-2"))
+        self.assertEqual(len(cache), 1)
+
+    def test_lru_eviction(self):
+        cache = AnalysisCache(":memory:", max_size=40)
+        cache.set("a", "k", ["x" * 10])
+        cache.set("b", "k", ["x" * 10])
+        cache.get("a", "k")
+        cache.set("c", "k", ["x" * 10])
+        # "b" is the least recently used
+        self.assertIsNone(cache.get("b", "k"))
+        self.assertIsNotNone(cache.get("a", "k"))
+        self.assertIsNotNone(cache.get("c", "k"))
+
+    def test_warm_run_skips_parse(self):
+        cache = AnalysisCache(":memory:")
+        entry = BigQueryGithubEntryMock()
+        cold = [ImportAnalyzer("sklearn", "SKLEARN_ALL"),
+                RepoImportCounter("sklearn")]
+        AnalyzerPipeline(cold, cache=cache).run([entry])
+        # The cached facts are used, so the code is never looked at.
+        entry.code = None
+        warm = [ImportAnalyzer("sklearn", "SKLEARN_ALL"),
+                RepoImportCounter("sklearn")]
+        AnalyzerPipeline(warm, cache=cache).run([entry])
+        self.assertEqual(cold[0].get_most_common(), warm[0].get_most_common())
+        self.assertEqual(cold[1].get_most_common(), warm[1].get_most_common())
@@ -0,0 +1,47 @@
+import unittest
+from odyssey.core.analyzer import AnalysisState
+from odyssey.core.bigquery.GithubPython import GithubPython
+from odyssey.core.bigquery.LocalCorpus import LocalCorpus
+from .BigQueryGithubEntry_test import BigQueryGithubEntryMock
+from .LocalCorpus_test import LocalCorpusMock
+
+
+class TestAnalysisState(unittest.TestCase):
+
+    def test_diff(self):
+        state = AnalysisState(":memory:")
+        entry = BigQueryGithubEntryMock()
+        list(state.add_entries([entry]))
+        state.set(entry.id, "imports-1", [["import", ["sklearn"], []]])
+        self.assertEqual(state.diff([entry.id, "b"]), (["b"], []))
+        self.assertEqual(state.diff(["b"]), (["b"], [entry.id]))
+        [(removed, facts)] = state.pop_entries([entry.id])
+        self.assertEqual(removed.repo_name, entry.repo_name)
+        self.assertIsNone(removed.code)
+        self.assertEqual(facts, {"imports-1": [["import", ["sklearn"], []]]})
+        self.assertEqual(len(state), 0)
+
+    def test_refresh_import_report(self):
+        corpus = LocalCorpusMock()
+        gp = GithubPython("sklearn", analysis_cache=False, corpus=corpus)
+        gp.set_class_list(["SVC"])
+        gp.set_submodule_list(["svm", "tree"])
+        gp.set_function_list([])
+        state = AnalysisState(":memory:")
+        self.assertEqual(gp.refresh_import_report(state),
+                         gp.get_import_report())
+        # "2" is gone, "5" is new
+        refreshed = LocalCorpus(":memory:")
+        refreshed.add_files(row for row in corpus.iter_rows()
+                            if row[0] != "2")
+        refreshed.add_files([("5", "from sklearn.svm import SVC\n", "e/v",
+                              "v.py")])
+        refreshed.add_all_files([("c/sklearn", "z.py")])
+        gp.corpus = refreshed
+        self.assertEqual(state.diff(gp._iter_ids()), (["5"], ["2"]))
+        report = gp.refresh_import_report(state)
+        self.assertEqual([e.id for e in gp.get_import_source("SVC")],
+                         ["1", "5"])
+        self.assertEqual(report["CLASS"], [("SVC", 2)])
+        self.assertEqual(report["SUBMODULE"], [("svm", 2)])
+        self.assertEqual(report, gp.get_import_report())
@@ -0,0 +1,123 @@
+import importlib
+import os
+import pickle
+import tempfile
+import unittest
+from odyssey.core.analyzer import (AnalysisCache, AnalyzerPipeline,
+                                   ImportAnalyzer, InstantiationAnalyzer,
+                                   RepoImportCounter)
+from odyssey.core.bigquery.BigQueryGithubEntry import BigQueryGithubEntry
+from odyssey.core.bigquery.BlobStore import BlobEntry, BlobStore
+from .BigQueryGithubEntry_test import BigQueryGithubEntryMock
+
+
+class TestAnalyzerPipeline(unittest.TestCase):
+
+    def test_run_matches_separate_parse(self):
+        entries = [BigQueryGithubEntryMock(),
+                   BigQueryGithubEntryMock("import os\n"),
+                   BigQueryGithubEntryMock("from sklearn.svm import SVC\n"
+                                           "clf = KMeans(n_clusters=3)\n")]
+        ia = ImportAnalyzer("sklearn", "SKLEARN_ALL")
+        ric = RepoImportCounter("sklearn")
+        inst = InstantiationAnalyzer("KMeans")
+        AnalyzerPipeline([ia, ric, inst]).run(entries)
+
+        ia_alone = ImportAnalyzer("sklearn", "SKLEARN_ALL")
+        ric_alone = RepoImportCounter("sklearn")
+        inst_alone = InstantiationAnalyzer("KMeans")
+        for entry in entries:
+            ia_alone.parse(entry)
+            ric_alone.parse(entry)
+            inst_alone.parse(entry.code)
+        self.assertEqual(ia.get_most_common(), ia_alone.get_most_common())
+        self.assertEqual(ric.get_most_common(), ric_alone.get_most_common())
+        self.assertEqual(inst.d, inst_alone.d)
+        self.assertEqual(inst.d["n_clusters"]["3"], 1)
+        # files without the import are not counted for the repo
+        self.assertEqual(ric.get_most_common(), [("abhi252/GloVeGraphs", 2)])
+
+
+    def test_run_batches(self):
+        import pyarrow as pa
+        codes = ["from sklearn.svm import SVC\n", "import os\n",
+                 "import sklearn\n"]
+        batch = pa.RecordBatch.from_pydict({
+            "id": ["1", "2", "3"], "content": codes,
+            "repo_name": ["a/x", "a/x", "b/y"],
+            "path": ["x.py", "y.py", "z.py"]})
+        ric = RepoImportCounter("sklearn")
+        AnalyzerPipeline([ric]).run_batches([batch.slice(0, 2),
+                                             batch.slice(2)])
+        self.assertEqual(ric.get_most_common(), [("a/x", 1), ("b/y", 1)])
+
+    def test_parallel_matches_serial(self):
+        entries = [BigQueryGithubEntryMock(),
+                   BigQueryGithubEntryMock("import os\n"),
+                   BigQueryGithubEntryMock("from sklearn.svm import SVC\n"
+                                           "clf = KMeans(n_clusters=3)\n")]
+        serial = [ImportAnalyzer("sklearn", "SKLEARN_ALL"),
+                  RepoImportCounter("sklearn"),
+                  InstantiationAnalyzer("KMeans")]
+        parallel = [a._empty_copy() for a in serial]
+        AnalyzerPipeline(serial).run(entries)
+        AnalyzerPipeline(parallel, n_jobs=2, batch_size=1).run(iter(entries))
+        self.assertEqual(serial[0].get_most_common(),
+                         parallel[0].get_most_common())
+        self.assertEqual(serial[1].get_most_common(),
+                         parallel[1].get_most_common())
+        self.assertEqual(serial[2].d, parallel[2].d)
+        self.assertEqual(serial[2].counter, parallel[2].counter)
+
+    def test_parallel_with_cache(self):
+        # More batches than joblib dispatches at first, so that the next ones
+        # are dispatched while results come back.
+        entries = [BigQueryGithubEntry("%040x" % i, "import sklearn\n"
+                                       "from sklearn.svm import SVC\n",
+                                       "a/x%d" % (i % 3), "x.py")
+                   for i in range(60)]
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        cache = AnalysisCache(os.path.join(directory.name, "cache.sqlite"))
+        for _ in range(2):
+            ric = RepoImportCounter("sklearn")
+            AnalyzerPipeline([ric], n_jobs=2, batch_size=2,
+                             cache=cache).run(iter(entries))
+            self.assertEqual(ric.get_most_common(),
+                             [("a/x0", 20), ("a/x1", 20), ("a/x2", 20)])
+        self.assertEqual(len(cache), 60)
+
+    def test_parallel_blob_entries(self):
+        store = BlobStore()
+        codes = ["from sklearn.svm import SVC\n" * 1000, "import sklearn\n"]
+        entries = [BlobEntry("%040x" % i, store, *store.append(code),
+                             "a/x%d" % i, "x.py")
+                   for i, code in enumerate(codes)]
+        pipeline = importlib.import_module(
+            "odyssey.core.analyzer.AnalyzerPipeline")
+        # Workers are sent the place of the code in the store, not the code.
+        source, keys = pipeline._get_job(entries[0], ["imports"])
+        self.assertIs(source, entries[0])
+        self.assertLess(len(pickle.dumps(source)), 500)
+        ric = RepoImportCounter("sklearn")
+        AnalyzerPipeline([ric], n_jobs=2, batch_size=1).run(entries)
+        self.assertEqual(ric.get_most_common(), [("a/x0", 1), ("a/x1", 1)])
+
+    def test_file_parsed_once_for_all_classes(self):
+        pipeline = importlib.import_module(
+            "odyssey.core.analyzer.AnalyzerPipeline")
+        parsed = []
+        parso_parse = pipeline.parso_parse
+        self.addCleanup(setattr, pipeline, "parso_parse", parso_parse)
+
+        def counting_parse(code):
+            parsed.append(code)
+            return parso_parse(code)
+        pipeline.parso_parse = counting_parse
+        # The unclosed call cannot be delimited, so the whole file is parsed.
+        code = "a = SVC(C=1)\nb = KMeans(n_clusters=2)\nc = SVC(C=2\n"
+        svc, kmeans = (InstantiationAnalyzer("SVC"),
+                       InstantiationAnalyzer("KMeans"))
+        AnalyzerPipeline([svc, kmeans]).run([BigQueryGithubEntryMock(code)])
+        self.assertEqual(parsed, [code])
+        self.assertEqual(dict(kmeans.d["n_clusters"]), {"2": 1})
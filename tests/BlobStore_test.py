@@ -0,0 +1,27 @@
+import pickle
+import unittest
+from odyssey.core.bigquery.BlobStore import BlobStore, BlobEntry
+
+
+class TestBlobStore(unittest.TestCase):
+
+    def test_append_read(self):
+        store = BlobStore()
+        first = store.append("import sklearn\n")
+        second = store.append("print('é')\n")
+        self.assertEqual(store.read(*second), "print('é')\n")
+        self.assertEqual(store.read(*first), "import sklearn\n")
+        third = store.append("x = 1\n")
+        self.assertEqual(store.read(*third), "x = 1\n")
+
+    def test_blob_entry(self):
+        store = BlobStore()
+        offset, length = store.append("import sklearn\n" * 1000)
+        entry = BlobEntry("id", store, offset, length, "a/b", "c.py")
+        self.assertEqual(entry.code, "import sklearn\n" * 1000)
+        self.assertEqual(entry.get_url(),
+                         "https://github.com/a/b/tree/master/c.py")
+        # Pickling an entry does not copy its code
+        data = pickle.dumps(entry)
+        self.assertLess(len(data), 500)
+        self.assertEqual(pickle.loads(data).code, entry.code)
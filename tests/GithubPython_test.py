@@ -1,5 +1,28 @@
+import asyncio
+import io
+import re
+import tempfile
+import time
 import unittest
-from odyssey.core.bigquery.GithubPython import GithubPython
+from unittest import mock
+from contextlib import redirect_stdout
+import pyarrow as pa
+from odyssey.core.bigquery import GithubPython as github_python
+from odyssey.core.bigquery.GithubPython import (GithubPython,
+                                                 QueryBudgetExceeded)
+from odyssey.core.bigquery.QueryCache import QueryCache
+from odyssey.core.bigquery.filter import And, Contains, Filter
+
+
+def fake_dry_run(gp, get_bytes):
+    """Replace the dry runs of gp: get_bytes(query) is the estimate."""
+    def dry_run(query, query_parameters=None):
+        estimate = {"query": query, "bytes_processed": get_bytes(query),
+                    "columns": (["f0_"] if "count(*)" in query else
+                                ["id", "content", "repo_name", "path"])}
+        gp.estimates.append(estimate)
+        return estimate
+    gp._dry_run = dry_run
 
 
 class TestGithubPython(unittest.TestCase):
@@ -24,3 +47,355 @@ class TestGithubPython(unittest.TestCase):
         self.assertTrue('REGEXP_CONTAINS(content,"sklearn")'
                         in a._get_all_query())
         self.assertTrue("count(*)" in a._get_count_query())
+
+    def test_dry_run(self):
+        a = GithubPython("sklearn", False, dry_run=True,
+                         query_cache=False)
+        fake_dry_run(a, lambda query: 10)
+        self.assertEqual(a.get_count(), 0)
+        self.assertEqual(a.get_all(), [])
+        self.assertEqual(len(a.estimates), 2)
+        self.assertEqual(a.estimate(a._get_count_query()), 10)
+        self.assertEqual(a.bytes_billed, 0)
+
+        async def gather():
+            return await asyncio.gather(*(
+                coroutine for _ in range(5)
+                for coroutine in (a.aget_count(), a.aget_all())))
+        # Each query gets the columns of its own estimate.
+        self.assertEqual(asyncio.run(gather()), [0, []] * 5)
+
+    def test_byte_budget(self):
+        a = GithubPython("sklearn", False, max_bytes_billed=100,
+                         query_cache=False)
+        fake_dry_run(a, lambda query: 1000)
+        with self.assertRaises(QueryBudgetExceeded):
+            a._prepare_query(a._get_count_query())
+        a.over_budget = "sample"
+        # The sampled query is estimated again, and is still over budget.
+        with self.assertRaises(QueryBudgetExceeded):
+            a._prepare_query(a._get_count_query())
+
+        def estimate(query):
+            # 60 bytes read in full, as by a fork subquery, and 10 bytes per
+            # percent of the unique files.
+            match = re.search(r"\(([\d.]+) PERCENT\)", query)
+            return 60 + 10 * (float(match.group(1)) if match else 100)
+        fake_dry_run(a, estimate)
+        with self.assertWarns(UserWarning):
+            query, _ = a._prepare_query(a._get_count_query())
+        self.assertTrue("%s TABLESAMPLE SYSTEM (4 PERCENT)"
+                        % a.py_files_unique in query)
+
+        class JobMock:
+            total_bytes_billed = 100
+            slot_millis = 5
+
+            def result(self):
+                return self
+
+            def to_arrow(self):
+                return pa.table({"f0_": [5]})
+        a._start_query = lambda query, query_parameters=None: JobMock()
+        with self.assertWarns(UserWarning):
+            count = a.get_count()
+        # The count on the 4% sample is scaled up.
+        self.assertEqual((count, count.sample_count), (125, 5))
+        fake_dry_run(a, lambda query: 50)
+        self.assertEqual(a._prepare_query(a._get_count_query())[0],
+                         a._get_count_query())
+
+    def test_exclude_forks(self):
+        a = GithubPython("sklearn", query_cache=False)
+        queries = []
+
+        def run_arrow(query):
+            queries.append(query)
+            return pa.table({"repo_name": ["c/sklearn", "b/sklearn"]})
+        a.run_arrow = run_arrow
+        # The fork repos are fetched once and written into the queries.
+        where = a._exclude_forks_string_list()
+        self.assertEqual(where, ['repo_name NOT IN UNNEST(["b/sklearn", '
+                                 '"c/sklearn"])'])
+        self.assertEqual(a._exclude_forks_string_list(), where)
+        self.assertFalse(a.py_files_all in a._get_count_query())
+        self.assertEqual(len(queries), 1)
+        self.assertTrue(a.py_files_all in queries[0])
+        self.assertEqual(a._get_fork_repos(), ["c/sklearn", "b/sklearn"])
+        # Too many to write into the query.
+        with mock.patch.object(github_python, "MAX_INLINED_FORKS_LENGTH", 10):
+            where = a._exclude_forks_string_list()
+        self.assertTrue(where[0].startswith("repo_name NOT IN ("))
+        self.assertTrue(a.py_files_all in where[0])
+        self.assertEqual(GithubPython("sklearn", False)
+                         ._exclude_forks_string_list(), [])
+
+    def test_import_reports_query(self):
+        a = GithubPython("", analysis_cache=False, query_cache=False)
+        queries = []
+
+        def iter_batches(query, chunk_size=10000):
+            # The instance is not changed while the files are read.
+            self.assertEqual(a.package, "")
+            queries.append(query)
+            return iter([])
+
+        def run_arrow(query):
+            queries.append(query)
+            return pa.table({"repo_name": ["c/sklearn"]})
+        a._iter_batches = iter_batches
+        a.run_arrow = run_arrow
+        lists = {"CLASS": [], "SUBMODULE": [], "FUNCTION": []}
+        a.get_import_reports({"sklearn": lists, "scikit-learn": lists})
+        # The fork repos, then the files.
+        self.assertEqual(len(queries), 2)
+        # The package names are escaped, and so are the backslashes in the
+        # BigQuery strings.
+        self.assertEqual(queries[0].count(
+            '"sklearn|scikit\\\\-learn"'), 2)
+        self.assertEqual(queries[1].count(
+            '"sklearn|scikit\\\\-learn"'), 1)
+        self.assertTrue('"c/sklearn"' in queries[1])
+
+    def test_import_reports_default_lists(self):
+        a = GithubPython("", False, analysis_cache=False, query_cache=False)
+        a._iter_batches = lambda query, chunk_size=10000: iter(pa.table({
+            "id": ["1"],
+            "content": ["import numpy\nfrom sklearn import svm\n"],
+            "repo_name": ["a/x"], "path": ["x.py"]}).to_batches())
+        reports = a.get_import_reports(["sklearn", "numpy"])
+        self.assertEqual(reports["sklearn"]["SUBMODULE"], [("svm", 1)])
+        # numpy has no default lists, only its repos are counted.
+        self.assertEqual(reports["numpy"]["CLASS"], [])
+        self.assertEqual(reports["numpy"]["REPO"], [("a/x", 1)])
+
+    def test_sample_fraction(self):
+        a = GithubPython("", False, sample_fraction=0.1)
+        self.assertTrue("MOD(ABS(FARM_FINGERPRINT(CONCAT('sample', id))), "
+                        "1000000) < 100000" in a._get_count_query())
+        self.assertEqual(a._get_count_query(),
+                         GithubPython("", False, sample_fraction=0.1)
+                         ._get_count_query())
+        self.assertTrue("CONCAT('sample', id)"
+                        in a._get_snippets_query(["SVC"], 3))
+        self.assertFalse("sample" in GithubPython("", False)
+                         ._get_count_query())
+        with self.assertRaises(ValueError):
+            GithubPython("sklearn", sample_fraction=0)
+
+    def test_create_sample_table(self):
+        a = GithubPython("", False, query_cache=False, sample_fraction=0.1)
+        queries = []
+
+        class JobMock:
+            total_bytes_billed = 10
+            slot_millis = 5
+
+            def result(self):
+                return self
+
+        def start_query(query, query_parameters=None):
+            queries.append(query)
+            return JobMock()
+        a._start_query = start_query
+        self.assertEqual(a.create_sample_table("p.d.sample"), "`p.d.sample`")
+        self.assertEqual(len(queries), 1)
+        self.assertTrue(queries[0].startswith(
+            "CREATE OR REPLACE TABLE `p.d.sample` AS SELECT * FROM "))
+        self.assertTrue("< 100000" in queries[0])
+        self.assertEqual(a.bytes_billed, 10)
+        with self.assertRaises(ValueError):
+            GithubPython("", False).create_sample_table("p.d.sample")
+
+    def test_entries_by_id_single_query(self):
+        a = GithubPython("sklearn", False, query_cache=False)
+        calls = []
+
+        class JobMock:
+            total_bytes_billed = 10
+            slot_millis = 5
+
+            def result(self, page_size=None):
+                return self
+
+            def to_arrow_iterable(self):
+                return iter(pa.table({
+                    "id": ["1"], "content": ["import sklearn\n"],
+                    "repo_name": ["a/x"], "path": ["x.py"]}).to_batches())
+
+        def start_query(query, query_parameters=None):
+            calls.append((query, query_parameters))
+            return JobMock()
+        a._start_query = start_query
+        ids = [str(i) for i in range(2500)]
+        self.assertEqual([entry.id for entry in a._iter_entries_by_id(ids)],
+                         ["1"])
+        self.assertEqual(len(calls), 1)
+        query, parameters = calls[0]
+        self.assertTrue("UNNEST(@ids)" in query)
+        self.assertEqual(parameters[0].values, ids)
+        self.assertEqual(list(a._iter_entries_by_id([])), [])
+        self.assertEqual(len(calls), 1)
+
+    def test_entries_by_id_many_ids(self):
+        a = GithubPython("sklearn", False, query_cache=False)
+        calls = []
+
+        class JobMock:
+            total_bytes_billed = 10
+            slot_millis = 5
+
+            def result(self, page_size=None):
+                return self
+
+            def to_arrow_iterable(self):
+                return iter(pa.table({
+                    "id": ["1", "2", "3"], "content": ["import sklearn\n"] * 3,
+                    "repo_name": ["a/x"] * 3,
+                    "path": ["x.py"] * 3}).to_batches(max_chunksize=2))
+
+        def start_query(query, query_parameters=None):
+            calls.append((query, query_parameters))
+            return JobMock()
+        a._start_query = start_query
+        with mock.patch.object(github_python, "MAX_QUERY_IDS", 2):
+            # Too many ids for one parameter: the ids are split.
+            list(a._iter_entries_by_id(["1", "3", "4"]))
+            self.assertEqual([parameters[0].values
+                              for _, parameters in calls],
+                             [["1", "3"], ["4"]])
+            # Or the files are picked from a query including them.
+            del calls[:]
+            entries = a._iter_entries_by_id(
+                ["1", "3", "4"], superset=a._get_all_query())
+            self.assertEqual([entry.id for entry in entries], ["1", "3"])
+            self.assertEqual(calls, [(a._get_all_query(), None)])
+
+    def test_async_queries_run_concurrently(self):
+        class JobMock:
+            total_bytes_billed = 10
+            slot_millis = 5
+
+            def __init__(self):
+                self.end = time.time() + 0.2
+
+            def done(self):
+                return time.time() >= self.end
+
+            def result(self):
+                return self
+
+            def to_arrow(self):
+                return pa.table({"f0_": [3]})
+
+        self.addCleanup(setattr, github_python, "POLL_INTERVAL",
+                        github_python.POLL_INTERVAL)
+        github_python.POLL_INTERVAL = 0.01
+        a = GithubPython("sklearn", False, query_cache=False)
+        a._start_query = lambda query, query_parameters=None: JobMock()
+
+        async def gather():
+            return await asyncio.gather(*(a.aget_count() for _ in range(10)))
+        start = time.time()
+        self.assertEqual(asyncio.run(gather()), [3] * 10)
+        # The jobs take 0.2 seconds each and run at the same time.
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual(a.bytes_billed, 100)
+
+    def test_narrow_cached_result(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        cache = QueryCache(directory.name, check_tables=False)
+        a = GithubPython("sklearn", False, query_cache=cache)
+
+        def start_query(query, query_parameters=None):
+            raise AssertionError("Query should be answered from the cache")
+        a._start_query = start_query
+        cache.set(a._get_all_query(Contains("sklearn")), a.project, pa.table({
+            "id": ["1", "2", "3"],
+            "content": ["import sklearn", "sklearn.Pipeline",
+                        "sklearn.Pipeline, SVC"],
+            "repo_name": ["a/x", "b/y", "c/z"],
+            "path": ["x.py", "y.py", "z.py"]}))
+        narrow = And(Contains("sklearn"), Contains("Pipeline"))
+        self.assertEqual([entry.id for entry in a.get_all(narrow)],
+                         ["2", "3"])
+        self.assertEqual(a.get_count(And(narrow, Contains("SVC"))), 1)
+        self.assertEqual(a.get_count(Contains("sklearn")), 3)
+        # Regular expressions, and streaming a chunk at a time.
+        regex = And(Contains("sklearn"), Contains(r"\bPipe"))
+        self.assertEqual(a.get_count(regex), 2)
+        self.assertEqual([batch.num_rows for batch in
+                          a._iter_entry_batches(regex, chunk_size=2)],
+                         [1, 1])
+        self.assertEqual([entry.id for entry in a.iter_entries(regex)],
+                         ["2", "3"])
+        # Filters that cannot be evaluated locally are queried.
+
+        class NoCompile(Filter):
+            def __str__(self):
+                return "TRUE"
+        with self.assertRaises(AssertionError):
+            a.get_all(And(Contains("sklearn"), NoCompile()))
+        # A limited result is not the whole superset.
+        a.limit = 10
+        with self.assertRaises(AssertionError):
+            a.get_all(narrow)
+
+    def test_async_query_cache(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        cache = QueryCache(directory.name, check_tables=False)
+        a = GithubPython("sklearn", False, query_cache=cache)
+
+        def start_query(query, query_parameters=None):
+            raise AssertionError("Query should be answered from the cache")
+        a._start_query = start_query
+        # The cache is used from this thread and from worker threads.
+        cache.set(a._get_count_query(), a.project, pa.table({"f0_": [7]}))
+
+        async def gather():
+            return await asyncio.gather(a.aget_count(), a.aget_count())
+        self.assertEqual(asyncio.run(gather()), [7, 7])
+        self.assertEqual(cache.get_stats()["hits"], 2)
+
+    def test_analysis_uses_query_cache(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        a = GithubPython("sklearn", False, analysis_cache=False,
+                         query_cache=QueryCache(directory.name,
+                                                check_tables=False))
+        queries = []
+
+        class JobMock:
+            total_bytes_billed = 10
+            slot_millis = 5
+
+            def result(self, page_size=None):
+                return self
+
+            def to_arrow_iterable(self):
+                return iter(pa.table({
+                    "id": ["1", "2"],
+                    "content": ["from sklearn.svm import SVC\n",
+                                "import sklearn\n"],
+                    "repo_name": ["a/x", "b/y"],
+                    "path": ["x.py", "y.py"]}).to_batches(max_chunksize=1))
+
+        def start_query(query, query_parameters=None):
+            queries.append(query)
+            return JobMock()
+        a._start_query = start_query
+        a.set_class_list(["SVC"])
+        stdout = io.StringIO()
+        with redirect_stdout(stdout):
+            self.assertEqual(a.get_most_imported_class(), [("SVC", 1)])
+        # Progress is only printed with verbose.
+        self.assertEqual(stdout.getvalue(), "")
+        self.assertEqual(a.get_most_imported_class(), [("SVC", 1)])
+        self.assertEqual(len(queries), 1)
+        # Narrower filters are answered from the cached result too.
+        self.assertEqual(a.get_top_import_repo(_filter=Contains("SVC")),
+                         [("a/x", 1)])
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(a.bytes_billed, 10)
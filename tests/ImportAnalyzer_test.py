@@ -1,5 +1,8 @@
+import os
+import tempfile
 import unittest
 from odyssey.core.analyzer.ImportAnalyzer import ImportAnalyzer
+from odyssey.core.bigquery.BigQueryGithubEntry import BigQueryGithubEntry
 from .BigQueryGithubEntry_test import BigQueryGithubEntryMock
 
 
@@ -26,8 +29,8 @@ class TestImportAnalyzer(unittest.TestCase):
 from sklearn.A import B
 """
         a.parse(BigQueryGithubEntryMock(code))
-        self.assertTrue(len(a.counter["A"]) == 1)
-        self.assertTrue(len(a.counter["B"]) == 1)
+        self.assertTrue(a.counter["A"] == 1)
+        self.assertTrue(a.counter["B"] == 1)
 
     def test_parse_test2(self):
         a = ImportAnalyzer("sklearn", ['A', 'B'])
@@ -36,8 +39,8 @@ from sklearn import A
 from sklearn import B
 """
         a.parse(BigQueryGithubEntryMock(code))
-        self.assertTrue(len(a.counter["A"]) == 1)
-        self.assertTrue(len(a.counter["B"]) == 1)
+        self.assertTrue(a.counter["A"] == 1)
+        self.assertTrue(a.counter["B"] == 1)
 
     def test_parse_test3(self):
         a = ImportAnalyzer("sklearn", ['A', 'B'])
@@ -45,8 +48,8 @@ from sklearn import B
 from sklearn import A, B
 """
         a.parse(BigQueryGithubEntryMock(code))
-        self.assertTrue(len(a.counter["A"]) == 1)
-        self.assertTrue(len(a.counter["B"]) == 1)
+        self.assertTrue(a.counter["A"] == 1)
+        self.assertTrue(a.counter["B"] == 1)
 
     def test_parse_test4(self):
         a = ImportAnalyzer("sklearn", ['A', 'B'])
@@ -54,8 +57,8 @@ from sklearn import A, B
 from sklearn import A, B as C
 """
         a.parse(BigQueryGithubEntryMock(code))
-        self.assertTrue(len(a.counter["A"]) == 1)
-        self.assertTrue(len(a.counter["B"]) == 1)
+        self.assertTrue(a.counter["A"] == 1)
+        self.assertTrue(a.counter["B"] == 1)
 
     def test_parse_test5(self):
         a = ImportAnalyzer("sklearn", ['A', 'B'])
@@ -64,8 +67,8 @@ from sklearn import A as X
 from sklearn import B as Y
 """
         a.parse(BigQueryGithubEntryMock(code))
-        self.assertTrue(len(a.counter["A"]) == 1)
-        self.assertTrue(len(a.counter["B"]) == 1)
+        self.assertTrue(a.counter["A"] == 1)
+        self.assertTrue(a.counter["B"] == 1)
 
     def test_parse_test6(self):
         a = ImportAnalyzer("sklearn", ['A', 'B'])
@@ -74,8 +77,8 @@ import sklearn.A
 import sklearn.B
 """
         a.parse(BigQueryGithubEntryMock(code))
-        self.assertTrue(len(a.counter["A"]) == 1)
-        self.assertTrue(len(a.counter["B"]) == 1)
+        self.assertTrue(a.counter["A"] == 1)
+        self.assertTrue(a.counter["B"] == 1)
 
     def test_parse_test7(self):
         a = ImportAnalyzer("sklearn", ['A', 'B'])
@@ -84,5 +87,53 @@ import sklearn.A as X
 import sklearn.B as Y
 """
         a.parse(BigQueryGithubEntryMock(code))
-        self.assertTrue(len(a.counter["A"]) == 1)
-        self.assertTrue(len(a.counter["B"]) == 1)
+        self.assertTrue(a.counter["A"] == 1)
+        self.assertTrue(a.counter["B"] == 1)
+
+    def test_get_source(self):
+        codes = {str(i): "from sklearn import A\n" for i in range(5)}
+        a = ImportAnalyzer("sklearn", ['A'], loader=lambda ids: [
+            BigQueryGithubEntry(_id, codes[_id], "r", "p") for _id in ids])
+        for _id, code in codes.items():
+            a.parse(BigQueryGithubEntry(_id, code, "r", "p"))
+        self.assertEqual(a.counter["A"], 5)
+        # only the id, repo name and path are kept
+        self.assertIsNone(a._files[0].code)
+        self.assertEqual([e.id for e in a.get_source("A", page=1,
+                                                     page_size=2)],
+                         ["2", "3"])
+        self.assertEqual(a.get_source("A")[4].code, codes["4"])
+        self.assertEqual(a.get_source("B"), [])
+
+    def test_qualified(self):
+        a = ImportAnalyzer("sklearn", ['LogisticRegression',
+                                       'sklearn.metrics.auc'])
+        code = """\
+from sklearn.linear_model import LogisticRegression
+from sklearn.other import auc
+"""
+        a.parse(BigQueryGithubEntryMock(code))
+        a.parse(BigQueryGithubEntryMock("from sklearn.metrics import auc\n"))
+        self.assertEqual(a.get_most_common(),
+                         [("LogisticRegression", 1), ("auc", 1)])
+        self.assertEqual(a.get_most_common(qualified=True),
+                         [("sklearn.linear_model.LogisticRegression", 1),
+                          ("sklearn.metrics.auc", 1)])
+        self.assertEqual(len(a.get_source("sklearn.metrics.auc",
+                                          qualified=True)), 1)
+
+    def test_save_load_merge(self):
+        a = ImportAnalyzer("sklearn", ['A', 'B'])
+        a.parse(BigQueryGithubEntryMock("from sklearn import A, B\n"))
+        b = ImportAnalyzer("sklearn", ['A', 'B'])
+        b.parse(BigQueryGithubEntryMock("from sklearn.A import B\n"))
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "a.json.gz")
+            a.save(path)
+            loaded = ImportAnalyzer.load(path)
+        self.assertEqual(loaded.get_most_common(), a.get_most_common())
+        self.assertIs(loaded.merge(b), loaded)
+        self.assertEqual(loaded.counter, {"A": 2, "B": 2})
+        self.assertEqual(len(loaded.get_source("B")), 2)
+        self.assertEqual(loaded.get_source("A")[0].repo_name,
+                         'abhi252/GloVeGraphs')
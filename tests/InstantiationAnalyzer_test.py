@@ -0,0 +1,49 @@
+import unittest
+from odyssey.core.analyzer.AnalyzerPipeline import _FileTree, _walk
+from odyssey.core.analyzer.InstantiationAnalyzer import InstantiationAnalyzer
+from odyssey.utils.parse import parso_parse
+
+
+def tree_pairs(analyzer, code):
+    analyzer._start()
+    _walk(parso_parse(code), {'name': [analyzer]})
+    return analyzer._pairs
+
+
+class TestInstantiationAnalyzer(unittest.TestCase):
+
+    def test_parse(self):
+        a = InstantiationAnalyzer("SVC")
+        a.parse("clf = SVC(C=1, kernel='rbf')\n")
+        self.assertEqual(a.d["C"]["1"], 1)
+        self.assertEqual(a.d["kernel"]["'rbf'"], 1)
+        self.assertEqual(a.counter, 2)
+
+    def test_scan_matches_tree(self):
+        codes = [
+            'clf = make_pipeline(Scaler(),\n    SVC(C=1,\n'
+            '        gamma=0.1))  # SVC(C=2)\n',
+            '"""SVC(C=3)"""\nx = [SVC(C=SVC(C=4)), svm.SVC(C=5)]\n',
+            'def SVC(C=6):\n    pass\n@SVC(C=7)\ndef f(): pass\n',
+            'SVC(C=")")\nSVC(C=(1, 2))\nSVC()\nSVC(x)\n',
+            'print "py2"\nclf = SVC(C=8)\n',
+            'clf = SVC(C=9\n',
+            'print(f"{SVC(C=10)}")\n',
+            '# Train the classifier.\nSVC(C=11).fit(X, y)\n',
+            'def f(): pass\nSVC(C=12)\nx = svm. \\\n    SVC(C=13)\n',
+            # A good call before one that falls back to the whole file.
+            'SVC(C=14)\nSVC(C=)\n',
+            'SVC(C=15)\nx = f"{SVC(C=16)}"\n',
+        ]
+        for code in codes:
+            a = InstantiationAnalyzer("SVC")
+            self.assertEqual(a._scan(code), tree_pairs(a, code), code)
+            tree = _FileTree(code)
+            self.assertEqual(a._scan(code, tree), tree_pairs(a, code), code)
+
+    def test_scan_uses_file_tree(self):
+        code = 'SVC(C=1)\nSVC(C=)\n'
+        tree = _FileTree(code)
+        InstantiationAnalyzer("SVC")._scan(code, tree)
+        # The fallback parses the file in the shared tree.
+        self.assertIsNotNone(tree._tree)
@@ -0,0 +1,130 @@
+import asyncio
+import unittest
+from odyssey.core.bigquery.GithubPython import GithubPython
+from odyssey.core.bigquery.LocalCorpus import LocalCorpus, in_sample
+from odyssey.core.bigquery.filter import Contains, And
+
+
+def LocalCorpusMock():
+    corpus = LocalCorpus(":memory:")
+    corpus.add_files([
+        ("1", "from sklearn.svm import SVC\nclf = SVC(C=1)\n", "a/x", "x.py"),
+        ("2", "import sklearn.tree\nclf = SVC(C=2)\n", "b/y", "y.py"),
+        ("3", "from sklearn.svm import SVC\nSVC(C=1)\n", "c/sklearn", "z.py"),
+        ("4", "import numpy\n", "d/w", "w.py"),
+    ])
+    corpus.add_all_files([("a/x", "x.py"), ("c/sklearn", "z.py")])
+    return corpus
+
+
+class TestLocalCorpus(unittest.TestCase):
+
+    def test_iter_rows(self):
+        corpus = LocalCorpusMock()
+        self.assertEqual(len(list(corpus.iter_rows())), 4)
+        self.assertEqual([row[0] for row in corpus.iter_rows("sklearn")],
+                         ["1", "2", "3"])
+        self.assertEqual([row[0] for row in corpus.iter_rows(
+            "sklearn", And(Contains("SVC"), Contains("tree")))], ["2"])
+        self.assertEqual([row[0] for row in corpus.iter_rows(
+            "sklearn", excluded_repos=["c/sklearn"], limit=1)], ["1"])
+        self.assertEqual(corpus.get_fork_repos(["sklearn"]), ["c/sklearn"])
+
+    def test_get_snippets(self):
+        corpus = LocalCorpus(":memory:")
+        code = "a = 1\nclf = SVC(C=1,\n    gamma=2)\nb = 2\nc = 3\nSVC(C=3)\n"
+        corpus.add_files([("1", code, "a/x", "x.py")])
+        self.assertEqual(corpus.get_snippets("SVC", window=1),
+                         [("1", "a/x", "x.py", 2, 1,
+                           "a = 1\nclf = SVC(C=1,\n    gamma=2)"),
+                          ("1", "a/x", "x.py", 6, 5, "c = 3\nSVC(C=3)\n")])
+        gp = GithubPython("", exclude_forks=None, analysis_cache=False,
+                          corpus=corpus)
+        context = gp.get_context("SVC", window=0)
+        self.assertEqual(list(context["line"]), [2, 6])
+        self.assertEqual(list(context["snippet"]),
+                         ["clf = SVC(C=1,", "SVC(C=3)"])
+        # overlapping snippets are merged, so calls are only counted once
+        instantiation = gp.get_instantiation("SVC", window=3)
+        self.assertEqual(dict(instantiation["C"]), {"1": 1, "3": 1})
+        self.assertEqual(dict(instantiation["gamma"]), {"2": 1})
+
+    def test_github_python(self):
+        gp = GithubPython("sklearn", analysis_cache=False,
+                          corpus=LocalCorpusMock())
+        self.assertEqual([entry.id for entry in gp.get_all()], ["1", "2"])
+        self.assertEqual(gp.get_count(Contains("tree")), 1)
+        self.assertEqual(gp.get_top_import_repo(),
+                         [("a/x", 1), ("b/y", 1)])
+        gp.set_class_list(["SVC"])
+        self.assertEqual(gp.get_most_imported_class(), [("SVC", 1)])
+        sources = gp.get_import_source("SVC")
+        self.assertEqual([entry.path for entry in sources], ["x.py"])
+        self.assertEqual(gp.get_import_source("SVC", page=1), [])
+        instantiation = gp.get_instantiation("SVC")
+        self.assertEqual(dict(instantiation["C"]), {"1": 1, "2": 1})
+        instantiations = gp.get_instantiations(["SVC", "KMeans"])
+        self.assertEqual(instantiations["SVC"], instantiation)
+        self.assertEqual(instantiations["KMeans"], {})
+
+    def test_github_python_async(self):
+        gp = GithubPython("sklearn", analysis_cache=False,
+                          corpus=LocalCorpusMock())
+
+        async def gather():
+            return await asyncio.gather(
+                gp.aget_all(), gp.aget_count(Contains("tree")),
+                gp.aget_context("SVC", window=0), gp.aget_instantiation("SVC"))
+        entries, count, context, instantiation = asyncio.run(gather())
+        self.assertEqual([entry.id for entry in entries], ["1", "2"])
+        self.assertEqual(count, 1)
+        self.assertEqual(list(context["line"]), [1, 2, 2])
+        self.assertEqual(instantiation, gp.get_instantiation("SVC"))
+
+    def test_get_import_reports(self):
+        gp = GithubPython("", exclude_forks=None, analysis_cache=False,
+                          corpus=LocalCorpusMock())
+        lists = {"CLASS": ["SVC"], "SUBMODULE": ["tree"],
+                 "FUNCTION": ["auc"]}
+        reports = gp.get_import_reports({"sklearn": lists,
+                                         "numpy": dict(lists, CLASS=[])})
+        self.assertEqual(reports["sklearn"]["CLASS"], [("SVC", 2)])
+        self.assertEqual(reports["sklearn"]["SUBMODULE"], [("tree", 1)])
+        self.assertEqual(len(reports["sklearn"]["REPO"]), 3)
+        self.assertEqual(reports["numpy"]["REPO"], [("d/w", 1)])
+        self.assertEqual(gp.package, "")
+        single = GithubPython("sklearn", exclude_forks=None,
+                              analysis_cache=False, corpus=LocalCorpusMock())
+        single.set_class_list(["SVC"])
+        single.set_submodule_list(["tree"])
+        single.set_function_list(["auc"])
+        self.assertEqual(single.get_import_report(), reports["sklearn"])
+
+    def test_pushdown_engine(self):
+        gp = GithubPython("sklearn", analysis_cache=False,
+                          corpus=LocalCorpusMock(), import_engine="pushdown")
+        gp.set_class_list(["SVC"])
+        gp.set_submodule_list(["tree", "svm"])
+        self.assertEqual(gp.get_most_imported_class(), [("SVC", 1)])
+        self.assertEqual(gp.get_most_imported_submodule(),
+                         [("svm", 1), ("tree", 1)])
+        self.assertEqual(gp.compare_import_engines("SUBMODULE"), [])
+
+    def test_sample_fraction(self):
+        corpus = LocalCorpus(":memory:")
+        corpus.add_files([(str(i), "import sklearn\n", "r/%d" % i, "x.py")
+                          for i in range(1000)])
+        sampled = [row[0] for row in corpus.iter_rows(sample_fraction=0.2)]
+        self.assertEqual(sampled, [str(i) for i in range(1000)
+                                   if in_sample(str(i), 0.2)])
+        self.assertTrue(150 < len(sampled) < 250)
+        self.assertEqual(len(list(corpus.iter_rows(sample_fraction=1))), 1000)
+        gp = GithubPython("sklearn", exclude_forks=None, analysis_cache=False,
+                          corpus=corpus, sample_fraction=0.2)
+        count = gp.get_count()
+        self.assertEqual(count.sample_count, len(sampled))
+        self.assertEqual(count, round(len(sampled) / 0.2))
+        self.assertTrue(count.low <= 1000 <= count.high)
+        top_repo = gp.get_top_import_repo(1)
+        self.assertEqual(top_repo[0][1], 5)
+        self.assertEqual(top_repo[0][1].sample_count, 1)
@@ -0,0 +1,86 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+import pyarrow as pa
+from odyssey.core.analyzer import AnalysisCache
+from odyssey.core.bigquery.QueryCache import QueryCache, _get_tables
+
+
+class TestQueryCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_get_set(self):
+        cache = QueryCache(self.directory.name, check_tables=False)
+        result = pa.table({"id": ["1", "2"], "count": [3, 4]})
+        self.assertIsNone(cache.get("SELECT 1", "p"))
+        cache.set("SELECT 1", "p", result)
+        self.assertTrue(cache.get("SELECT 1", "p").equals(result))
+        self.assertIsNone(cache.get("SELECT 1", "q"))
+        stats = cache.get_stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 2))
+        self.assertEqual(stats["entries"], 1)
+        self.assertEqual(stats["size"], stats["bytes_written"])
+        self.assertEqual(stats["size"], stats["bytes_read"])
+
+    def test_set_batches(self):
+        cache = QueryCache(self.directory.name, check_tables=False)
+        result = pa.table({"id": ["1", "2", "3"]})
+        batches = cache.set_batches("a", "p",
+                                    result.to_batches(max_chunksize=2))
+        # Nothing is stored until the whole result was streamed.
+        next(batches)
+        self.assertIsNone(cache.get_batches("a", "p"))
+        self.assertEqual(len(list(batches)), 1)
+        self.assertEqual([len(batch) for batch
+                          in cache.get_batches("a", "p", chunk_size=1)],
+                         [1, 1, 1])
+        self.assertTrue(cache.get("a", "p").equals(result))
+        # A result that is not streamed to the end is not stored.
+        batches = cache.set_batches("b", "p", result.to_batches(1))
+        next(batches)
+        batches.close()
+        self.assertEqual(len(cache), 1)
+        self.assertFalse([name for name in os.listdir(self.directory.name)
+                          if name.endswith(".tmp")])
+
+    def test_lru_eviction(self):
+        cache = QueryCache(self.directory.name, check_tables=False)
+        result = pa.table({"id": ["1"]})
+        cache.set("a", "p", result)
+        cache.max_size = 2.5 * cache.get_size()
+        cache.set("b", "p", result)
+        cache.get("a", "p")
+        cache.set("c", "p", result)
+        # "b" is the least recently used
+        self.assertIsNone(cache.get("b", "p"))
+        self.assertIsNotNone(cache.get("a", "p"))
+        self.assertIsNotNone(cache.get("c", "p"))
+
+    def test_modified_table(self):
+        cache = QueryCache(self.directory.name)
+        modified = {"d.t": 1.0}
+        cache._get_modified = lambda table, project: modified[table]
+        query = "SELECT id FROM `d.t`"
+        self.assertEqual(_get_tables(query), ["d.t"])
+        cache.set(query, "p", pa.table({"id": ["1"]}))
+        self.assertIsNotNone(cache.get(query, "p"))
+        modified["d.t"] = 2.0
+        self.assertIsNone(cache.get(query, "p"))
+        self.assertEqual(len(cache), 0)
+
+    def test_default_directory(self):
+        with mock.patch.dict(os.environ,
+                             {"ODYSSEY_CACHE_DIR": self.directory.name}):
+            self.assertEqual(QueryCache().directory,
+                             os.path.join(self.directory.name, "queries"))
+            self.assertEqual(AnalysisCache().path,
+                             os.path.join(self.directory.name,
+                                          "analysis.sqlite"))
+        with mock.patch.dict(os.environ, {"ODYSSEY_CACHE_DIR": "",
+                                          "XDG_CACHE_HOME": "/cache"}):
+            self.assertEqual(QueryCache().directory,
+                             os.path.join("/cache", "odyssey", "queries"))
@@ -0,0 +1,56 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+from odyssey.core.analyzer import InstantiationAnalyzer
+from odyssey.core.bigquery.GithubPython import GithubPython
+from odyssey.core.bigquery.LocalCorpus import LocalCorpus
+from odyssey.core.bigquery.ShardedRunner import ShardedRunner
+from odyssey.utils.cache_dir import CACHE_DIR_VARIABLE
+from .LocalCorpus_test import LocalCorpusMock
+
+
+class TestShardedRunner(unittest.TestCase):
+
+    def test_run(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "corpus.sqlite")
+            corpus = LocalCorpus(path)
+            mock = LocalCorpusMock()
+            corpus.add_files(mock.iter_rows())
+            corpus.add_all_files([("c/sklearn", "z.py")])
+            runner = ShardedRunner.create(
+                os.path.join(tmp, "manifest.json"), 3, "sklearn",
+                class_list=["SVC"], submodule_list=["svm", "tree"],
+                function_list=[], instantiations=["SVC"],
+                analysis_cache=False, corpus=path)
+            result = runner.run(n_jobs=2)
+            self.assertTrue(os.path.exists(os.path.join(tmp,
+                                                        "manifest-2.json.gz")))
+
+            gp = GithubPython("sklearn", analysis_cache=False, corpus=corpus)
+            gp.set_class_list(["SVC"])
+            gp.set_submodule_list(["svm", "tree"])
+            gp.set_function_list([])
+            report = gp.get_import_report()
+            for key in ("CLASS", "SUBMODULE", "FUNCTION", "REPO"):
+                self.assertEqual(sorted(result[key].get_most_common()),
+                                 sorted(report[key]))
+            self.assertEqual(result["CLASS"].get_source("SVC")[0].code,
+                             gp.get_import_source("SVC")[0].code)
+            ia = InstantiationAnalyzer("SVC")
+            ia.parse_all(entry.code for entry in gp.iter_entries())
+            self.assertEqual(result["SVC"].d, ia.d)
+
+    def test_shard_caches(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            runner = ShardedRunner.create(os.path.join(tmp, "manifest.json"),
+                                          2, "sklearn")
+            with mock.patch.dict(os.environ, {CACHE_DIR_VARIABLE: tmp}):
+                paths = [runner._get_cache(i).path for i in range(2)]
+            self.assertEqual(paths, [
+                os.path.join(tmp, "analysis-shard-0-of-2.sqlite"),
+                os.path.join(tmp, "analysis-shard-1-of-2.sqlite")])
+            runner = ShardedRunner.create(os.path.join(tmp, "manifest.json"),
+                                          2, "sklearn", analysis_cache=False)
+            self.assertFalse(runner._get_cache(0))
@@ -0,0 +1,18 @@
+import unittest
+from odyssey.core.analyzer.SymbolIndex import SymbolIndex
+
+
+class TestSymbolIndex(unittest.TestCase):
+
+    def test_resolve(self):
+        index = SymbolIndex(["SVC", "sklearn.metrics.auc", "sklearn.tree"])
+        self.assertEqual(len(index), 3)
+        self.assertEqual(index.resolve(["sklearn", "svm", "SVC"]),
+                         "sklearn.svm.SVC")
+        self.assertEqual(index.resolve(["sklearn", "metrics", "auc"]),
+                         "sklearn.metrics.auc")
+        self.assertIsNone(index.resolve(["sklearn", "other", "auc"]))
+        self.assertIsNone(index.resolve(["sklearn", "metrics"]))
+        self.assertTrue("sklearn.tree" in index)
+        self.assertTrue("SVC" in index)
+        self.assertFalse("auc" in index)
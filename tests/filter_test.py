@@ -0,0 +1,45 @@
+import unittest
+from odyssey.core.bigquery.filter import And, Contains, Filter, Or
+from .BigQueryGithubEntry_test import BigQueryGithubEntryMock
+
+
+class TestFilter(unittest.TestCase):
+
+    def test_compile(self):
+        match = And(Contains("SVC"), Or(Contains("tree"),
+                                        Contains(r"grid\w+"))).compile()
+        self.assertTrue(match("SVC, tree"))
+        self.assertTrue(match("SVC, grid_search"))
+        self.assertFalse(match("SVC, grid"))
+        self.assertFalse(match("tree"))
+        self.assertTrue(Contains("a.c").compile()("abc"))
+        self.assertFalse(Contains("a b").compile()("ab"))
+
+    def test_short_circuit(self):
+        calls = []
+
+        class Recorded(Contains):
+            def compile(self):
+                search = Contains.compile(self)
+                return lambda code: calls.append(self.s) or search(code)
+        Or(Recorded("a"), Or(Recorded("b"), Recorded("c"))).compile()("b")
+        self.assertEqual(calls, ["a", "b"])
+
+    def test_filter_entries(self):
+        entries = [BigQueryGithubEntryMock(code) for code in
+                   ["from sklearn.svm import SVC\n", "import os\n"]]
+        self.assertEqual(list(Contains("SVC").filter_entries(entries)),
+                         entries[:1])
+
+    def test_compile_returns_bool(self):
+        self.assertIs(Contains(r"\bSVC").compile()("SVC()"), True)
+        self.assertIs(Contains(r"\bSVC").compile()("LinearSVC()"), False)
+        self.assertIs(Contains("SVC").compile()("SVC()"), True)
+
+    def test_compile_default(self):
+        # Filters without compile can be created, but not run locally.
+        class NoCompile(Filter):
+            def __str__(self):
+                return "TRUE"
+        with self.assertRaises(NotImplementedError):
+            And(Contains("SVC"), NoCompile()).compile()
@@ -0,0 +1,56 @@
+import unittest
+from odyssey.utils.imports import (get_import_records, get_imported_paths,
+                                   get_imported_values, imports_package,
+                                   scan_import_records)
+from odyssey.utils.parse import parso_parse
+
+
+def tree_import_records(code):
+    records = []
+    stack = [parso_parse(code)]
+    while stack:
+        node = stack.pop()
+        if node.type in ('import_from', 'import_name'):
+            records.extend(get_import_records(node))
+        elif hasattr(node, 'children'):
+            stack.extend(reversed(node.children))
+    return records
+
+
+class TestImports(unittest.TestCase):
+
+    def test_imported_values(self):
+        record = ["from", ["sklearn", "A"], ["B", "*"]]
+        self.assertEqual(get_imported_values(record, "sklearn"),
+                         ["sklearn", "A", "B"])
+        record = ["import", ["sklearn", "A"], []]
+        self.assertEqual(get_imported_values(record, "sklearn"), ["A"])
+        self.assertEqual(get_imported_values(record, "numpy"), [])
+        self.assertEqual(get_imported_paths(record, "sklearn"),
+                         [["sklearn", "A"]])
+        record = ["from", ["sklearn", "A"], ["B", "*"]]
+        self.assertEqual(get_imported_paths(record, "sklearn"),
+                         [["sklearn"], ["sklearn", "A"],
+                          ["sklearn", "A", "B"]])
+        self.assertTrue(imports_package(["import", ["sklearn"], []],
+                                        "sklearn"))
+
+    def test_scan_matches_tree(self):
+        codes = [
+            '"""\nfrom sklearn.svm import SVC\n"""\nimport sklearn.tree\n',
+            'try: import sklearn.A\nexcept: from sklearn import B as C\n',
+            'import os; import sklearn.B; from sklearn.C import (D,\n'
+            '    E as F,  # comment\n)\n',
+            'from sklearn.A import \\\n    B\n',
+            'from . import A\nfrom ..B import C\n',
+            'from sklearn import *\nfrom sklearn.A import *\n',
+            'print "hello"\nimport sklearn.A\n',
+            'x = (yield\n     from gen)\n',
+            'def f():\n    import sklearn.A as B, os.path\n',
+            "s = '# import sklearn.A'; import sklearn.B\n",
+            'from sklearn import (A\n',
+            'from sklearn import None\n',
+        ]
+        for code in codes:
+            self.assertEqual(scan_import_records(code),
+                             tree_import_records(code), code)
@@ -0,0 +1,46 @@
+import unittest
+from odyssey.core.analyzer import AnalyzerPipeline, ImportAnalyzer
+from odyssey.utils.pushdown import (count_imports, get_import_count_query,
+                                    get_line_import_paths)
+from .BigQueryGithubEntry_test import BigQueryGithubEntryMock
+
+
+class TestPushdown(unittest.TestCase):
+
+    def test_line_import_paths(self):
+        self.assertEqual(get_line_import_paths(
+            "from sklearn.svm import SVC, LinearSVC as L\n", "sklearn"),
+            {"sklearn", "sklearn.svm", "sklearn.svm.SVC",
+             "sklearn.svm.LinearSVC"})
+        self.assertEqual(get_line_import_paths(
+            "import sklearn.tree as t, os\nimport sklearn\n", "sklearn"),
+            {"sklearn.tree"})
+        self.assertEqual(get_line_import_paths(
+            "from sklearn import (svm,\n    tree)\nfrom .a import b\n"
+            "from sklearn import *\n", "sklearn"),
+            {"sklearn.svm", "sklearn.tree"})
+
+    def test_matches_import_analyzer(self):
+        # Cases 1-7 of the import statements ImportAnalyzer handles.
+        codes = ["from sklearn.svm import SVC\n",
+                 "from sklearn import svm\n",
+                 "from sklearn import svm, tree\n",
+                 "from sklearn import svm, tree as t\n",
+                 "from sklearn import svm as s\n",
+                 "import sklearn.svm\n",
+                 "import sklearn.svm as s\n",
+                 BigQueryGithubEntryMock().code]
+        accepted = ["SVC", "svm", "tree", "KMeans", "sklearn.cluster"]
+        ia = ImportAnalyzer("sklearn", accepted)
+        AnalyzerPipeline([ia]).run(BigQueryGithubEntryMock(code)
+                                   for code in codes)
+        values, qualified = count_imports(codes, "sklearn", accepted)
+        self.assertEqual(values, ia.counter)
+        self.assertEqual(qualified, ia.qualified_counter)
+
+    def test_query(self):
+        query = get_import_count_query("SELECT id, content FROM t",
+                                       "sklearn", ["SVC", "sklearn.svm"])
+        self.assertTrue("SELECT id, content FROM t" in query)
+        self.assertTrue("IN UNNEST(ARRAY<STRING>['SVC'])" in query)
+        self.assertTrue("IN UNNEST(ARRAY<STRING>['sklearn.svm'])" in query)
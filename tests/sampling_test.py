@@ -0,0 +1,34 @@
+import pickle
+import unittest
+from odyssey.utils.sampling import (Estimate, sample_bucket, scale_count,
+                                    scale_counts)
+
+
+class TestSampling(unittest.TestCase):
+
+    def test_scale_count(self):
+        estimate = scale_count(100, 0.1)
+        self.assertEqual(estimate, 1000)
+        self.assertEqual(estimate.sample_count, 100)
+        # 1.96 * sqrt(100 * 0.9) / 0.1 = 185.9
+        self.assertEqual((estimate.low, estimate.high), (814, 1186))
+        # the lower bound is never below the count in the sample
+        self.assertEqual(scale_count(1, 0.01).low, 1)
+        exact = scale_count(5, 1)
+        self.assertEqual((exact, exact.low, exact.high), (5, 5, 5))
+        self.assertEqual(scale_count(0, 0.5).high, 0)
+
+    def test_estimate(self):
+        estimate = Estimate(10, 8, 12, 5)
+        self.assertEqual(estimate + 1, 11)
+        self.assertEqual(repr(estimate), "Estimate(10, low=8, high=12)")
+        loaded = pickle.loads(pickle.dumps(estimate))
+        self.assertEqual((loaded, loaded.low, loaded.high,
+                          loaded.sample_count), (10, 8, 12, 5))
+        self.assertEqual(scale_counts([("SVC", 3)], 0.5), [("SVC", 6)])
+
+    def test_sample_bucket(self):
+        self.assertEqual(sample_bucket(0.25), 250000)
+        self.assertEqual(sample_bucket(1), 1000000)
+        with self.assertRaises(ValueError):
+            sample_bucket(1.5)